@@ -38,28 +38,98 @@ class AccountApiClient(object):
             session = requests.Session()
         self.session = session
 
-    def _api_request(self, method, params):
+    def _post(self, data):
         url = "%s/api/" % (self.api_url,)
         headers = {
             "Content-Type": "application/json; charset=utf-8",
             "Authorization": "Bearer %s" % (self.auth_token,),
         }
+        r = self.session.post(url, data=json.dumps(data), headers=headers)
+        r.raise_for_status()
+        return r.json()
+
+    def _rpc_exception(self, rpc_error):
+        return JsonRpcException(
+            fault=rpc_error['fault'], fault_code=rpc_error['faultCode'],
+            fault_string=rpc_error['faultString'])
+
+    def _api_request(self, method, params):
         data = {
             "method": method,
             "params": params,
             "jsonrpc": "2.0",
             "id": 0,
         }
-        r = self.session.post(url, data=json.dumps(data), headers=headers)
-        r.raise_for_status()
-        rpc_response = r.json()
+        rpc_response = self._post(data)
         rpc_error = rpc_response['error']
         if rpc_error is not None:
-            raise JsonRpcException(
-                fault=rpc_error['fault'], fault_code=rpc_error['faultCode'],
-                fault_string=rpc_error['faultString'])
+            raise self._rpc_exception(rpc_error)
         return rpc_response['result']
 
+    def batch(self, calls):
+        """
+        Make several API calls in a single JSON-RPC batch request.
+
+        :param list calls:
+            A list of ``(method, params)`` pairs, e.g.
+            ``[("channels", [campaign_id]), ("routers", [campaign_id])]``.
+
+        :return:
+            A list with the result of each call, in the order of ``calls``.
+            Calls that failed have a :class:`JsonRpcException` in place of
+            their result.
+
+        :raises JsonRpcException:
+            If the whole batch was rejected.
+        """
+        if not calls:
+            return []
+        data = [{
+            "method": method,
+            "params": params,
+            "jsonrpc": "2.0",
+            "id": call_id,
+        } for call_id, (method, params) in enumerate(calls)]
+        rpc_response = self._post(data)
+        if isinstance(rpc_response, dict):
+            raise self._rpc_exception(rpc_response['error'])
+        responses = dict(
+            (response.get('id'), response) for response in rpc_response)
+        results = []
+        for call_id in range(len(calls)):
+            response = responses.get(call_id)
+            if response is None:
+                results.append(JsonRpcException(
+                    fault="Fault", fault_code=-32603,
+                    fault_string="No response for call %d." % (call_id,)))
+            elif response.get('error') is not None:
+                results.append(self._rpc_exception(response['error']))
+            else:
+                results.append(response['result'])
+        return results
+
+    def overview(self, campaign_id):
+        """
+        Return the conversations, channels, routers and routing entries for
+        the campaign, fetched with a single batch request.
+
+        :param str campaign_id:
+            The campaign or account id.
+
+        :return:
+            A dict with ``conversations``, ``channels``, ``routers`` and
+            ``routing_entries`` keys.
+
+        :raises JsonRpcException:
+            If any of the calls failed.
+        """
+        names = ["conversations", "channels", "routers", "routing_entries"]
+        results = self.batch([(name, [campaign_id]) for name in names])
+        for result in results:
+            if isinstance(result, JsonRpcException):
+                raise result
+        return dict(zip(names, results))
+
     def campaigns(self):
         """
         Return a list of campaigns accessible by the account.
@@ -0,0 +1,130 @@
+"""
+Normalization of message addresses.
+
+The same address can be written in several ways (e.g. ``0821234567``,
+``27821234567`` and ``+27 82 123 4567``), which defeats caches and
+snapshots keyed by address. :class:`AddressNormalizer` converts addresses to
+a canonical form and remembers recent results.
+"""
+
+import re
+
+try:
+    from urllib import quote
+except ImportError:  # Python 3
+    from urllib.parse import quote
+
+from go_http.cache import TTLCache
+
+
+_MSISDN_FORMATTING = re.compile(r"[\s().\-]")
+
+_DIGITS = re.compile(r"^\d+$")
+
+CASE_INSENSITIVE_TYPES = frozenset([u"twitter_handle", u"gtalk_id"])
+
+
+class AddressNormalizer(object):
+    """
+    Converts addresses to a canonical form.
+
+    MSISDNs are converted to E.164 (e.g. ``+27821234567``) by removing
+    spaces, dashes, dots and brackets and replacing a leading ``00`` with
+    ``+``. If a ``default_country_code`` is given, a leading ``0`` is
+    replaced with it and numbers that start with it are given a ``+``.
+    Other addresses are stripped of surrounding whitespace, and addresses
+    of case-insensitive types (e.g. Twitter handles) are lowercased.
+    Addresses may be text or UTF-8 encoded bytes; the result is text.
+
+    :param str default_country_code:
+        The country calling code for numbers in national format, e.g.
+        ``'27'``. Optional.
+    :param int max_size:
+        The maximum number of results to remember. Defaults to ``10000``.
+    :param case_insensitive_types:
+        The address types to lowercase. Defaults to
+        :data:`CASE_INSENSITIVE_TYPES` (``twitter_handle`` and
+        ``gtalk_id``).
+    """
+
+    def __init__(self, default_country_code=None, max_size=10000,
+                 case_insensitive_types=CASE_INSENSITIVE_TYPES):
+        self.default_country_code = default_country_code
+        self.case_insensitive_types = frozenset(case_insensitive_types)
+        self._cache = TTLCache(max_size=max_size, ttl=float('inf'))
+
+    def __repr__(self):
+        return "<AddressNormalizer default_country_code=%r>" % (
+            self.default_country_code,)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups answered from the cache.
+        """
+        return self._cache.hit_rate
+
+    def _normalize_msisdn(self, address):
+        number = _MSISDN_FORMATTING.sub("", address)
+        international = number.startswith("+")
+        if international:
+            number = number[1:]
+        if not _DIGITS.match(number):
+            return address
+        if international:
+            return "+" + number
+        if number.startswith("00"):
+            return "+" + number[2:]
+        country_code = self.default_country_code
+        if country_code is not None:
+            if number.startswith("0"):
+                return "+" + country_code + number[1:]
+            if number.startswith(country_code):
+                return "+" + number
+        return number
+
+    def _lookup(self, address_type, address):
+        key = (address_type, address)
+        result = self._cache.get(key)
+        if result is None:
+            normalized = address
+            if isinstance(normalized, bytes):
+                normalized = normalized.decode("utf-8")
+            normalized = normalized.strip()
+            if address_type == "msisdn":
+                normalized = self._normalize_msisdn(normalized)
+            elif address_type in self.case_insensitive_types:
+                normalized = normalized.lower()
+            quoted = quote(normalized.encode("utf-8"), safe="")
+            result = (normalized, quoted)
+            self._cache.set(key, result)
+        return result
+
+    def normalize(self, address_type, address):
+        """
+        Return the canonical form of an address.
+
+        :param str address_type:
+            Type of address, e.g. `msisdn`.
+        :param str address:
+            The address to normalize.
+        """
+        return self._lookup(address_type, address)[0]
+
+    def quote(self, address_type, address):
+        """
+        Return the canonical form of an address, quoted for use as a URL
+        path segment.
+        """
+        return self._lookup(address_type, address)[1]
+
+
+DEFAULT_NORMALIZER = AddressNormalizer()
+
+
+def normalize_address(address_type, address):
+    """
+    Normalize an address with the default :class:`AddressNormalizer`, which
+    has no default country code.
+    """
+    return DEFAULT_NORMALIZER.normalize(address_type, address)
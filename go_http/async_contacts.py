@@ -0,0 +1,264 @@
+"""
+Asyncio client for Vumi Go's contacts API.
+
+Requests are made by a :class:`ContactsApiClient` running in a thread pool
+that shares a single connection pool, so many requests (including several
+paginated downloads) can be in flight at once from one event loop.
+
+This module requires Python 3.
+"""
+
+import collections
+import functools
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2
+    asyncio = None
+
+import requests
+
+from go_http.contacts import ContactsApiClient
+
+
+class _AsyncContactIterator(object):
+    """
+    Async iterator over a paginated contact download.
+
+    Contacts are pulled from the underlying synchronous iterator in batches
+    on a worker thread. If the download fails part way through a batch, the
+    contacts received before the failure are returned before the exception
+    (e.g. a :class:`PagedException`) is raised. If a caller stops waiting
+    (e.g. it is cancelled by :func:`asyncio.wait_for`), the batch it was
+    waiting for is kept for the next call.
+    """
+
+    def __init__(self, client, contacts, batch_size):
+        self._client = client
+        self._contacts = contacts
+        self._batch_size = batch_size
+        self._buffer = collections.deque()
+        self._error = None
+        self._done = False
+        self._batch = None
+        self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self._client._get_loop().create_future()
+        if not self._resolve(future):
+            self._waiter = future
+            if self._batch is None:
+                self._batch = self._client._run(self._fetch_batch)
+                self._batch.add_done_callback(self._batch_received)
+        return future
+
+    def _resolve(self, future):
+        if self._buffer:
+            future.set_result(self._buffer.popleft())
+        elif self._batch is not None:
+            return False
+        elif self._error is not None:
+            error, self._error = self._error, None
+            self._done = True
+            future.set_exception(error)
+        elif self._done:
+            future.set_exception(StopAsyncIteration())  # noqa: F821
+        else:
+            return False
+        return True
+
+    def _fetch_batch(self):
+        """
+        Read the next batch of contacts on a worker thread.
+
+        Returns a ``(contacts, done, error)`` tuple. The iterator's state is
+        only updated from the event loop, in :meth:`_batch_received`.
+        """
+        contacts = []
+        try:
+            for contact in self._contacts:
+                contacts.append(contact)
+                if len(contacts) >= self._batch_size:
+                    break
+            else:
+                return contacts, True, None
+        except Exception as err:
+            return contacts, False, err
+        return contacts, False, None
+
+    def _batch_received(self, batch):
+        self._batch = None
+        contacts, self._done, self._error = batch.result()
+        self._buffer.extend(contacts)
+        future, self._waiter = self._waiter, None
+        if future is not None and not future.cancelled():
+            self._resolve(future)
+
+
+class AsyncContactsApiClient(object):
+    """
+    Asyncio client for Vumi Go's contacts API.
+
+    Methods return awaitables and :meth:`contacts` and
+    :meth:`group_contacts` return async iterators, otherwise the interface
+    is the same as :class:`go_http.contacts.ContactsApiClient`.
+
+    :param str auth_token:
+        An OAuth 2 access token.
+
+    :param str api_url:
+        The full URL of the HTTP API. Defaults to
+        ``https://go.vumi.org/api/v1/go``.
+
+    :type session:
+        :class:`requests.Session`
+    :param session:
+        Requests session to use for HTTP requests. Defaults to a new session
+        whose connection pool is sized to ``max_workers``.
+
+    :param int max_workers:
+        The maximum number of concurrent requests. Defaults to ``10``.
+
+    :param loop:
+        The event loop to use. Defaults to the current event loop.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, auth_token, api_url=None, session=None, max_workers=10,
+                 loop=None):
+        if asyncio is None:
+            raise RuntimeError(
+                "AsyncContactsApiClient requires Python 3 and asyncio.")
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.client = ContactsApiClient(
+            auth_token, api_url=api_url, session=session)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._loop = loop
+
+    def _get_loop(self):
+        if self._loop is not None:
+            return self._loop
+        return asyncio.get_event_loop()
+
+    def _run(self, func, *args, **kw):
+        return self._get_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kw))
+
+    def close(self):
+        """
+        Shut down the worker threads once pending requests have completed.
+        """
+        self._executor.shutdown(wait=False)
+
+    def contacts(self, start_cursor=None, fields=None, page_size=None):
+        """
+        Retrieve all contacts.
+
+        See :meth:`go_http.contacts.ContactsApiClient.contacts`.
+
+        :returns:
+            An async iterator over all contacts.
+        """
+        return _AsyncContactIterator(
+            self, self.client.contacts(
+                start_cursor, fields=fields, page_size=page_size),
+            self.BATCH_SIZE)
+
+    def group_contacts(self, group_key, start_cursor=None, fields=None,
+                       page_size=None):
+        """
+        Retrieve all group contacts.
+
+        See :meth:`go_http.contacts.ContactsApiClient.group_contacts`.
+
+        :returns:
+            An async iterator over all group contacts.
+        """
+        return _AsyncContactIterator(
+            self, self.client.group_contacts(
+                group_key, start_cursor, fields=fields, page_size=page_size),
+            self.BATCH_SIZE)
+
+    def create_contact(self, contact_data):
+        """
+        Create a contact.
+
+        :param dict contact_data:
+            Data for new contact.
+        """
+        return self._run(self.client.create_contact, contact_data)
+
+    def get_contact(self, *args, **kw):
+        """
+        Get a contact.
+
+        See :meth:`go_http.contacts.ContactsApiClient.get_contact`.
+        """
+        return self._run(self.client.get_contact, *args, **kw)
+
+    def update_contact(self, contact_key, update_data):
+        """
+        Update a contact.
+
+        :param str contact_key:
+            Key for the contact to update.
+        :param dict update_data:
+            Fields to modify.
+        """
+        return self._run(self.client.update_contact, contact_key, update_data)
+
+    def delete_contact(self, contact_key):
+        """
+        Delete a contact.
+
+        :param str contact_key:
+            Key for the contact to delete.
+        """
+        return self._run(self.client.delete_contact, contact_key)
+
+    def create_group(self, group_data):
+        """
+        Create a group.
+
+        :param dict group_data:
+            Data for new group.
+        """
+        return self._run(self.client.create_group, group_data)
+
+    def get_group(self, group_key):
+        """
+        Get a group.
+
+        :param str group_key:
+            Key for the group to get.
+        """
+        return self._run(self.client.get_group, group_key)
+
+    def update_group(self, group_key, update_data):
+        """
+        Update a group.
+
+        :param str group_key:
+            Key for the group to update.
+        :param dict update_data:
+            Fields to modify.
+        """
+        return self._run(self.client.update_group, group_key, update_data)
+
+    def delete_group(self, group_key):
+        """
+        Delete a group.
+
+        :param str group_key:
+            Key for the group to delete.
+        """
+        return self._run(self.client.delete_group, group_key)
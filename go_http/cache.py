@@ -0,0 +1,115 @@
+"""
+A simple in-memory cache for API responses.
+"""
+
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    A thread-safe LRU cache whose entries expire after a time-to-live.
+
+    :param int max_size:
+        The maximum number of entries. The least recently used entry is
+        evicted when the cache is full. Defaults to ``1000``.
+    :param float ttl:
+        The default number of seconds entries live for. Defaults to ``60``.
+        Use ``float('inf')`` for entries that never expire.
+    :param clock:
+        A function returning the current time in seconds. Defaults to
+        :func:`time.time`.
+
+    Attributes:
+        hits - The number of lookups that found an entry.
+        misses - The number of lookups that did not find an entry.
+        evictions - The number of entries evicted to make space.
+    """
+
+    def __init__(self, max_size=1000, ttl=60, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __repr__(self):
+        return "<TTLCache size=%d hits=%d misses=%d>" % (
+            len(self._entries), self.hits, self.misses)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that found an entry.
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key`` or ``default`` if there is no unexpired
+        entry for it.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Mark the entry as most recently used.
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """
+        Store ``value`` for ``key``.
+
+        :param float ttl:
+            The number of seconds the entry lives for. Defaults to the
+            cache's ``ttl``.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Remove the entry for ``key``, if there is one.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
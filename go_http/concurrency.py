@@ -0,0 +1,91 @@
+"""
+Helpers for running API requests concurrently.
+"""
+
+import threading
+
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait)
+
+
+def imap_unordered(func, items, concurrency):
+    """
+    Call ``func(item)`` for each item using up to ``concurrency`` threads.
+
+    Items are consumed lazily so that at most ``concurrency`` calls are in
+    flight at once, which keeps memory use bounded even for very large
+    iterables.
+
+    :param func:
+        The function to call.
+    :param items:
+        An iterable of arguments for ``func``.
+    :param int concurrency:
+        The maximum number of concurrent calls.
+
+    :returns:
+        An iterator over ``(item, future)`` pairs in the order the calls
+        complete. Each future is done, so ``future.result()`` returns the
+        value returned by ``func`` or raises the exception it raised.
+    """
+    executor = ThreadPoolExecutor(concurrency)
+    pending = {}
+    try:
+        for item in items:
+            while len(pending) >= concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+            pending[executor.submit(func, item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share a key.
+
+    While a call for a key is in flight, further calls for the same key wait
+    for and share its result instead of making their own call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, key, func, *args, **kw):
+        """
+        Call ``func(*args, **kw)`` unless a call for ``key`` is already in
+        flight, in which case wait for that call to complete.
+
+        :returns:
+            A tuple ``(result, shared)`` where ``shared`` is ``True`` if the
+            result came from a call made by another thread. Exceptions raised
+            by ``func`` are raised in every waiting thread.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = func(*args, **kw)
+        except BaseException as err:
+            # Also covers e.g. KeyboardInterrupt, which would otherwise leave
+            # waiting threads blocked forever.
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -6,13 +6,232 @@ TODO:
  * Implement more of the API as the server side grows.
 """
 
+import codecs
+import copy
 import json
+import threading
+import time
 
 import requests
+from requests.exceptions import HTTPError
 
+from go_http.concurrency import SingleFlight, imap_unordered
 from go_http.exceptions import PagedException
 
 
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Marks a streamed page whose cursor has not been read yet.
+_MISSING = object()
+
+
+class _JsonStreamReader(object):
+    """
+    Reads JSON values one at a time from an iterable of byte chunks.
+    """
+
+    WHITESPACE = u' \t\n\r'
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            chunk = self._text_decoder.decode(b'', final=True)
+        else:
+            chunk = self._text_decoder.decode(chunk)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while (self._pos < len(self._buf) and
+                    self._buf[self._pos] in self.WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return
+
+    def peek(self):
+        self._skip_whitespace()
+        if self._pos >= len(self._buf):
+            raise ValueError("Unexpected end of JSON stream")
+        return self._buf[self._pos]
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(
+                "Expected one of %r at position %d of JSON stream, got %r" % (
+                    chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A value that ends at the end of the buffer may be truncated
+            # (e.g. a number), so only accept it if more data follows.
+            if end < len(self._buf) or not self._fill():
+                self._pos = end
+                return value
+
+
+def _iter_json_object(chunks, array_key):
+    """
+    Incrementally parse a JSON object from an iterable of byte chunks.
+
+    Yields ``(key, value)`` pairs for each member of the object, except for
+    the member named ``array_key`` whose value must be an array. A
+    ``(array_key, item)`` pair is yielded for each item in that array as soon
+    as the item has been received.
+    """
+    reader = _JsonStreamReader(chunks)
+    reader.expect(u'{')
+    if reader.peek() == u'}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(u':')
+        if key == array_key:
+            reader.expect(u'[')
+            if reader.peek() == u']':
+                reader.expect(u']')
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(u',]') == u']':
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(u',}') == u'}':
+            return
+
+
+def _compile_projection(fields):
+    """
+    Convert a list of field names into a mapping from top-level field names
+    to either ``None`` (keep the whole field) or a set of sub-field names to
+    keep (for fields given as ``"extra.<name>"``).
+    """
+    projection = {}
+    for field in fields:
+        name, _, sub_field = field.partition('.')
+        if not sub_field:
+            projection[name] = None
+        elif name not in projection:
+            projection[name] = set([sub_field])
+        elif projection[name] is not None:
+            projection[name].add(sub_field)
+    return projection
+
+
+def _project_contact(contact, projection):
+    result = {}
+    for name, sub_fields in projection.items():
+        if name not in contact:
+            continue
+        value = contact[name]
+        if sub_fields is not None and isinstance(value, dict):
+            value = dict(
+                (k, v) for k, v in value.items() if k in sub_fields)
+        result[name] = value
+    return result
+
+
+class PaginationStats(object):
+    """
+    Counters for the pages fetched by paginated downloads.
+
+    Attributes:
+        pages - The number of pages fetched.
+        contacts - The number of contacts (or groups) received.
+        bytes - The number of bytes received.
+        elapsed - The total time spent fetching pages, in seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.contacts = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def record(self, contacts, num_bytes, elapsed):
+        with self._lock:
+            self.pages += 1
+            self.contacts += contacts
+            self.bytes += num_bytes
+            self.elapsed += elapsed
+
+
+class AdaptivePageSize(object):
+    """
+    A page size that adapts to how long pages take to fetch.
+
+    After each page, the page size is scaled towards the size that would
+    have taken ``target_time`` seconds to fetch (and, if ``max_bytes`` is
+    given, would not have exceeded ``max_bytes``). The size changes by at
+    most a factor of two per page and stays within ``min_size`` and
+    ``max_size``.
+
+    :param float target_time:
+        The desired time to fetch each page, in seconds. Defaults to ``1.0``.
+    :param int initial_size:
+        The size of the first page. Defaults to ``100``.
+    :param int min_size:
+        The smallest page size to request. Defaults to ``10``.
+    :param int max_size:
+        The largest page size to request. Defaults to ``1000``.
+    :param int max_bytes:
+        An optional limit on the size of each page's response in bytes.
+    """
+
+    def __init__(self, target_time=1.0, initial_size=100, min_size=10,
+                 max_size=1000, max_bytes=None):
+        self.target_time = target_time
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.size = initial_size
+
+    def record(self, contacts, num_bytes, elapsed):
+        """
+        Adjust the page size after a page has been fetched.
+
+        :param int contacts:
+            The number of contacts in the page.
+        :param int num_bytes:
+            The size of the page in bytes.
+        :param float elapsed:
+            The time taken to fetch the page, in seconds.
+        """
+        if contacts == 0:
+            return
+        size = self.target_time * contacts / max(elapsed, 1e-6)
+        if self.max_bytes is not None and num_bytes > 0:
+            size = min(size, float(self.max_bytes) * contacts / num_bytes)
+        size = max(self.size / 2.0, min(self.size * 2.0, size))
+        self.size = int(max(self.min_size, min(self.max_size, size)))
+
+
 class ContactsApiClient(object):
 
     """
@@ -31,9 +250,21 @@ class ContactsApiClient(object):
         :class:`requests.Session`
     :param session:
         Requests session to use for HTTP requests. Defaults to a new session.
+
+    :type group_cache:
+        :class:`go_http.cache.TTLCache`
+    :param group_cache:
+        An optional cache for groups fetched with :meth:`get_group`. Groups
+        created, updated or deleted through this client are written to or
+        removed from the cache. Changes made elsewhere are only seen once
+        cached entries expire.
+
+    The :class:`PaginationStats` for all paginated downloads made by the
+    client are available as ``pagination_stats``.
     """
 
-    def __init__(self, auth_token, api_url=None, session=None):
+    def __init__(self, auth_token, api_url=None, session=None,
+                 group_cache=None):
         self.auth_token = auth_token
         if api_url is None:
             api_url = "https://go.vumi.org/api/v1/go"
@@ -41,9 +272,13 @@ class ContactsApiClient(object):
         if session is None:
             session = requests.Session()
         self.session = session
+        self.pagination_stats = PaginationStats()
+        self.group_cache = group_cache
+        self._in_flight = SingleFlight()
 
     def _api_request(
-            self, method, api_collection, api_path, data=None, params=None):
+            self, method, api_collection, api_path, data=None, params=None,
+            stream=False):
         url = "%s/%s/%s" % (self.api_url, api_collection, api_path)
         headers = {
             "Content-Type": "application/json; charset=utf-8",
@@ -52,11 +287,106 @@ class ContactsApiClient(object):
         if data is not None:
             data = json.dumps(data)
         r = self.session.request(
-            method, url, data=data, headers=headers, params=params)
+            method, url, data=data, headers=headers, params=params,
+            stream=stream)
         r.raise_for_status()
+        if stream:
+            return r
         return r.json()
 
-    def contacts(self, start_cursor=None):
+    def _timed_chunks(self, r, page):
+        for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            page['bytes'] += len(chunk)
+            yield chunk
+
+    def _page_contacts(self, api_collection, api_path, cursor, stream, page,
+                       page_size):
+        """
+        Yield the contacts from a single page and store the cursor for the
+        next page in ``page['cursor']``. The size of the page and the time
+        spent fetching it are stored in ``page['bytes']`` and
+        ``page['elapsed']``.
+        """
+        if cursor:
+            api_path = "%s?cursor=%s" % (api_path, cursor)
+        params = None
+        if page_size is not None:
+            params = {'max_results': page_size}
+        page.update({'bytes': 0, 'elapsed': 0.0, 'contacts': 0})
+        start = time.time()
+        r = self._api_request(
+            "GET", api_collection, api_path, params=params, stream=True)
+        try:
+            if not stream:
+                page['bytes'] = len(r.content)
+                page['elapsed'] = time.time() - start
+                result = r.json()
+                page['cursor'] = result['cursor']
+                page['contacts'] = len(result['data'])
+                for contact in result['data']:
+                    yield contact
+                return
+            page['elapsed'] = time.time() - start
+            page['cursor'] = _MISSING
+            items = _iter_json_object(self._timed_chunks(r, page), 'data')
+            while True:
+                # Only time reading the response, not processing contacts.
+                start = time.time()
+                item = next(items, None)
+                page['elapsed'] += time.time() - start
+                if item is None:
+                    break
+                key, value = item
+                if key == 'data':
+                    page['contacts'] += 1
+                    yield value
+                elif key == 'cursor':
+                    page['cursor'] = value
+            if page['cursor'] is _MISSING:
+                raise ValueError("Page has no cursor.")
+        finally:
+            r.close()
+
+    def _record_page(self, page, page_size):
+        self.pagination_stats.record(
+            page['contacts'], page['bytes'], page['elapsed'])
+        if isinstance(page_size, AdaptivePageSize):
+            page_size.record(page['contacts'], page['bytes'], page['elapsed'])
+
+    def _paginate(self, api_collection, api_path, start_cursor, stream,
+                  fields, page_size):
+        if fields is not None:
+            projection = _compile_projection(fields)
+            for contact in self._paginate(
+                    api_collection, api_path, start_cursor, stream, None,
+                    page_size):
+                yield _project_contact(contact, projection)
+            return
+        page = {'cursor': start_cursor}
+        first_page = True
+        while first_page or page['cursor'] is not None:
+            cursor = page['cursor']
+            if isinstance(page_size, AdaptivePageSize):
+                limit = page_size.size
+            else:
+                limit = page_size
+            contacts = self._page_contacts(
+                api_collection, api_path, cursor, stream, page, limit)
+            while True:
+                try:
+                    contact = next(contacts)
+                except StopIteration:
+                    break
+                except Exception as err:
+                    if first_page:
+                        raise
+                    raise PagedException(cursor, err)
+                yield contact
+            first_page = False
+            self._record_page(page, page_size)
+
+    def contacts(self, start_cursor=None, stream=False, fields=None,
+                 page_size=None):
         """
         Retrieve all contacts.
 
@@ -65,25 +395,33 @@ class ContactsApiClient(object):
         :param start_cursor:
             An optional parameter that declares the cursor to start fetching
             the contacts from.
+        :param bool stream:
+            If ``True``, each page is parsed incrementally as it is received
+            and contacts are yielded before the whole page has arrived. This
+            keeps memory use flat for large pages. If reading a page fails
+            part way through, the :class:`PagedException` raised contains the
+            cursor of the page being read, so contacts from that page that
+            were already yielded will be yielded again on restart.
+        :param list fields:
+            An optional list of the contact fields to return, e.g.
+            ``['key', 'msisdn', 'extra.quest']``. Names of the form
+            ``extra.<name>`` keep only the named entries of a dict field.
+            Other fields are dropped as soon as each contact is decoded.
+            The API does not currently support projections, so full
+            contacts are still downloaded.
+        :param page_size:
+            The number of contacts to request per page. Either an ``int``,
+            an :class:`AdaptivePageSize` to adjust the page size based on
+            how long pages take to fetch, or ``None`` to use the server's
+            default page size.
+
+        Every page fetched is recorded in :attr:`pagination_stats`.
 
         :returns:
             An iterator over all contacts.
         """
-        if start_cursor:
-            page = self._api_request(
-                "GET", "contacts", "?cursor=%s" % start_cursor)
-        else:
-            page = self._api_request("GET", "contacts", "")
-        while True:
-            for contact in page['data']:
-                yield contact
-            if page['cursor'] is None:
-                break
-            try:
-                page = self._api_request(
-                    "GET", "contacts", "?cursor=%s" % page['cursor'])
-            except Exception as err:
-                raise PagedException(page['cursor'], err)
+        return self._paginate(
+            "contacts", "", start_cursor, stream, fields, page_size)
 
     def create_contact(self, contact_data):
         """
@@ -94,14 +432,28 @@ class ContactsApiClient(object):
         """
         return self._api_request("POST", "contacts", "", contact_data)
 
+    def _coalesced(self, flight_key, func, *args):
+        contact, shared = self._in_flight.call(flight_key, func, *args)
+        if shared:
+            # Don't hand the same mutable dict to several callers.
+            contact = copy.deepcopy(contact)
+        return contact
+
     def _contact_by_key(self, contact_key):
-        return self._api_request("GET", "contacts", contact_key)
+        return self._coalesced(
+            ("key", contact_key),
+            self._api_request, "GET", "contacts", contact_key)
 
-    def _contact_by_field(self, field, value):
+    def _fetch_contact_by_field(self, field, value):
         contact = self._api_request(
             "GET", "contacts", "", params={'query': '%s=%s' % (field, value)})
         return contact.get('data')[0]
 
+    def _contact_by_field(self, field, value):
+        return self._coalesced(
+            ("field", field, value),
+            self._fetch_contact_by_field, field, value)
+
     def get_contact(self, *args, **kw):
         """
         Get a contact. May either be called as ``.get_contact(contact_key)``
@@ -121,16 +473,48 @@ class ContactsApiClient(object):
             ``field`` is the address field that is searched on (e.g. ``msisdn``
             , ``twitter_handle``). The value of ``field`` is the value to
             search for (e.g. ``+12345``, `@foobar``).
+
+        Concurrent calls for the same contact key or field and value share a
+        single in-flight HTTP request.
         """
         if not kw and len(args) == 1:
             return self._contact_by_key(args[0])
         elif len(kw) == 1 and not args:
-            field, value = kw.items()[0]
+            [(field, value)] = kw.items()
             return self._contact_by_field(field, value)
         raise ValueError(
             "get_contact may either be called as .get_contact(contact_key) or"
             " .get_contact(field=value)")
 
+    def _contact_or_none(self, contact_key):
+        try:
+            return self._contact_by_key(contact_key)
+        except HTTPError as err:
+            if err.response is None or err.response.status_code != 404:
+                raise
+            return None
+
+    def get_contacts(self, contact_keys, concurrency=10):
+        """
+        Get many contacts by key, making up to ``concurrency`` requests at
+        once.
+
+        :param list contact_keys:
+            Keys for the contacts to get. Duplicate keys are only fetched
+            once.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``10``.
+
+        :returns:
+            A dict mapping each key to its contact, or to ``None`` if the
+            contact was not found.
+        """
+        contacts = {}
+        for contact_key, future in imap_unordered(
+                self._contact_or_none, set(contact_keys), concurrency):
+            contacts[contact_key] = future.result()
+        return contacts
+
     def update_contact(self, contact_key, update_data):
         """
         Update a contact.
@@ -151,6 +535,11 @@ class ContactsApiClient(object):
         """
         return self._api_request("DELETE", "contacts", contact_key)
 
+    def _cache_group(self, group):
+        if self.group_cache is not None:
+            self.group_cache.set(group[u'key'], copy.deepcopy(group))
+        return group
+
     def create_group(self, group_data):
         """
         Create a group.
@@ -158,7 +547,8 @@ class ContactsApiClient(object):
         :param dict group_data:
             Data for new group.
         """
-        return self._api_request("POST", "groups", "", group_data)
+        group = self._api_request("POST", "groups", "", group_data)
+        return self._cache_group(group)
 
     def get_group(self, group_key):
         """
@@ -167,7 +557,12 @@ class ContactsApiClient(object):
         :param str group_key:
             Key for the group to get
         """
-        return self._api_request("GET", "groups", group_key)
+        if self.group_cache is not None:
+            group = self.group_cache.get(group_key)
+            if group is not None:
+                return copy.deepcopy(group)
+        group = self._api_request("GET", "groups", group_key)
+        return self._cache_group(group)
 
     def update_group(self, group_key, update_data):
         """
@@ -178,7 +573,10 @@ class ContactsApiClient(object):
         :param str update_data:
             Fields to modify.
         """
-        return self._api_request("PUT", "groups", group_key, update_data)
+        if self.group_cache is not None:
+            self.group_cache.delete(group_key)
+        group = self._api_request("PUT", "groups", group_key, update_data)
+        return self._cache_group(group)
 
     def delete_group(self, group_key):
         """
@@ -187,9 +585,42 @@ class ContactsApiClient(object):
         :param str group_key:
             Key for the group to delete.
         """
+        if self.group_cache is not None:
+            self.group_cache.delete(group_key)
         return self._api_request("DELETE", "groups", group_key)
 
-    def group_contacts(self, group_key, start_cursor=None):
+    def groups(self, start_cursor=None):
+        """
+        Retrieve all groups.
+
+        This uses the API's paginated group download.
+
+        :param start_cursor:
+            An optional parameter that declares the cursor to start fetching
+            the groups from.
+
+        :returns:
+            An iterator over all groups.
+        """
+        return self._paginate("groups", "", start_cursor, False, None, None)
+
+    def warm_group_cache(self):
+        """
+        Load all groups into the group cache.
+
+        :returns:
+            The number of groups loaded.
+        """
+        if self.group_cache is None:
+            raise ValueError("This client has no group cache.")
+        count = 0
+        for group in self.groups():
+            self._cache_group(group)
+            count += 1
+        return count
+
+    def group_contacts(self, group_key, start_cursor=None, stream=False,
+                       fields=None, page_size=None):
         """
         Retrieve all group contacts.
 
@@ -200,25 +631,19 @@ class ContactsApiClient(object):
         :param start_cursor:
             An optional parameter that declares the cursor to start fetching
             the contacts from.
+        :param bool stream:
+            If ``True``, each page is parsed incrementally as it is received.
+            See :meth:`contacts`.
+        :param list fields:
+            An optional list of the contact fields to return. See
+            :meth:`contacts`.
+        :param page_size:
+            The number of contacts to request per page. See
+            :meth:`contacts`.
 
         :returns:
             An iterator over all group contacts.
         """
-        if start_cursor:
-            page = self._api_request(
-                "GET", "groups/%s" % group_key,
-                "contacts?cursor=%s" % start_cursor)
-        else:
-            page = self._api_request(
-                "GET", "groups/%s" % group_key, "contacts")
-        while True:
-            for contact in page['data']:
-                yield contact
-            if page['cursor'] is None:
-                break
-            try:
-                page = self._api_request(
-                    "GET", "groups/%s" % group_key, "contacts?cursor=%s" %
-                    page['cursor'])
-            except Exception as err:
-                raise PagedException(page['cursor'], err)
+        return self._paginate(
+            "groups/%s" % group_key, "contacts", start_cursor, stream, fields,
+            page_size)
@@ -0,0 +1,152 @@
+"""
+Planning and applying changes that bring Vumi Go contacts in line with a
+desired set of contacts.
+"""
+
+from go_http.concurrency import imap_unordered
+
+
+def _changed_fields(current, desired, ignore_fields):
+    changes = {}
+    for field, value in desired.items():
+        if field == u'key' or field in ignore_fields:
+            continue
+        if current.get(field) != value:
+            changes[field] = value
+    return changes
+
+
+class SyncPlan(object):
+    """
+    The changes needed to bring contacts in line with a desired state.
+
+    Attributes:
+        creates - A list of contact dicts to create.
+        updates - A list of ``(contact_key, changed_fields)`` pairs.
+        deletes - A list of keys for contacts to delete.
+        conflicts - A list of keys for contacts that are left unchanged
+            because another current contact already matched the same
+            desired contact (e.g. two contacts with the same msisdn).
+    """
+
+    def __init__(self, creates=None, updates=None, deletes=None,
+                 conflicts=None):
+        self.creates = creates if creates is not None else []
+        self.updates = updates if updates is not None else []
+        self.deletes = deletes if deletes is not None else []
+        self.conflicts = conflicts if conflicts is not None else []
+
+    def __len__(self):
+        return len(self.creates) + len(self.updates) + len(self.deletes)
+
+    def __repr__(self):
+        return "<SyncPlan creates=%d updates=%d deletes=%d conflicts=%d>" % (
+            len(self.creates), len(self.updates), len(self.deletes),
+            len(self.conflicts))
+
+    def _operations(self):
+        for contact_data in self.creates:
+            yield ("create", contact_data)
+        for contact_key, changes in self.updates:
+            yield ("update", (contact_key, changes))
+        for contact_key in self.deletes:
+            yield ("delete", contact_key)
+
+    def apply(self, client, concurrency=10):
+        """
+        Apply the plan, making up to ``concurrency`` requests at once.
+
+        :type client:
+            :class:`go_http.contacts.ContactsApiClient`
+        :param client:
+            The contacts API client to make the changes with.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``10``.
+
+        :returns:
+            A list of ``(action, target, error)`` tuples for the changes that
+            failed, where ``action`` is one of ``'create'``, ``'update'`` or
+            ``'delete'`` and ``target`` is the contact data, the
+            ``(contact_key, changed_fields)`` pair or the contact key
+            respectively. The list is empty if every change succeeded.
+        """
+        def run(operation):
+            action, target = operation
+            if action == "create":
+                return client.create_contact(target)
+            elif action == "update":
+                return client.update_contact(*target)
+            return client.delete_contact(target)
+
+        failures = []
+        for (action, target), future in imap_unordered(
+                run, self._operations(), concurrency):
+            error = future.exception()
+            if error is not None:
+                failures.append((action, target, error))
+        return failures
+
+
+def plan_sync(client, desired, match_on=u'key', delete_missing=False,
+              ignore_fields=()):
+    """
+    Compare the current contacts with the desired contacts and plan the
+    smallest set of changes needed to make them match.
+
+    The current contacts are streamed from
+    :meth:`go_http.contacts.ContactsApiClient.contacts` and only the keys of
+    contacts to delete are retained.
+
+    :type client:
+        :class:`go_http.contacts.ContactsApiClient`
+    :param client:
+        The contacts API client to fetch the current contacts with.
+    :param desired:
+        An iterable of contact dicts describing the desired state. Fields not
+        present in a desired contact are left unchanged.
+    :param str match_on:
+        The field used to match desired contacts to current contacts, e.g.
+        ``'key'`` or ``'msisdn'``. Defaults to ``'key'``. Desired contacts
+        without this field are created.
+    :param bool delete_missing:
+        If ``True``, current contacts that do not match any desired contact
+        are deleted. Defaults to ``False``. Current contacts that match a
+        desired contact another current contact has already matched are
+        never deleted; they are listed in :attr:`SyncPlan.conflicts`.
+    :param ignore_fields:
+        Names of fields that are never compared or updated.
+
+    :returns:
+        A :class:`SyncPlan`.
+    """
+    plan = SyncPlan()
+    wanted = {}
+    for contact in desired:
+        if contact.get(match_on) is None:
+            plan.creates.append(contact)
+        else:
+            wanted[contact[match_on]] = contact
+
+    matched = set()
+    for current in client.contacts():
+        value = current.get(match_on)
+        if value in matched:
+            plan.conflicts.append(current[u'key'])
+            continue
+        target = wanted.pop(value, None)
+        if target is None:
+            if delete_missing:
+                plan.deletes.append(current[u'key'])
+            continue
+        matched.add(value)
+        changes = _changed_fields(current, target, ignore_fields)
+        if changes:
+            plan.updates.append((current[u'key'], changes))
+
+    for contact in wanted.values():
+        if match_on == u'key':
+            # Contacts can't be created with a given key.
+            contact = dict(
+                (k, v) for k, v in contact.items() if k != u'key')
+        plan.creates.append(contact)
+    return plan
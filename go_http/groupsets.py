@@ -0,0 +1,316 @@
+"""
+Set algebra over contact group memberships.
+
+Group memberships are streamed from :meth:`ContactsApiClient.group_contacts`
+into compact sorted sets of contact keys so that groups can be combined
+(e.g. "in group A and B but not C") without holding full contact records
+in memory. Only the contacts in the final set are fetched, and only when
+they are iterated over.
+"""
+
+import threading
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+def _encode_key(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8')
+
+
+def _decode_key(key):
+    return key.rstrip(b'\0').decode('utf-8')
+
+
+class ContactKeySet(object):
+    """
+    An immutable set of contact keys.
+
+    Keys are stored in a single buffer of sorted, fixed-width, NUL-padded
+    UTF-8 encoded keys, so each key costs only its own bytes. Set
+    operations are linear merges of the sorted keys and membership tests
+    are binary searches.
+
+    :param keys:
+        An iterable of contact keys. Duplicates are removed.
+    """
+
+    def __init__(self, keys=()):
+        keys = sorted(set(_encode_key(key) for key in keys))
+        width = max([len(key) for key in keys] or [0])
+        self._width = width
+        self._count = len(keys)
+        self._data = b"".join(key.ljust(width, b"\0") for key in keys)
+
+    @classmethod
+    def _from_packed(cls, data, width):
+        key_set = cls()
+        key_set._width = width
+        key_set._count = len(data) // width if width else 0
+        key_set._data = data
+        return key_set
+
+    @classmethod
+    def from_contacts(cls, contacts):
+        """
+        Build a key set from an iterable of contact dicts.
+
+        Only the ``key`` of each contact is retained.
+
+        :param contacts:
+            An iterable of contact dicts, e.g. the result of
+            :meth:`ContactsApiClient.contacts`.
+        """
+        return cls(contact[u'key'] for contact in contacts)
+
+    @classmethod
+    def from_group(cls, client, group_key):
+        """
+        Build a key set from the members of a group.
+
+        Each contact is reduced to its key as soon as it is decoded.
+
+        :type client:
+            :class:`go_http.contacts.ContactsApiClient`
+        :param client:
+            The contacts API client to fetch the group members with.
+        :param str group_key:
+            Key for the group.
+        """
+        return cls.from_contacts(
+            client.group_contacts(group_key, fields=[u'key']))
+
+    def _key(self, i):
+        return self._data[i * self._width:(i + 1) * self._width]
+
+    def _padded_keys(self, width):
+        """
+        Yield the keys in order, padded to ``width`` bytes.
+        """
+        for i in range(self._count):
+            key = self._key(i)
+            yield key if width == self._width else key.ljust(width, b"\0")
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield _decode_key(self._key(i))
+
+    def __contains__(self, key):
+        key = _encode_key(key)
+        if len(key) > self._width:
+            return False
+        key = key.ljust(self._width, b"\0")
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low < self._count and self._key(low) == key
+
+    def __eq__(self, other):
+        if not isinstance(other, ContactKeySet):
+            return NotImplemented
+        if self._width == other._width:
+            return self._data == other._data
+        width = max(self._width, other._width)
+        return (self._count == other._count and
+                list(self._padded_keys(width)) ==
+                list(other._padded_keys(width)))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return "<ContactKeySet size=%d>" % (self._count,)
+
+    def _merge(self, other, keep_self, keep_both, keep_other):
+        """
+        Merge the sorted keys of two sets, keeping keys only in this set,
+        keys in both sets and keys only in ``other`` as requested.
+        """
+        width = max(self._width, other._width)
+        a = self._padded_keys(width)
+        b = other._padded_keys(width)
+        x, y = next(a, None), next(b, None)
+        result = bytearray()
+        while x is not None and y is not None:
+            if x < y:
+                if keep_self:
+                    result += x
+                x = next(a, None)
+            elif x > y:
+                if keep_other:
+                    result += y
+                y = next(b, None)
+            else:
+                if keep_both:
+                    result += x
+                x, y = next(a, None), next(b, None)
+        while keep_self and x is not None:
+            result += x
+            x = next(a, None)
+        while keep_other and y is not None:
+            result += y
+            y = next(b, None)
+        return self._from_packed(bytes(result), width)
+
+    def union(self, other):
+        """
+        Return the keys that are in either this set or ``other``.
+        """
+        return self._merge(other, True, True, True)
+
+    def intersection(self, other):
+        """
+        Return the keys that are in both this set and ``other``.
+        """
+        return self._merge(other, False, True, False)
+
+    def difference(self, other):
+        """
+        Return the keys that are in this set but not in ``other``.
+        """
+        return self._merge(other, True, False, False)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def contacts(self, client):
+        """
+        Lazily fetch the contacts in this set.
+
+        Each contact is retrieved with :meth:`ContactsApiClient.get_contact`
+        as the iterator is advanced.
+
+        :type client:
+            :class:`go_http.contacts.ContactsApiClient`
+        :param client:
+            The contacts API client to fetch the contacts with.
+
+        :returns:
+            An iterator over the contacts in this set, ordered by key.
+        """
+        for key in self:
+            yield client.get_contact(key)
+
+
+_DONE = object()
+
+
+def _put(output, item, stop):
+    """
+    Put an item on the output queue unless the export has been stopped.
+    """
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _export_group(client, group_key, output, stop, page_size):
+    try:
+        for contact in client.group_contacts(group_key, page_size=page_size):
+            if not _put(output, (group_key, contact, None), stop):
+                return
+    except Exception as err:
+        _put(output, (group_key, None, err), stop)
+    else:
+        _put(output, (group_key, _DONE, None), stop)
+
+
+def _export_worker(client, group_queue, output, stop, page_size):
+    while not stop.is_set():
+        try:
+            group_key = group_queue.get_nowait()
+        except queue.Empty:
+            return
+        _export_group(client, group_key, output, stop, page_size)
+
+
+def export_groups(client, group_keys, concurrency=4, buffer_size=1000,
+                  page_size=None):
+    """
+    Export the contacts from several groups, fetching up to ``concurrency``
+    groups at once and emitting each contact only once.
+
+    Each contact is emitted the first time it is received, tagged with the
+    requested groups it belongs to. These are the group that returned it
+    plus any requested groups listed in its ``groups`` field. Membership of
+    other smart groups (groups defined by a query) is not known when a
+    contact is first received, so it is not included in the tags.
+
+    :type client:
+        :class:`go_http.contacts.ContactsApiClient`
+    :param client:
+        The contacts API client to fetch the groups with.
+    :param list group_keys:
+        Keys for the groups to export.
+    :param int concurrency:
+        The maximum number of groups to fetch at once. Defaults to ``4``.
+    :param int buffer_size:
+        The maximum number of received contacts waiting to be emitted.
+        Defaults to ``1000``.
+    :param page_size:
+        The page size to request. See
+        :meth:`go_http.contacts.ContactsApiClient.contacts`.
+
+    :returns:
+        An iterator over ``(contact, group_keys)`` pairs, where
+        ``group_keys`` is a sorted list of the keys of the requested groups
+        the contact belongs to.
+
+    If fetching a group fails, the exception (e.g. a
+    :class:`go_http.exceptions.PagedException`) is raised and the remaining
+    downloads are stopped.
+    """
+    group_keys = list(group_keys)
+    requested = set(group_keys)
+    group_queue = queue.Queue()
+    for group_key in group_keys:
+        group_queue.put(group_key)
+    output = queue.Queue(buffer_size)
+    stop = threading.Event()
+    workers = [
+        threading.Thread(
+            target=_export_worker,
+            args=(client, group_queue, output, stop, page_size))
+        for _ in range(min(concurrency, len(group_keys)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    seen = set()
+    remaining = len(group_keys)
+    try:
+        while remaining:
+            group_key, contact, err = output.get()
+            if err is not None:
+                raise err
+            if contact is _DONE:
+                remaining -= 1
+                continue
+            key = _encode_key(contact[u'key'])
+            if key in seen:
+                continue
+            seen.add(key)
+            groups = requested.intersection(contact.get(u'groups') or ())
+            groups.add(group_key)
+            yield contact, sorted(groups)
+    finally:
+        stop.set()
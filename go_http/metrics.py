@@ -6,10 +6,111 @@ TODO:
  * Implement more of the API as the server side grows.
 """
 
+import collections
+import copy
 import json
+import re
+import logging
+import threading
+import time
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
 
 import requests
 
+from go_http.concurrency import SingleFlight, imap_unordered
+
+
+AGGREGATORS = ("avg", "sum", "max", "min", "last")
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+log = logging.getLogger(__name__)
+
+INTERVAL_UNITS = {
+    "s": 1,
+    "m": 60,
+    "min": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+_INTERVAL_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([a-z]+)\s*$")
+
+
+def parse_interval(interval):
+    """
+    Convert an interval such as ``'1d'`` or ``'5m'`` into seconds.
+
+    :raises ValueError:
+        If the interval is not a number followed by one of the units ``s``,
+        ``m`` (or ``min``), ``h``, ``d`` or ``w``.
+    """
+    match = _INTERVAL_RE.match(interval)
+    if match is None or match.group(2) not in INTERVAL_UNITS:
+        raise ValueError("Invalid interval %r." % (interval,))
+    return float(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def _absolute_time(value):
+    """
+    Return ``value`` as seconds since the epoch if it is an absolute time
+    (a number or a string of digits) or ``None`` if it is a relative time
+    such as ``'-1d'``.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value is not None and value.isdigit():
+        return float(value)
+    return None
+
+
+def _resolve_time(value, now):
+    """
+    Return a relative time such as ``'-30d'`` or an absolute time as
+    seconds since the epoch.
+
+    :raises ValueError:
+        If the time can't be parsed.
+    """
+    absolute = _absolute_time(value)
+    if absolute is not None:
+        return absolute
+    if value.startswith("-"):
+        return now - parse_interval(value[1:])
+    raise ValueError("Invalid time %r." % (value,))
+
+
+def _aggregator(metric):
+    agg = metric.rpartition(".")[2]
+    if agg not in AGGREGATORS:
+        raise ValueError(
+            "Metric name %r does not end in a valid aggregator name (%s)." % (
+                metric, ", ".join(AGGREGATORS)))
+    return agg
+
+
+def _combine(agg, old, new):
+    """
+    Combine two ``(value, count)`` pairs for the same metric. ``new`` holds
+    the more recent values.
+    """
+    if old is None:
+        return new
+    if new is None:
+        return old
+    if agg in ("sum", "avg"):
+        return (old[0] + new[0], old[1] + new[1])
+    elif agg == "max":
+        return (max(old[0], new[0]), old[1] + new[1])
+    elif agg == "min":
+        return (min(old[0], new[0]), old[1] + new[1])
+    return (new[0], old[1] + new[1])
+
 
 class MetricsApiClient(object):
     """
@@ -28,9 +129,28 @@ class MetricsApiClient(object):
         :class:`requests.Session`
     :param session:
         Requests session to use for HTTP requests. Defaults to a new session.
+
+    :type query_cache:
+        :class:`go_http.cache.TTLCache`
+    :param query_cache:
+        An optional cache for :meth:`get_metric` results. Results are
+        cached for one bucket ``interval``, or indefinitely if the query
+        ``end`` is an absolute time at least one bucket in the past.
+
+    :type metric_store:
+        :class:`go_http.metricstore.MetricStore`
+    :param metric_store:
+        An optional local store for :meth:`get_metric` results. Queries for
+        a single metric whose buckets are all stored are answered without
+        a request, and fetched results are added to the store.
+
+    :param clock:
+        A function returning the current time in seconds. Defaults to
+        :func:`time.time`.
     """
 
-    def __init__(self, auth_token, api_url=None, session=None):
+    def __init__(self, auth_token, api_url=None, session=None,
+                 query_cache=None, metric_store=None, clock=time.time):
         self.auth_token = auth_token
         if api_url is None:
             api_url = "https://go.vumi.org/api/v1/go"
@@ -38,6 +158,10 @@ class MetricsApiClient(object):
         if session is None:
             session = requests.Session()
         self.session = session
+        self.query_cache = query_cache
+        self.metric_store = metric_store
+        self.clock = clock
+        self._in_flight = SingleFlight()
 
     def _api_request(self, method, api_collection, data=None):
         url = "%s/%s" % (self.api_url, api_collection)
@@ -68,7 +192,171 @@ class MetricsApiClient(object):
             How nulls should be handled (e.g. `omit`).
         :param str end:
             When to get metrics until (e.g. `-30d`).
+
+        If the client has a ``query_cache``, cached results are returned
+        when available and concurrent identical queries share a single
+        request. If the client has a ``metric_store``, stored buckets are
+        returned when every bucket in the range is stored. Results fetched
+        with ``nulls="zeroize"`` are not stored.
+        """
+        query_range = None
+        if self.metric_store is not None:
+            query_range = self._store_range(metric, start, interval, end)
+        if query_range is not None:
+            try:
+                datapoints = self.metric_store.query(
+                    metric, interval, query_range[0], query_range[1], nulls)
+            except Exception:
+                log.exception(
+                    "Failed to read %r from the metric store.", metric)
+                datapoints = None
+            if datapoints is not None:
+                return {metric: datapoints}
+
+        if self.query_cache is None:
+            result = self._get_metric(metric, start, interval, nulls, end)
+        else:
+            key = (metric, start, interval, nulls, end)
+            result = self.query_cache.get(key)
+            if result is None:
+                result, _ = self._in_flight.call(
+                    key, self._get_cached_metric, key)
+            result = copy.deepcopy(result)
+
+        # Zeroized results can't be told apart from real zeros, so they
+        # aren't stored. Only omitted buckets need filling in as nulls.
+        if query_range is not None and nulls != "zeroize":
+            fill_range = query_range if nulls == "omit" else (None, None)
+            try:
+                self.metric_store.add(
+                    metric, interval, result.get(metric, []), *fill_range)
+            except Exception:
+                log.exception(
+                    "Failed to store %r in the metric store.", metric)
+        return result
+
+    def _store_range(self, metric, start, interval, end):
+        """
+        Return the ``(start, end)`` range of a query in seconds since the
+        epoch if its results can be stored, otherwise ``None``.
         """
+        if any(c in metric for c in "*?[{") or \
+                not self.metric_store.supports(interval):
+            return None
+        now = self.clock()
+        try:
+            return (_resolve_time(start, now),
+                    now if end is None else _resolve_time(end, now))
+        except ValueError:
+            return None
+
+    def get_metrics(self, metrics, start, interval, nulls, end=None,
+                    concurrency=10):
+        """
+        Get many metrics, making up to ``concurrency`` requests at once.
+
+        Requests share the client's session and its connection pool.
+
+        :param list metrics:
+            Metric names. Duplicate names are only fetched once.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``10``.
+
+        The remaining parameters are the same as for :meth:`get_metric` and
+        apply to every metric.
+
+        :returns:
+            A dict mapping each metric name to the result of
+            :meth:`get_metric` or, if fetching that metric failed, to the
+            exception raised.
+        """
+        def fetch(metric):
+            return self.get_metric(metric, start, interval, nulls, end)
+
+        results = {}
+        for metric, future in imap_unordered(
+                fetch, set(metrics), concurrency):
+            error = future.exception()
+            results[metric] = future.result() if error is None else error
+        return results
+
+    def get_metric_chunked(self, metric, start, interval, nulls, end=None,
+                           chunk_buckets=1000, concurrency=4):
+        """
+        Get a metric over a long range by splitting the range into chunks
+        and fetching up to ``concurrency`` chunks at once.
+
+        Chunks are aligned to bucket boundaries and each bucket is taken
+        from exactly one chunk, so the stitched result has no duplicate
+        points at chunk edges. When the client has a ``query_cache``,
+        chunks that lie entirely in the past are cached indefinitely.
+
+        :param int chunk_buckets:
+            The number of buckets to fetch per request. Defaults to
+            ``1000``.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``4``.
+
+        The remaining parameters are the same as for :meth:`get_metric`,
+        except that ``start`` and ``end`` must be relative times such as
+        ``-30d`` or absolute times in seconds since the epoch, and
+        ``interval`` must be understood by :func:`parse_interval`.
+
+        :raises ValueError:
+            If ``start``, ``end`` or ``interval`` can't be parsed.
+
+        If fetching any chunk fails, the exception is raised.
+        """
+        if chunk_buckets < 1:
+            raise ValueError("chunk_buckets must be at least 1.")
+        step = parse_interval(interval)
+        now = self.clock()
+        range_start = _resolve_time(start, now)
+        range_end = now if end is None else _resolve_time(end, now)
+        range_start -= range_start % step
+        size = step * chunk_buckets
+        chunks = []
+        while range_start < range_end or not chunks:
+            chunks.append(
+                (range_start, min(range_start + size, range_end)))
+            range_start += size
+
+        def fetch(chunk):
+            return self.get_metric(
+                metric, str(int(chunk[0])), interval, nulls,
+                end=str(int(chunk[1])))
+
+        results = {}
+        for chunk, future in imap_unordered(fetch, chunks, concurrency):
+            results[chunk] = future.result()
+
+        stitched = {}
+        for i, chunk in enumerate(chunks):
+            low = chunk[0] * 1000
+            high = chunk[1] * 1000
+            last = i == len(chunks) - 1
+            for name, points in results[chunk].items():
+                stitched.setdefault(name, []).extend(
+                    point for point in points
+                    if low <= point[u"x"] < high or
+                    (last and point[u"x"] == high))
+        return stitched
+
+    def get_metric_series(self, metric, start, interval, nulls, end=None):
+        """
+        Get a metric as NumPy arrays. Requires NumPy.
+
+        Takes the same parameters as :meth:`get_metric`.
+
+        :returns:
+            A dict mapping metric names to
+            :class:`go_http.timeseries.TimeSeries`.
+        """
+        from go_http.timeseries import series_from_response
+        return series_from_response(
+            self.get_metric(metric, start, interval, nulls, end), nulls=nulls)
+
+    def _get_metric(self, metric, start, interval, nulls, end):
         payload = {
             "m": metric,
             "from": start,
@@ -79,6 +367,23 @@ class MetricsApiClient(object):
             payload['until'] = end
         return self._api_request("GET", "metrics/", payload)
 
+    def _query_ttl(self, interval, end):
+        try:
+            ttl = parse_interval(interval)
+        except ValueError:
+            return None
+        end = _absolute_time(end)
+        if end is not None and end + ttl <= self.clock():
+            return float('inf')
+        return ttl
+
+    def _get_cached_metric(self, key):
+        result = self._get_metric(*key)
+        ttl = self._query_ttl(key[2], key[4])
+        if ttl is not None:
+            self.query_cache.set(key, result, ttl=ttl)
+        return result
+
     def fire(self, metrics):
         """
         Fire metrics.
@@ -114,3 +419,538 @@ class MetricsApiClient(object):
         See :meth:`go_http.send.HttpApiSender.fire_metric`.
         """
         return self._api_request("POST", "metrics/", metrics)
+
+
+def _series_start(series):
+    """
+    Return the timestamp (in milliseconds) of the earliest of the last
+    points in each series, or ``None`` if any series is empty.
+    """
+    lasts = [points[-1][u"x"] if points else None
+             for points in series.values()]
+    if not lasts or None in lasts:
+        return None
+    return min(lasts)
+
+
+def _merge_series(old, new, since):
+    """
+    Replace the points at or after ``since`` in each series of ``old`` with
+    the points in ``new``.
+    """
+    merged = {}
+    for name in set(old) | set(new):
+        if name not in new:
+            merged[name] = old[name]
+            continue
+        merged[name] = [
+            point for point in old.get(name, ()) if point[u"x"] < since]
+        merged[name].extend(new[name])
+    return merged
+
+
+class IncrementalMetricFetcher(object):
+    """
+    Polls metrics, downloading only the buckets that may have changed since
+    the previous poll.
+
+    The series returned by the first poll of each query are kept. Later
+    polls request only the range from the most recent stored bucket onward
+    (that bucket may have been incomplete when it was fetched), merge the
+    new points in and drop points that have fallen out of a relative
+    ``start`` window.
+
+    :type client:
+        :class:`MetricsApiClient`
+    :param client:
+        The metrics API client to fetch metrics with.
+    :param clock:
+        A function returning the current time in seconds. Defaults to
+        :func:`time.time`.
+
+    Attributes:
+        full_fetches - The number of polls that fetched the whole range.
+        incremental_fetches - The number of polls that fetched only new
+            buckets.
+    """
+
+    def __init__(self, client, clock=time.time):
+        self.client = client
+        self.clock = clock
+        self.full_fetches = 0
+        self.incremental_fetches = 0
+        self._lock = threading.Lock()
+        self._series = {}
+        self._in_flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._series)
+
+    def get_metric(self, metric, start, interval, nulls):
+        """
+        Get a metric, reusing the points fetched by earlier polls.
+
+        Takes the same parameters as :meth:`MetricsApiClient.get_metric`,
+        except that the range is always open-ended.
+        """
+        key = (metric, start, interval, nulls)
+        result, _ = self._in_flight.call(key, self._fetch, key)
+        return copy.deepcopy(result)
+
+    def forget(self, metric, start, interval, nulls):
+        """
+        Discard the stored series for a query, so that the next poll
+        fetches the whole range.
+        """
+        with self._lock:
+            self._series.pop((metric, start, interval, nulls), None)
+
+    def clear(self):
+        """
+        Discard all stored series.
+        """
+        with self._lock:
+            self._series.clear()
+
+    def _fetch(self, key):
+        metric, start, interval, nulls = key
+        with self._lock:
+            series = self._series.get(key)
+        since = _series_start(series) if series is not None else None
+        if since is None:
+            series = self.client.get_metric(metric, start, interval, nulls)
+        else:
+            new = self.client.get_metric(
+                metric, str(int(since // 1000)), interval, nulls)
+            series = _merge_series(series, new, since)
+        series = self._trim(series, start, interval)
+        with self._lock:
+            self._series[key] = series
+            if since is None:
+                self.full_fetches += 1
+            else:
+                self.incremental_fetches += 1
+        return series
+
+    def _trim(self, series, start, interval):
+        if not start.startswith("-"):
+            return series
+        try:
+            window = parse_interval(start[1:])
+            step = parse_interval(interval)
+        except ValueError:
+            return series
+        cutoff = self.clock() - window
+        cutoff = (cutoff - cutoff % step) * 1000
+        return dict(
+            (name, [point for point in points if point[u"x"] >= cutoff])
+            for name, points in series.items())
+
+
+class MetricsAggregator(object):
+    """
+    Combines metric values locally and fires them in a single request per
+    flush interval.
+
+    Values are combined according to the aggregator in each metric's name:
+    ``sum`` values are added, ``max`` and ``min`` keep the largest and
+    smallest value, ``last`` keeps the most recent value and ``avg`` keeps a
+    running total and count and fires their mean.
+
+    Note that the server averages ``avg`` metrics over the values it
+    receives, so if several flushes fall in one time period each flush is
+    weighted equally rather than by the number of values it combined.
+
+    :type client:
+        :class:`MetricsApiClient`
+    :param client:
+        The client to fire the combined metrics with.
+    :param float interval:
+        The minimum number of seconds between flushes. Defaults to ``10``.
+    :param clock:
+        A function returning the current time in seconds. Defaults to
+        :func:`time.time`.
+    """
+
+    def __init__(self, client, interval=10.0, clock=time.time):
+        self.client = client
+        self.interval = interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = clock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _merge(self, values, older=False):
+        # Find every aggregator first so that an invalid metric name leaves
+        # the pending values unchanged.
+        aggs = dict((metric, _aggregator(metric)) for metric in values)
+        for metric, value in values.items():
+            agg = aggs[metric]
+            current = self._pending.get(metric)
+            if older:
+                self._pending[metric] = _combine(agg, value, current)
+            else:
+                self._pending[metric] = _combine(agg, current, value)
+
+    def add(self, metrics):
+        """
+        Add metric values, flushing if the flush interval has passed.
+
+        :param dict metrics:
+            A mapping of metric names to floating point metric values, as
+            for :meth:`MetricsApiClient.fire`.
+
+        :raises ValueError:
+            If a metric name does not end in a valid aggregator name or a
+            value is not a number. No values are added in that case.
+        """
+        values = dict(
+            (metric, (float(value), 1)) for metric, value in metrics.items())
+        with self._lock:
+            self._merge(values)
+        if self.clock() - self._last_flush >= self.interval:
+            self.flush()
+
+    fire = add
+
+    def payload(self, pending):
+        """
+        Build the payload for :meth:`MetricsApiClient.fire` from a mapping
+        of metric names to ``(value, count)`` pairs.
+        """
+        payload = {}
+        for metric, (value, count) in pending.items():
+            if _aggregator(metric) == "avg":
+                value = value / count
+            payload[metric] = value
+        return payload
+
+    def take(self):
+        """
+        Remove and return the pending ``(value, count)`` pairs.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = self.clock()
+        return pending
+
+    def restore(self, pending):
+        """
+        Return values removed by :meth:`take` to the pending values, e.g.
+        after firing them failed.
+        """
+        with self._lock:
+            self._merge(pending, older=True)
+
+    def flush(self):
+        """
+        Fire all pending metric values in a single request.
+
+        If firing fails, the values are kept so that they are fired with the
+        next flush and the exception is raised.
+
+        :returns:
+            The result of :meth:`MetricsApiClient.fire` or ``None`` if there
+            were no pending values.
+        """
+        pending = self.take()
+        if not pending:
+            return None
+        try:
+            return self.client.fire(self.payload(pending))
+        except Exception:
+            self.restore(pending)
+            raise
+
+
+class _BufferedMetrics(object):
+    """
+    Common code for metric flushers that buffer fired values and combine
+    them with a :class:`MetricsAggregator` before firing.
+    """
+
+    def __init__(self, client, interval, max_size, overflow):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Invalid overflow policy %r, expected one of %s." % (
+                    overflow, ", ".join(OVERFLOW_POLICIES)))
+        self.client = client
+        self.interval = interval
+        self.max_size = max_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.last_flush_latency = None
+        self.max_flush_latency = 0.0
+        self._buffer = collections.deque()
+        self._aggregator = MetricsAggregator(client, interval=float('inf'))
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _items(self, metrics):
+        items = []
+        for metric, value in metrics.items():
+            _aggregator(metric)
+            items.append((metric, float(value)))
+        return items
+
+    def _enqueue(self, item):
+        if len(self._buffer) >= self.max_size:
+            self.dropped += 1
+            if self.overflow != "drop_oldest":
+                return
+            self._buffer.popleft()
+        self._buffer.append(item)
+
+    def _drain(self):
+        while self._buffer:
+            metric, value = self._buffer.popleft()
+            self._aggregator.add({metric: value})
+
+    def _fire_pending(self):
+        with self._flush_lock:
+            pending = self._aggregator.take()
+            if not pending:
+                return
+            start = time.time()
+            try:
+                self.client.fire(self._aggregator.payload(pending))
+            except Exception:
+                self._aggregator.restore(pending)
+                self.flush_errors += 1
+                log.exception("Failed to fire metrics.")
+                return
+            latency = time.time() - start
+            self.flushes += 1
+            self.flushed += len(pending)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    def stats(self):
+        """
+        Return the flusher's counters.
+
+        :returns:
+            A dict with the number of buffered values (``buffered``), values
+            dropped because the buffer was full (``dropped``), successful
+            flush requests (``flushes``), metrics fired (``flushed``), failed
+            flush requests (``flush_errors``) and the latency of the last and
+            slowest flush requests in seconds (``last_flush_latency`` and
+            ``max_flush_latency``).
+        """
+        return {
+            "buffered": len(self._buffer),
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+
+class MetricsFlusher(_BufferedMetrics):
+    """
+    Fires metrics from a background thread so that slow requests to the
+    metrics API never delay the caller.
+
+    Values passed to :meth:`fire` are added to a bounded buffer. Every
+    ``interval`` seconds the background thread combines the buffered values
+    (see :class:`MetricsAggregator`) and fires them in a single request. If
+    firing fails, the combined values are kept and fired with the next
+    flush.
+
+    :type client:
+        :class:`MetricsApiClient`
+    :param client:
+        The client to fire metrics with.
+    :param float interval:
+        The number of seconds between flushes. Defaults to ``10``.
+    :param int max_size:
+        The maximum number of buffered values. Defaults to ``10000``.
+    :param str overflow:
+        What to do when the buffer is full. ``'drop_oldest'`` (the default)
+        discards the oldest buffered value, ``'drop_newest'`` discards the
+        new value and ``'block'`` waits for the next flush.
+    """
+
+    def __init__(self, client, interval=10.0, max_size=10000,
+                 overflow="drop_oldest"):
+        super(MetricsFlusher, self).__init__(
+            client, interval, max_size, overflow)
+        self._space = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread after a final flush. If the thread was
+        never started, the final flush happens in the calling thread.
+
+        :param float timeout:
+            The maximum number of seconds to wait for the final flush.
+        """
+        self._stopping.set()
+        with self._space:
+            self._space.notify_all()
+        if self._thread is None:
+            self.flush()
+        else:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def fire(self, metrics):
+        """
+        Add metric values to the buffer.
+
+        :param dict metrics:
+            A mapping of metric names to floating point metric values, as
+            for :meth:`MetricsApiClient.fire`.
+
+        :raises ValueError:
+            If a metric name does not end in a valid aggregator name.
+        """
+        items = self._items(metrics)
+        with self._space:
+            for item in items:
+                if self.overflow == "block":
+                    while (len(self._buffer) >= self.max_size and
+                            not self._stopping.is_set()):
+                        self._space.wait()
+                self._enqueue(item)
+
+    def flush(self):
+        """
+        Fire all buffered values now.
+        """
+        with self._space:
+            self._drain()
+            self._space.notify_all()
+        self._fire_pending()
+
+
+class AsyncMetricsFlusher(_BufferedMetrics):
+    """
+    An asyncio version of :class:`MetricsFlusher`.
+
+    Flushes are scheduled on the event loop and requests to the metrics API
+    are made in the loop's default executor. :meth:`fire` returns an
+    awaitable that completes once the values have been buffered, which is
+    immediately unless ``overflow`` is ``'block'`` and the buffer is full.
+
+    This class requires Python 3.
+
+    :param loop:
+        The event loop to use. Defaults to the current event loop.
+
+    The other parameters are the same as for :class:`MetricsFlusher`.
+    """
+
+    def __init__(self, client, interval=10.0, max_size=10000,
+                 overflow="drop_oldest", loop=None):
+        if asyncio is None:
+            raise RuntimeError(
+                "AsyncMetricsFlusher requires Python 3 and asyncio.")
+        super(AsyncMetricsFlusher, self).__init__(
+            client, interval, max_size, overflow)
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._blocked = collections.deque()
+        self._handle = None
+
+    def start(self):
+        """
+        Start flushing every ``interval`` seconds.
+        """
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def stop(self):
+        """
+        Stop flushing periodically and flush any buffered values.
+
+        :returns:
+            An awaitable that completes after the final flush.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        while self._blocked:
+            items, future = self._blocked.popleft()
+            for item in items:
+                self._enqueue(item)
+            future.set_result(None)
+        return self.flush()
+
+    def _tick(self):
+        self.flush()
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def fire(self, metrics):
+        """
+        Add metric values to the buffer.
+
+        :param dict metrics:
+            A mapping of metric names to floating point metric values, as
+            for :meth:`MetricsApiClient.fire`.
+
+        :returns:
+            An awaitable that completes once the values are buffered.
+
+        :raises ValueError:
+            If a metric name does not end in a valid aggregator name.
+        """
+        items = collections.deque(self._items(metrics))
+        future = self._loop.create_future()
+        if self.overflow == "block":
+            if not self._blocked:
+                self._fill(items)
+            if items:
+                self._blocked.append((items, future))
+                return future
+        else:
+            for item in items:
+                self._enqueue(item)
+        future.set_result(None)
+        return future
+
+    def _fill(self, items):
+        while items and len(self._buffer) < self.max_size:
+            self._enqueue(items.popleft())
+
+    def flush(self):
+        """
+        Fire all buffered values now.
+
+        :returns:
+            An awaitable that completes once the values have been fired.
+        """
+        self._drain()
+        while self._blocked:
+            items, future = self._blocked[0]
+            self._fill(items)
+            if items:
+                break
+            self._blocked.popleft()
+            if not future.cancelled():
+                future.set_result(None)
+        return self._loop.run_in_executor(None, self._fire_pending)
@@ -0,0 +1,282 @@
+"""
+A local proxy that receives metrics over UDP or a Unix socket and fires them
+to Vumi Go's metrics API in batches.
+
+Short-lived processes can send metrics to the proxy without holding their
+own buffers or connections. Each datagram holds one or more lines in a
+StatsD-like syntax::
+
+    <name>:<value>|<type>[|@<sample rate>]
+
+where ``type`` is ``c`` (counter), ``g`` (gauge), ``ms`` or ``h`` (timer or
+histogram) or one of the metrics API aggregators (``sum``, ``avg``, ``max``,
+``min`` or ``last``). Counters are summed, gauges keep the last value and
+timers are averaged. If ``name`` already ends in an aggregator (e.g.
+``foo.sum``) it is used unchanged, otherwise the aggregator for ``type`` is
+appended to it.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import threading
+
+from go_http.metrics import (
+    AGGREGATORS, MetricsApiClient, MetricsFlusher, _aggregator)
+
+
+log = logging.getLogger(__name__)
+
+STATSD_TYPES = {
+    "c": "sum",
+    "g": "last",
+    "ms": "avg",
+    "h": "avg",
+}
+
+MAX_DATAGRAM_SIZE = 65535
+
+
+def parse_line(line):
+    """
+    Parse a metric line.
+
+    :param str line:
+        A line such as ``requests:1|c`` or ``latency.avg:250|ms``.
+
+    :returns:
+        A tuple ``(metric, value)`` where ``metric`` ends in an aggregator
+        name.
+
+    :raises ValueError:
+        If the line is not valid.
+    """
+    name, sep, rest = line.strip().partition(":")
+    if not sep or not name:
+        raise ValueError("Invalid metric line %r." % (line,))
+    fields = rest.split("|")
+    if len(fields) not in (2, 3):
+        raise ValueError("Invalid metric line %r." % (line,))
+    value = float(fields[0])
+    metric_type = fields[1]
+    if metric_type in STATSD_TYPES:
+        agg = STATSD_TYPES[metric_type]
+    elif metric_type in AGGREGATORS:
+        agg = metric_type
+    else:
+        raise ValueError("Invalid metric type %r." % (metric_type,))
+    if len(fields) == 3:
+        if not fields[2].startswith("@"):
+            raise ValueError("Invalid sample rate %r." % (fields[2],))
+        rate = float(fields[2][1:])
+        if not 0 < rate <= 1:
+            raise ValueError("Invalid sample rate %r." % (fields[2],))
+        if agg == "sum":
+            value = value / rate
+    try:
+        _aggregator(name)
+    except ValueError:
+        name = "%s.%s" % (name, agg)
+    return name, value
+
+
+class MetricsProxy(object):
+    """
+    Receives metric datagrams and fires them with a :class:`MetricsFlusher`.
+
+    :type flusher:
+        :class:`go_http.metrics.MetricsFlusher`
+    :param flusher:
+        The flusher that combines and fires the received metrics.
+
+    Attributes:
+        received - The number of datagrams received.
+        metrics - The number of valid metric lines received.
+        invalid - The number of lines that could not be parsed.
+    """
+
+    def __init__(self, flusher):
+        self.flusher = flusher
+        self.received = 0
+        self.metrics = 0
+        self.invalid = 0
+        self._socket = None
+        self._stopping = threading.Event()
+
+    def handle_datagram(self, data):
+        """
+        Parse the metric lines in a datagram and buffer them for firing.
+        """
+        self.received += 1
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        metrics = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                metrics.append(parse_line(line))
+            except ValueError:
+                self.invalid += 1
+                log.debug("Ignoring invalid metric line %r.", line)
+        for metric, value in metrics:
+            self.flusher.fire({metric: value})
+        self.metrics += len(metrics)
+
+    def stats(self):
+        """
+        Return the proxy's counters, including the flusher's counters (see
+        :meth:`go_http.metrics.MetricsFlusher.stats`).
+        """
+        stats = self.flusher.stats()
+        stats.update({
+            "received": self.received,
+            "metrics": self.metrics,
+            "invalid": self.invalid,
+        })
+        return stats
+
+    def _open_socket(self, family, rcvbuf):
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        if rcvbuf is not None:
+            self._socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+    def bind_udp(self, host="127.0.0.1", port=8125, rcvbuf=None):
+        """
+        Listen for datagrams on a UDP port.
+
+        :param int rcvbuf:
+            The socket receive buffer size in bytes. Datagrams that arrive
+            while the buffer is full are lost, so a larger buffer absorbs
+            bursts. Defaults to the system default.
+
+        :returns:
+            The ``(host, port)`` address bound to, which is useful if
+            ``port`` is ``0``.
+        """
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        self._open_socket(family, rcvbuf)
+        self._socket.bind((host, port))
+        return self._socket.getsockname()[:2]
+
+    def bind_unix(self, path, rcvbuf=None):
+        """
+        Listen for datagrams on a Unix datagram socket. An existing socket
+        file at ``path`` is replaced.
+
+        :param int rcvbuf:
+            The socket receive buffer size in bytes. See :meth:`bind_udp`.
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        self._open_socket(socket.AF_UNIX, rcvbuf)
+        self._socket.bind(path)
+        return path
+
+    def serve(self, timeout=0.5):
+        """
+        Start the flusher and receive datagrams until :meth:`stop` is
+        called, then stop the flusher after a final flush.
+
+        :param float timeout:
+            How often, in seconds, to check whether the proxy was stopped.
+        """
+        if self._socket is None:
+            raise RuntimeError("The proxy is not bound to a socket.")
+        self._socket.settimeout(timeout)
+        self.flusher.start()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    data = self._socket.recv(MAX_DATAGRAM_SIZE)
+                except socket.timeout:
+                    continue
+                self.handle_datagram(data)
+        finally:
+            self._socket.close()
+            self.flusher.stop()
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        self._stopping.set()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Receive StatsD-like metrics over UDP or a Unix socket "
+                    "and fire them to Vumi Go's metrics API in batches.")
+    parser.add_argument(
+        "--udp", default="127.0.0.1:8125", metavar="HOST:PORT",
+        help="UDP address to listen on (default: %(default)s).")
+    parser.add_argument(
+        "--unix", metavar="PATH",
+        help="Listen on a Unix datagram socket instead of UDP.")
+    parser.add_argument(
+        "--auth-token", default=os.environ.get("GO_METRICS_AUTH_TOKEN"),
+        help="Metrics API access token (default: $GO_METRICS_AUTH_TOKEN).")
+    parser.add_argument(
+        "--api-url", help="The full URL of the HTTP API.")
+    parser.add_argument(
+        "--interval", type=float, default=10.0,
+        help="Seconds between flushes (default: %(default)s).")
+    parser.add_argument(
+        "--max-size", type=int, default=10000,
+        help="Maximum number of buffered values (default: %(default)s).")
+    parser.add_argument(
+        "--rcvbuf", type=int,
+        help="Socket receive buffer size in bytes (default: system "
+             "default).")
+    parser.add_argument(
+        "--stats-interval", type=float, default=60.0,
+        help="Seconds between logging counters, 0 to disable "
+             "(default: %(default)s).")
+    return parser
+
+
+def _log_stats(proxy, interval):
+    while not proxy._stopping.wait(interval):
+        log.info("Metrics proxy stats: %r", proxy.stats())
+
+
+def main(argv=None):
+    """
+    Run the metrics proxy from the command line.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.auth_token:
+        parser.error("An auth token is required.")
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    client = MetricsApiClient(args.auth_token, api_url=args.api_url)
+    proxy = MetricsProxy(MetricsFlusher(
+        client, interval=args.interval, max_size=args.max_size))
+    if args.unix:
+        address = proxy.bind_unix(args.unix, rcvbuf=args.rcvbuf)
+    else:
+        host, _, port = args.udp.rpartition(":")
+        address = proxy.bind_udp(
+            host.strip("[]") or "127.0.0.1", int(port), rcvbuf=args.rcvbuf)
+    log.info("Metrics proxy listening on %s.", address)
+
+    if args.stats_interval > 0:
+        reporter = threading.Thread(
+            target=_log_stats, args=(proxy, args.stats_interval))
+        reporter.daemon = True
+        reporter.start()
+    try:
+        proxy.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.stop()
+        log.info("Metrics proxy stopped: %r", proxy.stats())
+
+
+if __name__ == "__main__":
+    main()
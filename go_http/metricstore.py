@@ -0,0 +1,343 @@
+"""
+A local store for metric series fetched from Vumi Go's metrics API.
+
+Each metric is kept in fixed-size ring buffers of packed doubles, one per
+resolution. Buckets stored at a fine resolution are rolled up into
+the coarser resolutions (e.g. one minute buckets into hours and hours into
+days), so a query at any resolution can be answered locally once the data
+it covers has been fetched. Rings can optionally be persisted in
+memory-mapped files so that the store survives restarts.
+"""
+
+import binascii
+import collections
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from go_http.metrics import _aggregator, parse_interval
+
+
+NAN = float('nan')
+
+DEFAULT_RESOLUTIONS = (("1m", 1440), ("1h", 720), ("1d", 365))
+
+_MAGIC = b"GORING01"
+_HEADER = struct.Struct("<8sdd")
+_SLOT = struct.Struct("<dddd")
+_TIME = struct.Struct("<d")
+
+
+def _rollup_value(agg, values):
+    if not values:
+        return NAN
+    if agg == "sum":
+        return sum(values)
+    if agg == "avg":
+        return sum(values) / len(values)
+    if agg == "max":
+        return max(values)
+    if agg == "min":
+        return min(values)
+    return values[-1]
+
+
+class _Ring(object):
+    """
+    A ring buffer of buckets for one metric at one resolution.
+
+    Each slot holds a bucket's start time, its value (NaN for null), the
+    time it was stored and whether it was stored directly (as opposed to
+    rolled up from a finer resolution). Slots are packed doubles read and
+    written in place, in a memory-mapped file if ``path`` is given and in a
+    ``bytearray`` otherwise.
+    """
+
+    def __init__(self, step, capacity, path=None):
+        self.step = step
+        self.capacity = capacity
+        self._mmap = None
+        empty = _HEADER.pack(_MAGIC, float(step), float(capacity)) + \
+            _SLOT.pack(NAN, NAN, 0.0, 0.0) * capacity
+        if path is None:
+            self._buffer = bytearray(empty)
+        else:
+            self._buffer = self._mmap = self._open(path, empty)
+
+    def _open(self, path, empty):
+        exists = os.path.exists(path) and os.path.getsize(path) == len(empty)
+        # The mapping holds its own descriptor, so the file can be closed.
+        with open(path, "r+b" if exists else "w+b") as f:
+            if not exists:
+                f.write(empty)
+                f.flush()
+            buf = mmap.mmap(f.fileno(), len(empty))
+        if buf[:_HEADER.size] != empty[:_HEADER.size]:
+            buf[:] = empty
+        return buf
+
+    def _index(self, bucket):
+        return int(bucket // self.step) % self.capacity
+
+    def slot(self, bucket):
+        """
+        Return the slot holding ``bucket`` or ``None``.
+        """
+        i = self._index(bucket)
+        offset = _HEADER.size + i * _SLOT.size
+        if _TIME.unpack_from(self._buffer, offset)[0] == bucket:
+            return i
+        return None
+
+    def get(self, i):
+        """
+        Return the ``(time, value, stored, direct)`` tuple in slot ``i``.
+        """
+        return _SLOT.unpack_from(self._buffer, _HEADER.size + i * _SLOT.size)
+
+    def put(self, bucket, value, stored, direct):
+        _SLOT.pack_into(
+            self._buffer, _HEADER.size + self._index(bucket) * _SLOT.size,
+            bucket, value, stored, 1.0 if direct else 0.0)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = self._buffer = None
+
+
+class MetricStore(object):
+    """
+    Stores metric buckets in ring buffers and answers queries from them.
+
+    :param resolutions:
+        A list of ``(interval, capacity)`` pairs, e.g. ``("1m", 1440)`` to
+        keep one day of one minute buckets. Each interval must be a multiple
+        of the next finer one. Defaults to one day of minutes, 30 days of
+        hours and a year of days.
+    :param str path:
+        A directory to persist the rings in, or ``None`` (the default) to
+        keep them in memory only. Each ring is a memory-mapped file that is
+        updated as buckets are stored.
+    :param int max_open:
+        The maximum number of memory-mapped rings kept open when ``path``
+        is given. Each open ring holds a file descriptor; the least recently
+        used ring is closed when the limit is reached and reopened from its
+        file when next needed. Defaults to ``128``.
+    :param clock:
+        A function returning the current time in seconds. Defaults to
+        :func:`time.time`.
+
+    Rollups are computed with the aggregator in each metric's name (e.g.
+    hourly buckets of ``foo.sum`` are the sum of the minute buckets) and are
+    only stored once every finer bucket they cover is known. Buckets stored
+    directly are not replaced by older rollups.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS, path=None,
+                 max_open=128, clock=time.time):
+        self.resolutions = sorted(
+            (parse_interval(interval), capacity)
+            for interval, capacity in resolutions)
+        for (fine, _), (coarse, _) in zip(
+                self.resolutions, self.resolutions[1:]):
+            if coarse % fine:
+                raise ValueError(
+                    "Resolution %ss is not a multiple of %ss." % (
+                        coarse, fine))
+        if max_open < len(self.resolutions):
+            raise ValueError(
+                "max_open must be at least the number of resolutions.")
+        self.path = path
+        self.max_open = max_open
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._rings = collections.OrderedDict()
+        self._metrics = set()
+
+    def __len__(self):
+        return len(self._metrics)
+
+    def _level(self, interval):
+        try:
+            step = parse_interval(interval)
+        except ValueError:
+            return None
+        for level, (resolution, _) in enumerate(self.resolutions):
+            if resolution == step:
+                return level
+        return None
+
+    def _ring(self, metric, level, create=True):
+        """
+        Return the ring for a metric and resolution. If it is not loaded,
+        it is opened from its file or, if ``create`` is ``True``, created.
+        """
+        key = (metric, level)
+        ring = self._rings.pop(key, None)
+        if ring is None:
+            step, capacity = self.resolutions[level]
+            path = None
+            if self.path is not None:
+                path = os.path.join(self.path, "%s.%d.ring" % (
+                    binascii.hexlify(metric.encode("utf-8")).decode("ascii"),
+                    step))
+                create = create or os.path.exists(path)
+            if not create:
+                return None
+            ring = _Ring(step, capacity, path)
+            self._metrics.add(metric)
+        # Mark the ring as most recently used.
+        self._rings[key] = ring
+        if self.path is not None:
+            while len(self._rings) > self.max_open:
+                self._rings.popitem(last=False)[1].close()
+        return ring
+
+    def supports(self, interval):
+        """
+        Return ``True`` if buckets of size ``interval`` are stored.
+        """
+        return self._level(interval) is not None
+
+    def add(self, metric, interval, datapoints, start=None, end=None):
+        """
+        Store a series of datapoints and roll them up into the coarser
+        resolutions.
+
+        :param str metric:
+            The metric name.
+        :param str interval:
+            The bucket size of the datapoints. Datapoints at intervals that
+            are not stored are ignored.
+        :param list datapoints:
+            Datapoints as returned by the metrics API.
+        :param float start:
+        :param float end:
+            The range, in seconds since the epoch, that was queried with
+            ``nulls="omit"``. If given, buckets entirely inside the range
+            without a datapoint are stored as nulls, since the API omits
+            them. Leave these out for other ``nulls`` modes.
+        """
+        level = self._level(interval)
+        if level is None:
+            return
+        now = self.clock()
+        step, capacity = self.resolutions[level]
+        points = {}
+        if start is not None and end is not None:
+            # Only buckets entirely inside the range are known to be null.
+            # Servers may round a partial first bucket either way.
+            first = max(start, end - step * (capacity - 1))
+            bucket = first - first % step
+            if bucket < first:
+                bucket += step
+            while bucket + step <= end:
+                points[bucket] = NAN
+                bucket += step
+        for point in datapoints:
+            value = point[u"y"]
+            points[point[u"x"] / 1000.0] = NAN if value is None else value
+        with self._lock:
+            ring = self._ring(metric, level)
+            for bucket, value in points.items():
+                ring.put(bucket, value, now, True)
+            self._rollup(metric, level, points)
+
+    def _rollup(self, metric, level, buckets):
+        try:
+            agg = _aggregator(metric)
+        except ValueError:
+            return
+        fine = self._ring(metric, level)
+        for coarse_level in range(level + 1, len(self.resolutions)):
+            coarse = self._ring(metric, coarse_level)
+            coarse_buckets = set(
+                bucket - bucket % coarse.step for bucket in buckets)
+            for bucket in coarse_buckets:
+                self._rollup_bucket(agg, fine, coarse, bucket)
+            fine, buckets = coarse, coarse_buckets
+
+    def _rollup_bucket(self, agg, fine, coarse, bucket):
+        values, stored = [], []
+        for j in range(int(coarse.step // fine.step)):
+            i = fine.slot(bucket + j * fine.step)
+            if i is None:
+                return
+            _, value, value_stored, _ = fine.get(i)
+            stored.append(value_stored)
+            if not math.isnan(value):
+                values.append(value)
+        stored = min(stored)
+        i = coarse.slot(bucket)
+        if i is not None:
+            _, _, coarse_stored, direct = coarse.get(i)
+            if direct and coarse_stored >= stored:
+                return
+        coarse.put(bucket, _rollup_value(agg, values), stored, False)
+
+    def query(self, metric, interval, start, end, nulls="keep",
+              max_age=None):
+        """
+        Return the datapoints for a range if every bucket in it is stored.
+
+        :param str metric:
+            The metric name.
+        :param str interval:
+            The bucket size.
+        :param float start:
+        :param float end:
+            The range in seconds since the epoch.
+        :param str nulls:
+            How null buckets are returned, as for
+            :meth:`go_http.metrics.MetricsApiClient.get_metric`.
+        :param float max_age:
+            How long, in seconds, buckets that were incomplete when they
+            were stored are served for. Defaults to one bucket ``interval``.
+
+        :returns:
+            A list of datapoints in the form returned by the metrics API, or
+            ``None`` if any bucket in the range is missing or too old.
+        """
+        level = self._level(interval)
+        if level is None:
+            return None
+        step, capacity = self.resolutions[level]
+        if max_age is None:
+            max_age = step
+        now = self.clock()
+        bucket = start - start % step
+        if (end - bucket) / step >= capacity:
+            return None
+        datapoints = []
+        with self._lock:
+            ring = self._ring(metric, level, create=False)
+            if ring is None:
+                return None
+            while bucket <= end:
+                i = ring.slot(bucket)
+                if i is None:
+                    return None
+                _, value, stored, _ = ring.get(i)
+                if stored < bucket + step and now - stored > max_age:
+                    return None
+                if math.isnan(value):
+                    value = 0.0 if nulls == "zeroize" else None
+                if value is not None or nulls != "omit":
+                    datapoints.append(
+                        {u"x": int(bucket * 1000), u"y": value})
+                bucket += step
+        return datapoints
+
+    def close(self):
+        """
+        Flush and close any memory-mapped files.
+        """
+        with self._lock:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings.clear()
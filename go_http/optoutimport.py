@@ -0,0 +1,258 @@
+"""
+Bulk import and removal of opt outs from CSV files.
+
+Addresses are streamed from the file, de-duplicated and sent with up to
+``concurrency`` requests at once. Progress is recorded in a checkpoint file
+so that an interrupted import can be resumed, and addresses that could not
+be updated are written to a failures file that can itself be imported
+later.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+from go_http.optouts import OptOutsApiClient
+
+
+log = logging.getLogger(__name__)
+
+PY2 = sys.version_info[0] < 3
+
+
+def _open_csv(path, mode):
+    if PY2:
+        return open(path, mode + "b")
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def _decode(value):
+    if PY2 and isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def _encode(value):
+    if PY2:
+        return value.encode("utf-8")
+    return value
+
+
+def read_addresses(path, column=0, skip_header=False):
+    """
+    Stream addresses from a CSV file.
+
+    :param str path:
+        The CSV file to read.
+    :param int column:
+        The index of the column holding the addresses. Defaults to ``0``.
+    :param bool skip_header:
+        If ``True``, the first row is skipped. Defaults to ``False``.
+
+    :return:
+        An iterator over ``(row_number, address)`` pairs, where
+        ``row_number`` counts from ``0`` and ``address`` is ``None`` for rows
+        without an address.
+    """
+    with _open_csv(path, "r") as f:
+        for row_number, row in enumerate(csv.reader(f)):
+            if skip_header and row_number == 0:
+                continue
+            address = None
+            if len(row) > column:
+                address = _decode(row[column]).strip() or None
+            yield row_number, address
+
+
+def _read_checkpoint(checkpoint_path, path, action):
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("path") != path or checkpoint.get("action") != action:
+        log.warning(
+            "Ignoring checkpoint %s for a different import.", checkpoint_path)
+        return 0
+    return checkpoint["row"]
+
+
+def _write_checkpoint(checkpoint_path, path, action, row):
+    if checkpoint_path is None:
+        return
+    tmp_path = "%s.tmp" % (checkpoint_path,)
+    with open(tmp_path, "w") as f:
+        json.dump({"path": path, "action": action, "row": row}, f)
+    os.rename(tmp_path, checkpoint_path)
+
+
+def import_optouts(client, address_type, path, delete=False, column=0,
+                   skip_header=False, checkpoint_path=None,
+                   failures_path=None, concurrency=10, retries=2,
+                   checkpoint_every=1000):
+    """
+    Set (or delete) the opt outs for the addresses in a CSV file.
+
+    :type client:
+        :class:`go_http.optouts.OptOutsApiClient`
+    :param client:
+        The opt outs API client to make the changes with.
+    :param str address_type:
+        Type of the addresses, e.g. `msisdn`.
+    :param str path:
+        The CSV file to read addresses from.
+    :param bool delete:
+        If ``True``, opt outs are deleted rather than set. Defaults to
+        ``False``.
+    :param int column:
+    :param bool skip_header:
+        See :func:`read_addresses`.
+    :param str checkpoint_path:
+        A file to record progress in. If it holds a checkpoint for the same
+        file and action, rows before the checkpoint are skipped. The
+        checkpoint is updated every ``checkpoint_every`` rows and when the
+        import finishes.
+    :param str failures_path:
+        A CSV file to append ``address,error`` rows to for addresses that
+        could not be updated.
+    :param int concurrency:
+        The maximum number of concurrent requests. Defaults to ``10``.
+    :param int retries:
+        The number of times to retry each failed request. Defaults to
+        ``2``.
+    :param int checkpoint_every:
+        How many rows to process between checkpoints. Defaults to ``1000``.
+
+    :return:
+        A dict with the number of rows read (``rows``), rows skipped
+        because of the checkpoint (``resumed``), blank (``blank``) and
+        duplicate (``duplicates``) rows, addresses updated (``updated``),
+        addresses that could not be updated (``failed``) and requests
+        retried (``retries``).
+    """
+    action = "delete" if delete else "set"
+    start_row = _read_checkpoint(checkpoint_path, path, action)
+    normalize = client.normalizer.normalize
+    stats = {
+        "rows": 0, "resumed": 0, "blank": 0, "duplicates": 0,
+        "updated": 0, "failed": 0, "retries": 0,
+    }
+    seen = set()
+    pending = {}
+    progress = {"next_row": start_row}
+
+    def addresses():
+        for row_number, address in read_addresses(path, column, skip_header):
+            stats["rows"] += 1
+            progress["next_row"] = row_number + 1
+            if row_number < start_row:
+                stats["resumed"] += 1
+                continue
+            if address is None:
+                stats["blank"] += 1
+                continue
+            address = normalize(address_type, address)
+            if address in seen:
+                stats["duplicates"] += 1
+            else:
+                seen.add(address)
+                pending[address] = row_number
+                yield address
+
+    def checkpoint_row():
+        if pending:
+            return min(pending.values())
+        return progress["next_row"]
+
+    method = client.delete_optouts if delete else client.set_optouts
+    updates = method(
+        address_type, addresses(), concurrency=concurrency, retries=retries)
+    failures = None
+    if failures_path is not None:
+        failures = _open_csv(failures_path, "a")
+    try:
+        writer = csv.writer(failures) if failures is not None else None
+        last_checkpoint = start_row
+        for address, _, error in updates:
+            del pending[address]
+            if error is not None and writer is not None:
+                writer.writerow([_encode(address), _encode(repr(error))])
+            row = checkpoint_row()
+            if row - last_checkpoint >= checkpoint_every:
+                if failures is not None:
+                    failures.flush()
+                _write_checkpoint(checkpoint_path, path, action, row)
+                last_checkpoint = row
+        _write_checkpoint(checkpoint_path, path, action, checkpoint_row())
+    finally:
+        if failures is not None:
+            failures.close()
+    stats.update({
+        "updated": updates.updated,
+        "failed": updates.errors,
+        "retries": updates.retries,
+    })
+    return stats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Set or delete Vumi Go opt outs for the addresses in a "
+                    "CSV file.")
+    parser.add_argument("csv_file", help="The CSV file to import.")
+    parser.add_argument(
+        "--address-type", default="msisdn",
+        help="Type of the addresses (default: %(default)s).")
+    parser.add_argument(
+        "--delete", action="store_true",
+        help="Delete the opt outs instead of setting them.")
+    parser.add_argument(
+        "--column", type=int, default=0,
+        help="Index of the address column (default: %(default)s).")
+    parser.add_argument(
+        "--skip-header", action="store_true",
+        help="Skip the first row of the file.")
+    parser.add_argument(
+        "--checkpoint", metavar="PATH",
+        help="File to record progress in, so the import can be resumed.")
+    parser.add_argument(
+        "--failures", metavar="PATH",
+        help="CSV file to append addresses that could not be updated to.")
+    parser.add_argument(
+        "--concurrency", type=int, default=10,
+        help="Maximum number of concurrent requests (default: %(default)s).")
+    parser.add_argument(
+        "--auth-token", default=os.environ.get("GO_OPTOUTS_AUTH_TOKEN"),
+        help="Opt outs API access token "
+             "(default: $GO_OPTOUTS_AUTH_TOKEN).")
+    parser.add_argument(
+        "--api-url", help="The full URL of the HTTP API.")
+    return parser
+
+
+def main(argv=None, client=None):
+    """
+    Run an opt out import from the command line.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if client is None:
+        if not args.auth_token:
+            parser.error("An auth token is required.")
+        client = OptOutsApiClient(args.auth_token, api_url=args.api_url)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    stats = import_optouts(
+        client, args.address_type, args.csv_file, delete=args.delete,
+        column=args.column, skip_header=args.skip_header,
+        checkpoint_path=args.checkpoint, failures_path=args.failures,
+        concurrency=args.concurrency)
+    print(", ".join(
+        "%s: %d" % (key, stats[key]) for key in sorted(stats)))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
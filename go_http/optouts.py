@@ -1,11 +1,162 @@
 """ Client for Vumi Go's opt out API.
 """
 
+import copy
 import json
-import urllib
+import threading
+import time
 
 import requests
 
+from go_http.addresses import DEFAULT_NORMALIZER
+from go_http.concurrency import imap_unordered
+
+
+_MISSING = object()
+
+
+def _is_retryable(err):
+    if isinstance(err, requests.HTTPError):
+        response = err.response
+        return response is None or response.status_code >= 500
+    return isinstance(
+        err, (requests.ConnectionError, requests.Timeout))
+
+
+class _OptOutRequests(object):
+    """
+    Makes an opt out request for each of many addresses, retrying requests
+    that fail with a connection error, a timeout or a 5xx response.
+
+    Addresses are consumed lazily and handled by up to ``concurrency``
+    threads, so memory use is bounded however many addresses there are.
+    Results are returned in the order the requests complete, as
+    ``(address, result, error)`` tuples where ``error`` is ``None`` if the
+    request succeeded and ``result`` is ``None`` if it failed.
+    """
+
+    def __init__(self, func, addresses, concurrency, retries, retry_delay):
+        self._func = func
+        self.max_retries = retries
+        self.retry_delay = retry_delay
+        self.retries = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._results = imap_unordered(self._call, addresses, concurrency)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        address, future = next(self._results)
+        error = future.exception()
+        if error is not None:
+            self.errors += 1
+            self._record(None, error)
+            return address, None, error
+        result = future.result()
+        self._record(result, None)
+        return address, result, None
+
+    next = __next__
+
+    def _record(self, result, error):
+        pass
+
+    def _call(self, address):
+        attempt = 0
+        while True:
+            try:
+                return self._func(address)
+            except Exception as err:
+                if attempt >= self.max_retries or not _is_retryable(err):
+                    raise
+            with self._lock:
+                self.retries += 1
+            time.sleep(self.retry_delay * 2 ** attempt)
+            attempt += 1
+
+
+class OptOutCheck(_OptOutRequests):
+    """
+    An iterator over the opt out status of many addresses.
+
+    Addresses are consumed lazily and checked by up to ``concurrency``
+    threads, so memory use is bounded however many addresses there are.
+    Results are returned in the order the checks complete.
+
+    Returned by :meth:`OptOutsApiClient.check_optouts`.
+
+    Attributes:
+        checked - The number of addresses checked.
+        opted_out - The number of addresses found to have opted out.
+        retries - The number of requests retried.
+        errors - The number of addresses that could not be checked.
+    """
+
+    def __init__(self, client, address_type, addresses, concurrency,
+                 retries, retry_delay):
+        self.checked = 0
+        self.opted_out = 0
+        super(OptOutCheck, self).__init__(
+            lambda address: client.get_optout(address_type, address),
+            addresses, concurrency, retries, retry_delay)
+
+    def _record(self, result, error):
+        self.checked += 1
+        if result is not None:
+            self.opted_out += 1
+
+    def stats(self):
+        """
+        Return the progress counters as a dict with the keys ``checked``,
+        ``opted_out``, ``retries`` and ``errors``.
+        """
+        return {
+            "checked": self.checked,
+            "opted_out": self.opted_out,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
+
+class OptOutUpdate(_OptOutRequests):
+    """
+    An iterator over the results of setting or deleting the opt outs of
+    many addresses.
+
+    Addresses are consumed lazily and updated by up to ``concurrency``
+    threads. Results are returned in the order the requests complete.
+
+    Returned by :meth:`OptOutsApiClient.set_optouts` and
+    :meth:`OptOutsApiClient.delete_optouts`.
+
+    Attributes:
+        updated - The number of addresses updated.
+        retries - The number of requests retried.
+        errors - The number of addresses that could not be updated.
+    """
+
+    def __init__(self, func, addresses, concurrency, retries, retry_delay):
+        self.updated = 0
+        super(OptOutUpdate, self).__init__(
+            func, addresses, concurrency, retries, retry_delay)
+
+    def _record(self, result, error):
+        if error is None:
+            self.updated += 1
+
+    def stats(self):
+        """
+        Return the progress counters as a dict with the keys ``updated``,
+        ``retries`` and ``errors``.
+        """
+        return {
+            "updated": self.updated,
+            "retries": self.retries,
+            "errors": self.errors,
+        }
+
 
 class OptOutsApiClient(object):
     """
@@ -22,9 +173,41 @@ class OptOutsApiClient(object):
         :class:`requests.Session`
     :param session:
         Requests session to use for HTTP requests. Defaults to a new session.
+
+    :type optout_cache:
+        :class:`go_http.cache.TTLCache`
+    :param optout_cache:
+        An optional cache for :meth:`get_optout` results. Opt outs are
+        cached for the cache's ``ttl``. Opt outs set or deleted through
+        this client update the cache. Changes made elsewhere are only seen
+        once cached entries expire.
+
+    :param float negative_ttl:
+        The number of seconds addresses without an opt out are cached for.
+        Defaults to the cache's ``ttl``.
+
+    :type normalizer:
+        :class:`go_http.addresses.AddressNormalizer`
+    :param normalizer:
+        Normalizes addresses before they are looked up, cached or sent, so
+        that e.g. ``+27 82 123 4567`` and ``+27821234567`` share an opt
+        out. Defaults to a normalizer without a default country code.
+
+    Requests are made for the normalized address, with the whole address
+    quoted as one path segment. For example,
+    ``get_optout('msisdn', '+27 82 123 4567')`` requests
+    ``optouts/msisdn/%2B27821234567``, and a ``/`` in an address is sent
+    as ``%2F`` rather than as a path separator.
+
+    Attributes:
+        cache_hits - The number of lookups answered by a cached opt out.
+        cache_negative_hits - The number of lookups answered by a cached
+            absence of an opt out.
+        cache_misses - The number of lookups that made a request.
     """
 
-    def __init__(self, auth_token, api_url=None, session=None):
+    def __init__(self, auth_token, api_url=None, session=None,
+                 optout_cache=None, negative_ttl=None, normalizer=None):
         self.auth_token = auth_token
         if api_url is None:
             api_url = "https://go.vumi.org/api/v1/go"
@@ -32,9 +215,18 @@ class OptOutsApiClient(object):
         if session is None:
             session = requests.Session()
         self.session = session
+        self.optout_cache = optout_cache
+        self.negative_ttl = negative_ttl
+        if normalizer is None:
+            normalizer = DEFAULT_NORMALIZER
+        self.normalizer = normalizer
+        self.cache_hits = 0
+        self.cache_negative_hits = 0
+        self.cache_misses = 0
+        self._stats_lock = threading.Lock()
 
     def _api_request(self, method, path, data=None, none_for_statuses=()):
-        url = "%s/%s" % (self.api_url, urllib.quote(path))
+        url = "%s/%s" % (self.api_url, path)
         headers = {
             "Content-Type": "application/json; charset=utf-8",
             "Authorization": "Bearer %s" % (self.auth_token,),
@@ -50,6 +242,10 @@ class OptOutsApiClient(object):
         r.raise_for_status()
         return r.json()
 
+    def _optout_uri(self, address_type, address):
+        return "optouts/%s/%s" % (
+            address_type, self.normalizer.quote(address_type, address))
+
     def get_optout(self, address_type, address):
         """
         Retrieve an opt out record.
@@ -72,11 +268,133 @@ class OptOutsApiClient(object):
                 u'user_account': u'fxxxeee',
             }
         """
-        uri = "optouts/%s/%s" % (address_type, address)
+        address = self.normalizer.normalize(address_type, address)
+        if self.optout_cache is not None:
+            optout = self.optout_cache.get(
+                (address_type, address), _MISSING)
+            with self._stats_lock:
+                if optout is None:
+                    self.cache_negative_hits += 1
+                elif optout is _MISSING:
+                    self.cache_misses += 1
+                else:
+                    self.cache_hits += 1
+            if optout is not _MISSING:
+                return copy.deepcopy(optout)
+        uri = self._optout_uri(address_type, address)
         result = self._api_request("GET", uri, none_for_statuses=(404,))
-        if result is None:
-            return None
-        return result["opt_out"]
+        optout = None if result is None else result["opt_out"]
+        return self._cache_optout(address_type, address, optout)
+
+    def _cache_optout(self, address_type, address, optout):
+        if self.optout_cache is not None:
+            if optout is None:
+                self.optout_cache.set(
+                    (address_type, address), None, ttl=self.negative_ttl)
+            else:
+                self.optout_cache.set(
+                    (address_type, address), copy.deepcopy(optout))
+        return optout
+
+    def cache_stats(self):
+        """
+        Return the opt out cache's counters.
+
+        :return:
+            A dict with the number of lookups answered by cached opt outs
+            (``hits``) and by cached absences of opt outs
+            (``negative_hits``), the number of lookups that made a request
+            (``misses``), the fraction of lookups answered from the cache
+            (``hit_rate``) and the number of cached addresses (``size``).
+        """
+        with self._stats_lock:
+            positive_hits = self.cache_hits
+            negative_hits = self.cache_negative_hits
+            misses = self.cache_misses
+        hits = positive_hits + negative_hits
+        lookups = hits + misses
+        return {
+            "hits": positive_hits,
+            "negative_hits": negative_hits,
+            "misses": misses,
+            "hit_rate": float(hits) / lookups if lookups else 0.0,
+            "size": (len(self.optout_cache)
+                     if self.optout_cache is not None else 0),
+        }
+
+    def check_optouts(self, address_type, addresses, concurrency=10,
+                      retries=2, retry_delay=0.5):
+        """
+        Check the opt out status of many addresses, making up to
+        ``concurrency`` requests at once.
+
+        :param str address_type:
+            Type of address, e.g. `msisdn`.
+        :param addresses:
+            An iterable of addresses. It is consumed lazily, so it may be a
+            generator over a very large list.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``10``.
+        :param int retries:
+            The number of times to retry a check that fails with a
+            connection error, a timeout or a 5xx response. Defaults to
+            ``2``.
+        :param float retry_delay:
+            The number of seconds to wait before the first retry of an
+            address. The delay doubles with each further retry. Defaults to
+            ``0.5``.
+
+        :return:
+            An :class:`OptOutCheck` iterator over ``(address, optout,
+            error)`` tuples. ``optout`` is the opt out record or ``None``.
+            If an address could not be checked, ``error`` is the exception
+            raised, otherwise it is ``None``.
+
+        Example::
+
+            >>> check = client.check_optouts('msisdn', addresses)
+            >>> allowed = [address for address, optout, error in check
+            ...            if optout is None and error is None]
+            >>> check.stats()
+            {'checked': 1000, 'opted_out': 12, 'retries': 3, 'errors': 0}
+        """
+        return OptOutCheck(
+            self, address_type, addresses, concurrency, retries, retry_delay)
+
+    def set_optouts(self, address_type, addresses, concurrency=10,
+                    retries=2, retry_delay=0.5):
+        """
+        Register many addresses as having opted out, making up to
+        ``concurrency`` requests at once.
+
+        Takes the same parameters as :meth:`check_optouts`.
+
+        :return:
+            An :class:`OptOutUpdate` iterator over ``(address, optout,
+            error)`` tuples, where ``optout`` is the created opt out record
+            and ``error`` is the exception raised if the request failed.
+        """
+        return OptOutUpdate(
+            lambda address: self.set_optout(address_type, address),
+            addresses, concurrency, retries, retry_delay)
+
+    def delete_optouts(self, address_type, addresses, concurrency=10,
+                       retries=2, retry_delay=0.5):
+        """
+        Remove the opt outs of many addresses, making up to
+        ``concurrency`` requests at once.
+
+        Takes the same parameters as :meth:`check_optouts`.
+
+        :return:
+            An :class:`OptOutUpdate` iterator over ``(address, optout,
+            error)`` tuples, where ``optout`` is the deleted opt out record
+            or ``None`` if there was no opt out, and ``error`` is the
+            exception raised if the request failed.
+        """
+        return OptOutUpdate(
+            lambda address: self.delete_optout(address_type, address),
+            addresses, concurrency, retries, retry_delay)
 
     def set_optout(self, address_type, address):
         """
@@ -99,9 +417,10 @@ class OptOutsApiClient(object):
                 u'user_account': u'fxxxeee',
             }
         """
-        uri = "optouts/%s/%s" % (address_type, address)
+        address = self.normalizer.normalize(address_type, address)
+        uri = self._optout_uri(address_type, address)
         result = self._api_request("PUT", uri)
-        return result["opt_out"]
+        return self._cache_optout(address_type, address, result["opt_out"])
 
     def delete_optout(self, address_type, address):
         """
@@ -125,8 +444,10 @@ class OptOutsApiClient(object):
                 u'user_account': u'fxxxeee',
             }
         """
-        uri = "optouts/%s/%s" % (address_type, address)
+        address = self.normalizer.normalize(address_type, address)
+        uri = self._optout_uri(address_type, address)
         result = self._api_request("DELETE", uri, none_for_statuses=(404,))
+        self._cache_optout(address_type, address, None)
         if result is None:
             return None
         return result["opt_out"]
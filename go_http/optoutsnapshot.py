@@ -0,0 +1,320 @@
+"""
+Memory-mapped snapshots of opted out addresses.
+
+A snapshot is a file holding a sorted array of fixed-width, UTF-8 encoded
+addresses followed by an open-addressing hash index into that array. It is
+opened with :mod:`mmap`, so many processes can share one snapshot without
+each loading a copy, and membership is tested with a hash lookup (an
+expected one or two probes), without any HTTP requests.
+
+The opt out API can't list opt outs, so a snapshot is built by checking a
+set of candidate addresses (e.g. everyone a campaign will be sent to) with
+:meth:`go_http.optouts.OptOutsApiClient.check_optouts`.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+
+from go_http.addresses import DEFAULT_NORMALIZER
+
+
+_MAGIC = b"GOOPTSN2"
+_HEADER = struct.Struct("<8sIQdq32sQ")
+_SLOT = struct.Struct("<I")
+
+
+def _hash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+
+def _build_index(keys):
+    """
+    Return an array of hash slots holding 1-based indexes into ``keys``, or
+    0 for empty slots. The number of slots is a power of two at least twice
+    the number of keys.
+    """
+    slots = 1
+    while slots < 2 * len(keys):
+        slots *= 2
+    mask = slots - 1
+    index = array('I', [0]) * slots
+    for i, key in enumerate(keys):
+        h = _hash(key) & mask
+        while index[h]:
+            h = (h + 1) & mask
+        index[h] = i + 1
+    if sys.byteorder == "big":
+        index.byteswap()
+    return index
+
+
+def _normalize(normalizer, address_type, address):
+    if isinstance(address, bytes):
+        address = address.decode("utf-8")
+    return normalizer.normalize(address_type, address).encode("utf-8")
+
+
+def write_snapshot(path, address_type, addresses, optout_count=-1,
+                   normalizer=None):
+    """
+    Write a snapshot file.
+
+    The snapshot is written to a uniquely named temporary file that is then
+    renamed to ``path``, so processes never see a partially written
+    snapshot and concurrent refreshes don't overwrite each other's files.
+
+    :param str path:
+        The snapshot file to write.
+    :param str address_type:
+        Type of the addresses, e.g. `msisdn`.
+    :param addresses:
+        An iterable of opted out addresses.
+    :param int optout_count:
+        The total number of opt outs reported by the API when the snapshot
+        was built, or ``-1`` if it is not known.
+    :type normalizer:
+        :class:`go_http.addresses.AddressNormalizer`
+    :param normalizer:
+        Normalizes the addresses before they are stored. Defaults to a
+        normalizer without a default country code.
+    """
+    if normalizer is None:
+        normalizer = DEFAULT_NORMALIZER
+    keys = sorted(set(
+        _normalize(normalizer, address_type, address)
+        for address in addresses))
+    width = max([len(key) for key in keys] or [1])
+    index = _build_index(keys)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix="%s." % (os.path.basename(path),), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(
+                _MAGIC, width, len(keys), time.time(), optout_count,
+                address_type.encode("utf-8"), len(index)))
+            for key in keys:
+                f.write(key.ljust(width, b"\0"))
+            f.write(index.tostring() if sys.version_info[0] < 3
+                    else index.tobytes())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class OptOutSnapshot(object):
+    """
+    A read-only, memory-mapped set of opted out addresses.
+
+    :param str path:
+        The snapshot file to open.
+    :type normalizer:
+        :class:`go_http.addresses.AddressNormalizer`
+    :param normalizer:
+        Normalizes addresses before they are looked up. It should match
+        the normalizer the snapshot was written with. Defaults to a
+        normalizer without a default country code.
+
+    :raises ValueError:
+        If the file is not a snapshot.
+
+    Attributes:
+        address_type - The type of the addresses in the snapshot.
+        created_at - When the snapshot was written, in seconds since the
+            epoch.
+        optout_count - The total number of opt outs reported by the API when
+            the snapshot was built, or ``-1`` if it is not known.
+    """
+
+    def __init__(self, path, normalizer=None):
+        self.path = path
+        if normalizer is None:
+            normalizer = DEFAULT_NORMALIZER
+        self.normalizer = normalizer
+        self._file = None
+        self._mmap = None
+        self._open()
+
+    def _open(self):
+        f = open(self.path, "rb")
+        try:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < _HEADER.size:
+                raise ValueError("%r is not an opt out snapshot." % (
+                    self.path,))
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            f.close()
+            raise
+        (magic, width, count, created_at, optout_count,
+         address_type, slots) = _HEADER.unpack_from(data, 0)
+        if (magic != _MAGIC or stat.st_size !=
+                _HEADER.size + width * count + _SLOT.size * slots):
+            data.close()
+            f.close()
+            raise ValueError("%r is not an opt out snapshot." % (self.path,))
+        self.close()
+        self._file, self._mmap = f, data
+        self._stat = (stat.st_ino, stat.st_mtime, stat.st_size)
+        self._width = width
+        self._count = count
+        self._mask = slots - 1
+        self._index_offset = _HEADER.size + width * count
+        self.created_at = created_at
+        self.optout_count = optout_count
+        self.address_type = address_type.rstrip(b"\0").decode("utf-8")
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._key(i).rstrip(b"\0").decode("utf-8")
+
+    def __contains__(self, address):
+        return self.contains(address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return "<OptOutSnapshot address_type=%r size=%d>" % (
+            self.address_type, self._count)
+
+    def _key(self, i):
+        offset = _HEADER.size + i * self._width
+        return self._mmap[offset:offset + self._width]
+
+    def contains(self, address):
+        """
+        Return ``True`` if ``address`` is in the snapshot.
+
+        A lookup normalizes the address and then makes an expected one or
+        two probes of the hash index. In pure Python the probes take about
+        3 microseconds and normalizing takes 2-9 microseconds, depending on
+        whether the normalizer has seen the address recently. That is slower
+        than a native set but lets many processes share one copy of the
+        snapshot.
+        """
+        key = _normalize(self.normalizer, self.address_type, address)
+        width = self._width
+        if len(key) > width:
+            return False
+        key_slot = key.ljust(width, b"\0")
+        data = self._mmap
+        mask = self._mask
+        index_offset = self._index_offset
+        h = _hash(key) & mask
+        while True:
+            i = _SLOT.unpack_from(data, index_offset + h * _SLOT.size)[0]
+            if not i:
+                return False
+            offset = _HEADER.size + (i - 1) * width
+            if data[offset:offset + width] == key_slot:
+                return True
+            h = (h + 1) & mask
+
+    def filter(self, addresses):
+        """
+        Return the addresses that are not in the snapshot.
+
+        :param addresses:
+            An iterable of addresses, e.g. the recipients of a send batch.
+
+        :return:
+            A list of the addresses that have not opted out, in their
+            original order.
+        """
+        return [
+            address for address in addresses if not self.contains(address)]
+
+    def missing(self, client=None):
+        """
+        Return the number of opt outs known to the API that are not in the
+        snapshot. These are opt outs for addresses that were not candidates
+        when the snapshot was built.
+
+        :type client:
+            :class:`go_http.optouts.OptOutsApiClient`
+        :param client:
+            If given, the current count is fetched with
+            :meth:`~go_http.optouts.OptOutsApiClient.count`. Otherwise the
+            count from when the snapshot was built is used.
+
+        Note that the API counts opt outs of every address type.
+        """
+        count = self.optout_count if client is None else client.count()
+        return max(count - self._count, 0)
+
+    def reload(self):
+        """
+        Reopen the snapshot if its file has been replaced, e.g. by
+        :meth:`build` in another process.
+
+        :return:
+            ``True`` if a new snapshot was loaded.
+        """
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime, stat.st_size) == self._stat:
+            return False
+        self._open()
+        return True
+
+    def close(self):
+        """
+        Unmap the snapshot file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    @classmethod
+    def build(cls, client, address_type, candidates, path, concurrency=10,
+              retries=2):
+        """
+        Build a snapshot of the opted out addresses among ``candidates``.
+
+        Addresses whose status could not be checked are included, so that
+        they are treated as opted out.
+
+        :type client:
+            :class:`go_http.optouts.OptOutsApiClient`
+        :param client:
+            The opt outs API client to check addresses with.
+        :param str address_type:
+            Type of address, e.g. `msisdn`.
+        :param candidates:
+            An iterable of addresses to check.
+        :param str path:
+            The snapshot file to write. An existing snapshot is replaced
+            atomically.
+        :param int concurrency:
+            The maximum number of concurrent requests. Defaults to ``10``.
+        :param int retries:
+            The number of times to retry each failed check. Defaults to
+            ``2``.
+
+        :return:
+            The new :class:`OptOutSnapshot`.
+        """
+        check = client.check_optouts(
+            address_type, candidates, concurrency=concurrency,
+            retries=retries)
+        optouts = [
+            address for address, optout, error in check
+            if optout is not None or error is not None]
+        write_snapshot(
+            path, address_type, optouts, client.count(), client.normalizer)
+        return cls(path, client.normalizer)
@@ -9,6 +9,7 @@ import uuid
 import requests
 from requests.exceptions import HTTPError
 
+from go_http.addresses import DEFAULT_NORMALIZER
 from go_http.exceptions import UserOptedOutException
 
 
@@ -35,10 +36,19 @@ class HttpApiSender(object):
     :param session:
         Requests session to use for HTTP requests. Defaults to
         a new session.
+    :param str address_type:
+        The type of the addresses sent to, e.g. `msisdn`. If given,
+        ``to_addr`` is normalized before sending. Optional.
+    :type normalizer:
+        :class:`go_http.addresses.AddressNormalizer`
+    :param normalizer:
+        Normalizes addresses when ``address_type`` is given. Defaults to a
+        normalizer without a default country code.
     """
 
     def __init__(self, account_key, conversation_key, conversation_token,
-                 api_url=None, session=None):
+                 api_url=None, session=None, address_type=None,
+                 normalizer=None):
         self.account_key = account_key
         self.conversation_key = conversation_key
         self.conversation_token = conversation_token
@@ -48,6 +58,15 @@ class HttpApiSender(object):
         if session is None:
             session = requests.Session()
         self.session = session
+        self.address_type = address_type
+        if normalizer is None:
+            normalizer = DEFAULT_NORMALIZER
+        self.normalizer = normalizer
+
+    def _to_addr(self, to_addr):
+        if self.address_type is None:
+            return to_addr
+        return self.normalizer.normalize(self.address_type, to_addr)
 
     def _api_request(self, suffix, py_data):
         url = "%s/%s/%s" % (self.api_url, self.conversation_key, suffix)
@@ -86,7 +105,7 @@ class HttpApiSender(object):
             May be one of 'new', 'resume' or 'close'. Optional.
         """
         data = {
-            "to_addr": to_addr,
+            "to_addr": self._to_addr(to_addr),
             "content": content,
         }
         if session_event is not None:
@@ -125,7 +144,7 @@ class HttpApiSender(object):
             equivalent to 'resume'.
         """
         data = {
-            "to_addr": to_addr,
+            "to_addr": self._to_addr(to_addr),
             "content": content,
         }
         if session_event is not None:
@@ -139,6 +158,46 @@ class HttpApiSender(object):
             data["helper_metadata"] = {"voice": voice}
         return self._raw_send(data)
 
+    def send_text_batch(self, to_addrs, content, optout_filter=None,
+                        session_event=None):
+        """ Send the same text message to many addresses.
+
+        :param to_addrs:
+            An iterable of addresses to send to.
+        :param str content:
+            Text to send.
+        :type optout_filter:
+            :class:`OptOutFilter`
+        :param optout_filter:
+            If given, addresses are checked with it first and only those
+            that have not opted out are sent to. Optional.
+        :param str session_event:
+            As for :meth:`send_text`.
+
+        :return:
+            A list of ``(to_addr, result)`` pairs for every address a send
+            was attempted for. ``result`` is the API response or, if sending
+            failed, the exception raised (e.g. a
+            :class:`go_http.exceptions.UserOptedOutException` if the address
+            opted out after it was checked, or an
+            :class:`requests.HTTPError`). A failed send doesn't stop the
+            batch, so the results always show who was sent to.
+        """
+        if optout_filter is not None:
+            to_addrs = optout_filter(to_addrs)
+        results = []
+        for to_addr in to_addrs:
+            try:
+                result = self.send_text(to_addr, content, session_event)
+            except UserOptedOutException as e:
+                if optout_filter is not None:
+                    optout_filter.skip(to_addr, e)
+                result = e
+            except Exception as e:
+                result = e
+            results.append((to_addr, result))
+        return results
+
     def fire_metric(self, metric, value, agg="last"):
         """ Fire a value for a metric.
 
@@ -163,6 +222,100 @@ class HttpApiSender(object):
         return self._api_request('metrics.json', data)
 
 
+class OptOutFilter(object):
+    """
+    A pre-send stage that removes addresses that have opted out, so that
+    sends to them aren't attempted.
+
+    :type client:
+        :class:`go_http.optouts.OptOutsApiClient`
+    :param client:
+        The opt outs API client to check addresses with. Give it an
+        ``optout_cache`` to avoid checking the same address repeatedly.
+    :param str address_type:
+        Type of the addresses, e.g. `msisdn`. Defaults to ``'msisdn'``.
+    :param on_skipped:
+        A function called with ``(address, reason)`` for each address that
+        is skipped. ``reason`` is the opt out record, the exception raised
+        while checking the address or the
+        :class:`go_http.exceptions.UserOptedOutException` raised when
+        sending to it. Optional.
+    :param int concurrency:
+        The maximum number of concurrent checks. Defaults to ``10``.
+    :param int retries:
+        The number of times to retry each failed check. Defaults to ``2``.
+
+    Addresses that can't be checked are skipped, so that a failing opt out
+    API doesn't result in messages to people who have opted out.
+
+    Attributes:
+        eligible - The number of addresses passed on for sending.
+        skipped - The number of addresses skipped.
+        errors - The number of addresses skipped because they couldn't be
+            checked.
+
+    Example::
+
+        >>> skipped = []
+        >>> optout_filter = OptOutFilter(
+        ...     optouts_client, on_skipped=lambda a, r: skipped.append(a))
+        >>> sender.send_text_batch(addresses, "Hello!", optout_filter)
+    """
+
+    def __init__(self, client, address_type="msisdn", on_skipped=None,
+                 concurrency=10, retries=2):
+        self.client = client
+        self.address_type = address_type
+        self.on_skipped = on_skipped
+        self.concurrency = concurrency
+        self.retries = retries
+        self.eligible = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def __call__(self, addresses):
+        """
+        Check addresses and yield those that have not opted out.
+
+        :param addresses:
+            An iterable of addresses. It is consumed lazily.
+
+        :return:
+            An iterator over the eligible addresses, in the order their
+            checks complete.
+        """
+        check = self.client.check_optouts(
+            self.address_type, addresses, concurrency=self.concurrency,
+            retries=self.retries)
+        for address, optout, error in check:
+            if error is not None:
+                self.errors += 1
+                self.skip(address, error)
+            elif optout is not None:
+                self.skip(address, optout)
+            else:
+                self.eligible += 1
+                yield address
+
+    def skip(self, address, reason):
+        """
+        Record a skipped address and pass it to ``on_skipped``.
+        """
+        self.skipped += 1
+        if self.on_skipped is not None:
+            self.on_skipped(address, reason)
+
+    def stats(self):
+        """
+        Return the filter's counters as a dict.
+        """
+        return {
+            "eligible": self.eligible,
+            "skipped": self.skipped,
+            "errors": self.errors,
+        }
+
+
 class LoggingSender(HttpApiSender):
     """
     A helper for pretending to sending text messages and fire metrics by
@@ -177,6 +330,8 @@ class LoggingSender(HttpApiSender):
     def __init__(self, logger, level=logging.INFO):
         self._logger = logging.getLogger(logger)
         self._level = level
+        self.address_type = None
+        self.normalizer = DEFAULT_NORMALIZER
 
     def _api_request(self, suffix, py_data):
         if suffix == "messages.json":
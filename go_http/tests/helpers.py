@@ -0,0 +1,15 @@
+"""
+Helpers shared by the tests.
+"""
+
+
+class FakeClock(object):
+    """ A clock for code that takes a ``clock`` function, which returns
+    ``now`` until a test changes it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
@@ -43,6 +43,9 @@ class FakeAccountApi(object):
         self.api_path = api_path
         self.auth_token = auth_token
         self.responses = collections.defaultdict(list)
+        self.requests = []
+        self.dropped_ids = set()
+        self.batch_error = None
 
     def http_error_response(self, http_code, error):
         return Resp("403 Forbidden", 403, headers={})
@@ -61,6 +64,9 @@ class FakeAccountApi(object):
             "result": result,
         }), 200, headers={})
 
+    def jsonrpc_batch_response(self, responses):
+        return Resp(json.dumps(responses), 200, headers={})
+
     def add_success_response(self, method, params, result):
         self.responses[method].append((params, copy.deepcopy(result), None))
 
@@ -78,12 +84,40 @@ class FakeAccountApi(object):
             return self.jsonrpc_error_response(
                 "Fault", 8000, "Only POST method supported")
         data = json.loads(request.body)
+        self.requests.append(data)
+        if isinstance(data, list):
+            return self.handle_batch(data)
         params, result, error = self.responses[data['method']].pop()
         assert params == data['params']
         if error is not None:
             return self.jsonrpc_error_response(**error)
         return self.jsonrpc_success_response(result)
 
+    def handle_batch(self, calls):
+        """
+        Respond to a batch of calls, in reverse order to check that the
+        client matches responses by id.
+        """
+        if self.batch_error is not None:
+            return self.jsonrpc_error_response(**self.batch_error)
+        responses = []
+        for call in reversed(calls):
+            if call['id'] in self.dropped_ids:
+                continue
+            params, result, error = self.responses[call['method']].pop()
+            assert params == call['params']
+            response = {"jsonrpc": "2.0", "id": call['id']}
+            if error is not None:
+                response["error"] = {
+                    "fault": error["fault"],
+                    "faultCode": error["fault_code"],
+                    "faultString": error["fault_string"],
+                }
+            else:
+                response["result"] = result
+            responses.append(response)
+        return self.jsonrpc_batch_response(responses)
+
 
 class TestAccountApiClient(TestCase):
     API_URL = "http://example.com/go"
@@ -225,3 +259,76 @@ class TestAccountApiClient(TestCase):
         self.assertEqual(
             client.update_routing_table("campaign-1", fixtures.routing_table),
             None)
+
+    def add_overview_responses(self):
+        for method in ["conversations", "channels", "routers",
+                       "routing_entries"]:
+            self.account_backend.add_success_response(
+                method, ["campaign-1"], getattr(fixtures, method))
+
+    def test_batch(self):
+        client = self.make_client()
+        self.account_backend.add_success_response(
+            "campaigns", [], fixtures.campaigns)
+        self.account_backend.add_error_response(
+            "channels", ["campaign-1"],
+            fault="Fault", fault_code=8002, fault_string="Meep")
+        self.account_backend.add_success_response(
+            "routers", ["campaign-1"], fixtures.routers)
+        campaigns, channels, routers = client.batch([
+            ("campaigns", []),
+            ("channels", ["campaign-1"]),
+            ("routers", ["campaign-1"]),
+        ])
+        self.assertEqual(campaigns, fixtures.campaigns)
+        self.assertTrue(isinstance(channels, JsonRpcException))
+        self.assertEqual(channels.fault_code, 8002)
+        self.assertEqual(routers, fixtures.routers)
+        [request] = self.account_backend.requests
+        self.assertEqual([call['id'] for call in request], [0, 1, 2])
+
+    def test_batch_missing_response(self):
+        client = self.make_client()
+        self.account_backend.add_success_response(
+            "campaigns", [], fixtures.campaigns)
+        self.account_backend.dropped_ids.add(1)
+        campaigns, missing = client.batch([
+            ("campaigns", []),
+            ("channels", ["campaign-1"]),
+        ])
+        self.assertEqual(campaigns, fixtures.campaigns)
+        self.assertTrue(isinstance(missing, JsonRpcException))
+
+    def test_batch_rejected(self):
+        client = self.make_client()
+        self.account_backend.batch_error = dict(
+            fault="Fault", fault_code=8000, fault_string="Meep")
+        err = self.assert_jsonrpc_exception(
+            client.batch, [("campaigns", [])])
+        self.assertEqual(err.fault_code, 8000)
+
+    def test_batch_empty(self):
+        client = self.make_client()
+        self.assertEqual(client.batch([]), [])
+        self.assertEqual(self.account_backend.requests, [])
+
+    def test_overview(self):
+        client = self.make_client()
+        self.add_overview_responses()
+        self.assertEqual(client.overview("campaign-1"), {
+            "conversations": fixtures.conversations,
+            "channels": fixtures.channels,
+            "routers": fixtures.routers,
+            "routing_entries": fixtures.routing_entries,
+        })
+        self.assertEqual(len(self.account_backend.requests), 1)
+
+    def test_overview_error(self):
+        client = self.make_client()
+        self.add_overview_responses()
+        self.account_backend.responses["routers"] = []
+        self.account_backend.add_error_response(
+            "routers", ["campaign-1"],
+            fault="Fault", fault_code=8002, fault_string="Meep")
+        err = self.assert_jsonrpc_exception(client.overview, "campaign-1")
+        self.assertEqual(err.fault_code, 8002)
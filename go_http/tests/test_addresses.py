@@ -0,0 +1,82 @@
+"""
+Tests for go_http.addresses.
+"""
+
+from unittest import TestCase
+
+from go_http.addresses import AddressNormalizer, normalize_address
+
+
+class TestAddressNormalizer(TestCase):
+
+    def setUp(self):
+        self.normalizer = AddressNormalizer(default_country_code="27")
+
+    def assert_normalized(self, address_type, address, expected):
+        self.assertEqual(
+            self.normalizer.normalize(address_type, address), expected)
+
+    def test_msisdn_formats(self):
+        for address in [u"+27821234567", u"0821234567", u"27821234567",
+                        u"0027821234567", u"+27 (82) 123-4567",
+                        u" 082.123.4567 "]:
+            self.assert_normalized(u"msisdn", address, u"+27821234567")
+
+    def test_msisdn_other_country(self):
+        self.assert_normalized(u"msisdn", u"+1 555 0100", u"+15550100")
+        self.assert_normalized(u"msisdn", u"0044 20 7946", u"+44207946")
+
+    def test_msisdn_without_default_country_code(self):
+        normalizer = AddressNormalizer()
+        self.assertEqual(
+            normalizer.normalize(u"msisdn", u"082 123 4567"), u"0821234567")
+        self.assertEqual(
+            normalizer.normalize(u"msisdn", u"+27 82 123 4567"),
+            u"+27821234567")
+
+    def test_msisdn_not_a_number(self):
+        self.assert_normalized(u"msisdn", u" shortcode ", u"shortcode")
+
+    def test_case_insensitive_types(self):
+        self.assert_normalized(u"twitter_handle", u" @Vumi ", u"@vumi")
+        self.assert_normalized(
+            u"gtalk_id", u"Someone@Example.com", u"someone@example.com")
+
+    def test_case_sensitive_types(self):
+        self.assert_normalized(u"mxit_id", u" MixedCase ", u"MixedCase")
+        self.assert_normalized(u"custom", u"ABC", u"ABC")
+        normalizer = AddressNormalizer(case_insensitive_types=[u"custom"])
+        self.assertEqual(normalizer.normalize(u"custom", u"ABC"), u"abc")
+        self.assertEqual(
+            normalizer.normalize(u"twitter_handle", u"@Vumi"), u"@Vumi")
+
+    def test_bytes(self):
+        self.assert_normalized(
+            u"mxit_id", u"\u00e9t".encode("utf-8"), u"\u00e9t")
+        self.assert_normalized(u"msisdn", b"082 123 4567", u"+27821234567")
+        self.assertEqual(
+            self.normalizer.quote(u"mxit_id", u"\u00e9t".encode("utf-8")),
+            u"%C3%A9t")
+
+    def test_quote(self):
+        self.assertEqual(
+            self.normalizer.quote(u"msisdn", u"082 123 4567"),
+            u"%2B27821234567")
+        self.assertEqual(
+            self.normalizer.quote(u"twitter_handle", u"@a/b"), u"%40a%2Fb")
+        self.assertEqual(
+            self.normalizer.quote(u"mxit_id", u"\u00c9t\u00e9"),
+            u"%C3%89t%C3%A9")
+
+    def test_results_cached(self):
+        normalizer = AddressNormalizer(max_size=2)
+        for _ in range(3):
+            normalizer.normalize(u"msisdn", u"+27821234567")
+        self.assertAlmostEqual(normalizer.hit_rate, 2.0 / 3)
+        normalizer.normalize(u"msisdn", u"+27821234568")
+        normalizer.normalize(u"msisdn", u"+27821234569")
+        self.assertEqual(len(normalizer._cache), 2)
+
+    def test_normalize_address(self):
+        self.assertEqual(
+            normalize_address(u"msisdn", u"+27 82 123 4567"), u"+27821234567")
@@ -0,0 +1,168 @@
+"""
+Tests for go_http.async_contacts.
+"""
+
+import json
+import threading
+from unittest import TestCase, skipIf
+
+from requests_testadapter import TestAdapter, TestSession
+
+from go_http.async_contacts import AsyncContactsApiClient, asyncio
+from go_http.exceptions import PagedException
+
+
+@skipIf(asyncio is None, "asyncio is not available")
+class TestAsyncContactsApiClient(TestCase):
+    API_URL = "http://example.com/go"
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.session = TestSession()
+        self.client = AsyncContactsApiClient(
+            "auth_token", api_url=self.API_URL, session=self.session,
+            max_workers=4, loop=self.loop)
+
+    def tearDown(self):
+        self.client.close()
+        self.loop.close()
+
+    def mount(self, path, data, status=200):
+        self.session.mount(
+            "%s/%s" % (self.API_URL, path),
+            TestAdapter(json.dumps(data).encode("utf-8"), status=status))
+
+    def mount_pages(self, path, pages):
+        cursor = None
+        for i, contacts in enumerate(pages):
+            next_cursor = u"c%d" % (i + 1,) if i + 1 < len(pages) else None
+            page_path = path if cursor is None else "%s?cursor=%s" % (
+                path, cursor)
+            self.mount(page_path, {u"cursor": next_cursor, u"data": contacts})
+            cursor = next_cursor
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def collect(self, iterator):
+        items = []
+        while True:
+            try:
+                items.append(self.wait(iterator.__anext__()))
+            except StopAsyncIteration:  # noqa: F821
+                return items
+
+    def test_default_session(self):
+        import requests
+        client = AsyncContactsApiClient("auth_token", loop=self.loop)
+        self.assertTrue(isinstance(client.client.session, requests.Session))
+        self.assertEqual(
+            client.client.api_url, "https://go.vumi.org/api/v1/go")
+        client.close()
+
+    def test_get_contact(self):
+        contact = {u"key": u"abc", u"msisdn": u"+1234"}
+        self.mount("contacts/abc", contact)
+        self.assertEqual(self.wait(self.client.get_contact("abc")), contact)
+
+    def test_create_and_delete_group(self):
+        group = {u"key": u"g1", u"name": u"Bob"}
+        self.mount("groups/", group)
+        self.mount("groups/g1", group)
+        self.assertEqual(
+            self.wait(self.client.create_group({u"name": u"Bob"})), group)
+        self.assertEqual(self.wait(self.client.delete_group("g1")), group)
+
+    def test_contacts_multiple_pages(self):
+        self.mount_pages("contacts/", [
+            [{u"key": u"a"}, {u"key": u"b"}],
+            [{u"key": u"c"}],
+        ])
+        contacts = self.collect(self.client.contacts())
+        self.assertEqual(
+            [c[u"key"] for c in contacts], [u"a", u"b", u"c"])
+
+    def test_contacts_small_batches(self):
+        self.client.BATCH_SIZE = 1
+        self.mount_pages("contacts/", [[{u"key": u"a"}, {u"key": u"b"}]])
+        contacts = self.collect(self.client.contacts(fields=["key"]))
+        self.assertEqual(contacts, [{u"key": u"a"}, {u"key": u"b"}])
+
+    def test_contacts_paged_failure(self):
+        self.mount_pages("contacts/", [[{u"key": u"a"}], [{u"key": u"b"}]])
+        self.mount("contacts/?cursor=c1", "API is down", status=500)
+        it = self.client.contacts()
+        self.assertEqual(self.wait(it.__anext__()), {u"key": u"a"})
+        try:
+            self.wait(it.__anext__())
+        except PagedException as err:
+            self.assertEqual(err.cursor, u"c1")
+        else:
+            self.fail("Expected PagedException.")
+        self.assertEqual(self.collect(it), [])
+
+    def test_cancelled_next_keeps_batch(self):
+        self.mount_pages("contacts/", [
+            [{u"key": u"a"}, {u"key": u"b"}], [{u"key": u"c"}]])
+        release = threading.Event()
+        send = self.session.send
+
+        def slow_send(*args, **kw):
+            release.wait(5)
+            return send(*args, **kw)
+
+        self.session.send = slow_send
+        it = self.client.contacts()
+        self.assertRaises(
+            asyncio.TimeoutError, self.wait,
+            asyncio.wait_for(it.__anext__(), 0.01))
+        release.set()
+        self.assertEqual(
+            [c[u"key"] for c in self.collect(it)], [u"a", u"b", u"c"])
+
+    def time_out_slow_next(self, it):
+        """
+        Time out waiting for the first batch from ``it`` and then wait for
+        the worker to finish the batch without running the event loop.
+        """
+        release = threading.Event()
+        send = self.session.send
+
+        def slow_send(*args, **kw):
+            release.wait(5)
+            return send(*args, **kw)
+
+        self.session.send = slow_send
+        self.assertRaises(
+            asyncio.TimeoutError, self.wait,
+            asyncio.wait_for(it.__anext__(), 0.01))
+        release.set()
+        self.client._executor.shutdown(wait=True)
+
+    def test_timed_out_last_batch_not_lost(self):
+        self.mount_pages("contacts/", [[{u"key": u"a"}, {u"key": u"b"}]])
+        it = self.client.contacts()
+        self.time_out_slow_next(it)
+        self.assertEqual(
+            [c[u"key"] for c in self.collect(it)], [u"a", u"b"])
+
+    def test_timed_out_batch_before_failure(self):
+        self.mount_pages("contacts/", [[{u"key": u"a"}], [{u"key": u"b"}]])
+        self.mount("contacts/?cursor=c1", "API is down", status=500)
+        it = self.client.contacts()
+        self.time_out_slow_next(it)
+        self.assertEqual(self.wait(it.__anext__()), {u"key": u"a"})
+        self.assertRaises(PagedException, self.wait, it.__anext__())
+        self.assertEqual(self.collect(it), [])
+
+    def test_concurrent_group_exports(self):
+        self.mount_pages("groups/g1/contacts", [
+            [{u"key": u"a"}], [{u"key": u"b"}]])
+        self.mount_pages("groups/g2/contacts", [
+            [{u"key": u"c"}], [{u"key": u"d"}]])
+        it1 = self.client.group_contacts("g1")
+        it2 = self.client.group_contacts("g2")
+        results = self.wait(asyncio.gather(it1.__anext__(), it2.__anext__()))
+        self.assertEqual(results, [{u"key": u"a"}, {u"key": u"c"}])
+        self.assertEqual(self.collect(it1), [{u"key": u"b"}])
+        self.assertEqual(self.collect(it2), [{u"key": u"d"}])
@@ -0,0 +1,78 @@
+"""
+Tests for go_http.cache.
+"""
+
+from unittest import TestCase
+
+from go_http.cache import TTLCache
+from go_http.tests.helpers import FakeClock
+
+
+class TestTTLCache(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_cache(self, **kw):
+        kw.setdefault("clock", self.clock)
+        return TTLCache(**kw)
+
+    def test_get_and_set(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("a", "default"), "default")
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertTrue("a" in cache)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(repr(cache), "<TTLCache size=1 hits=1 misses=2>")
+
+    def test_hit_rate(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.hit_rate, 0.0)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_expiry(self):
+        cache = self.make_cache(ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=20)
+        cache.set("c", 3, ttl=float('inf'))
+        self.clock.now += 10
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("b"), 2)
+        self.clock.now += 10
+        self.assertEqual(cache.get("b"), None)
+        self.clock.now += 1e9
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_lru_eviction(self):
+        cache = self.make_cache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_delete_and_clear(self):
+        cache = self.make_cache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("missing")
+        self.assertEqual(cache.get("a"), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_none_values(self):
+        cache = self.make_cache()
+        missing = object()
+        cache.set("a", None)
+        self.assertEqual(cache.get("a", missing), None)
+        self.assertEqual(cache.get("b", missing), missing)
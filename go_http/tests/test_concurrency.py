@@ -0,0 +1,171 @@
+"""
+Tests for go_http.concurrency.
+"""
+
+import threading
+from unittest import TestCase
+
+from concurrent.futures import Future
+
+from go_http import concurrency
+from go_http.concurrency import SingleFlight, imap_unordered
+
+
+class Interrupt(BaseException):
+    """ A stand-in for KeyboardInterrupt.
+    """
+
+
+class CountingFuture(Future):
+    """ A future that counts the calls waiting on its result.
+    """
+    waiting = 0
+
+    def result(self, timeout=None):
+        CountingFuture.waiting += 1
+        return super(CountingFuture, self).result(timeout)
+
+
+class TestImapUnordered(TestCase):
+
+    def test_results(self):
+        results = dict(
+            (item, future.result())
+            for item, future in imap_unordered(lambda x: x * 2, range(10), 3))
+        self.assertEqual(results, dict((i, i * 2) for i in range(10)))
+
+    def test_errors(self):
+        def func(x):
+            if x == 2:
+                raise ValueError(x)
+            return x
+
+        errors = [
+            item for item, future in imap_unordered(func, range(5), 2)
+            if future.exception() is not None]
+        self.assertEqual(errors, [2])
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        all_running = threading.Event()
+        release = threading.Event()
+        state = {"running": 0, "max": 0, "consumed": 0}
+        results = []
+
+        def items():
+            for i in range(20):
+                state["consumed"] += 1
+                yield i
+
+        def func(x):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+                if state["running"] == 4:
+                    all_running.set()
+            release.wait(5)
+            with lock:
+                state["running"] -= 1
+            return x
+
+        consumer = threading.Thread(target=lambda: results.extend(
+            imap_unordered(func, items(), 4)))
+        consumer.start()
+        self.addCleanup(release.set)
+        self.assertTrue(all_running.wait(5))
+        # Give the consumer time to pull more items than it should.
+        release.wait(0.05)
+        # At most four items are in flight and a fifth waits for a worker.
+        self.assertTrue(state["consumed"] <= 5)
+        self.assertEqual(state["running"], 4)
+        release.set()
+        consumer.join()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(state["max"], 4)
+
+
+class TestSingleFlight(TestCase):
+
+    def patch_future(self):
+        CountingFuture.waiting = 0
+        self.addCleanup(setattr, concurrency, "Future", Future)
+        concurrency.Future = CountingFuture
+
+    def test_single_call(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.call("a", lambda: 5), (5, False))
+
+    def test_concurrent_calls_coalesced(self):
+        self.patch_future()
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        def call():
+            results.append(flight.call("a", slow))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=call) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while CountingFuture.waiting < 3:
+            release.wait(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            sorted(results), [("result", False)] + [("result", True)] * 3)
+        self.assertEqual(flight._calls, {})
+
+    def test_errors_shared(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, flight.call, "a", fail)
+        self.assertEqual(flight._calls, {})
+
+    def test_base_exceptions_shared(self):
+        self.patch_future()
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        raised = []
+
+        def interrupted():
+            started.set()
+            release.wait(5)
+            raise Interrupt()
+
+        def call():
+            try:
+                flight.call("a", interrupted)
+            except Interrupt:
+                raised.append(1)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while CountingFuture.waiting < 1:
+            release.wait(0.001)
+        release.set()
+        leader.join()
+        follower.join(5)
+        self.assertFalse(follower.is_alive())
+        self.assertEqual(raised, [1, 1])
+        self.assertEqual(flight._calls, {})
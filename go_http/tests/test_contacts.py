@@ -2,6 +2,7 @@
 Tests for go_http.contacts.
 """
 
+import json
 from unittest import TestCase
 
 from requests import HTTPError
@@ -10,7 +11,9 @@ from requests_testadapter import TestSession, Resp, TestAdapter
 
 from fake_go_contacts import Request, FakeContactsApi
 
-from go_http.contacts import ContactsApiClient
+from go_http.cache import TTLCache
+from go_http.contacts import (
+    AdaptivePageSize, ContactsApiClient, _iter_json_object)
 from go_http.exceptions import PagedException
 
 
@@ -40,6 +43,22 @@ class FakeContactsApiAdapter(HTTPAdapter):
         return r
 
 
+class OnceAdapter(TestAdapter):
+    """
+    A TestAdapter that fails if it is asked for a second response.
+    """
+
+    def __init__(self, *args, **kw):
+        super(OnceAdapter, self).__init__(*args, **kw)
+        self.sent = 0
+
+    def send(self, request, *args, **kw):
+        self.sent += 1
+        if self.sent > 1:
+            raise AssertionError("Page requested more than once.")
+        return super(OnceAdapter, self).send(request, *args, **kw)
+
+
 make_contact_dict = FakeContactsApi.make_contact_dict
 make_group_dict = FakeContactsApi.make_group_dict
 
@@ -66,9 +85,10 @@ class TestContactsApiClient(TestCase):
     def simulate_api_up(self):
         self.session.mount(self.API_URL, self.adapter)
 
-    def make_client(self, auth_token=AUTH_TOKEN):
+    def make_client(self, auth_token=AUTH_TOKEN, group_cache=None):
         return ContactsApiClient(
-            auth_token, api_url=self.API_URL, session=self.session)
+            auth_token, api_url=self.API_URL, session=self.session,
+            group_cache=group_cache)
 
     def make_existing_contact(self, contact_data):
         existing_contact = make_contact_dict(contact_data)
@@ -206,6 +226,112 @@ class TestContactsApiClient(TestCase):
         self.assert_contacts_equal(
             contacts + [last_contact], expected_contacts)
 
+    def test_contacts_streamed_multiple_pages(self):
+        expected_contacts = self.make_n_contacts(
+            self.MAX_CONTACTS_PER_PAGE + 1)
+        contacts_api = self.make_client()
+        contacts = list(contacts_api.contacts(stream=True))
+        self.assert_contacts_equal(contacts, expected_contacts)
+
+    def test_contacts_streamed_no_results(self):
+        contacts_api = self.make_client()
+        contacts = list(contacts_api.contacts(stream=True))
+        self.assertEqual(contacts, [])
+
+    def test_contacts_streamed_multiple_pages_with_failure(self):
+        expected_contacts = self.make_n_contacts(
+            self.MAX_CONTACTS_PER_PAGE + 1)
+
+        contacts_api = self.make_client()
+        it = contacts_api.contacts(stream=True)
+        contacts = [it.next() for _ in range(self.MAX_CONTACTS_PER_PAGE)]
+        self.simulate_api_down()
+        err = self.assert_paged_exception(it.next)
+
+        self.simulate_api_up()
+        [last_contact] = list(
+            contacts_api.contacts(start_cursor=err.cursor, stream=True))
+
+        self.assert_contacts_equal(
+            contacts + [last_contact], expected_contacts)
+
+    def test_contacts_streamed_page_without_cursor(self):
+        self.make_n_contacts(3)
+        contacts_api = self.make_client()
+        it = contacts_api.contacts(stream=True, page_size=2)
+        contacts = [next(it) for _ in range(2)]
+        self.assertEqual(len(contacts), 2)
+        self.session.mount(
+            self.API_URL + "/contacts/?cursor=",
+            OnceAdapter(json.dumps({"data": []}).encode("utf-8"), 200))
+        err = self.assert_paged_exception(lambda: next(it))
+        self.assertTrue(err.cursor is not None)
+        self.assertTrue(isinstance(err.error, ValueError))
+
+    def test_contacts_fields(self):
+        self.make_existing_contact({
+            u"msisdn": u"+15556483",
+            u"name": u"Arthur",
+            u"extra": {
+                u"quest": u"Grail",
+                u"sidekick": u"Percy",
+            },
+        })
+        contacts_api = self.make_client()
+        [contact] = list(contacts_api.contacts(
+            fields=["msisdn", "extra.quest", "missing"]))
+        self.assertEqual(contact, {
+            u"msisdn": u"+15556483",
+            u"extra": {u"quest": u"Grail"},
+        })
+
+    def test_contacts_fields_whole_field_wins(self):
+        existing_contact = self.make_existing_contact({
+            u"msisdn": u"+15556483",
+            u"extra": {
+                u"quest": u"Grail",
+                u"sidekick": u"Percy",
+            },
+        })
+        contacts_api = self.make_client()
+        [contact] = list(contacts_api.contacts(
+            stream=True, fields=["extra.quest", "extra", "key"]))
+        self.assertEqual(contact, {
+            u"key": existing_contact[u"key"],
+            u"extra": existing_contact[u"extra"],
+        })
+
+    def test_contacts_page_size(self):
+        expected_contacts = self.make_n_contacts(7)
+        contacts_api = self.make_client()
+        contacts = list(contacts_api.contacts(page_size=3))
+        self.assert_contacts_equal(contacts, expected_contacts)
+        stats = contacts_api.pagination_stats
+        self.assertEqual(stats.pages, 3)
+        self.assertEqual(stats.contacts, 7)
+        self.assertTrue(stats.bytes > 0)
+
+    def test_contacts_streamed_page_size(self):
+        expected_contacts = self.make_n_contacts(7)
+        contacts_api = self.make_client()
+        contacts = list(contacts_api.contacts(stream=True, page_size=2))
+        self.assert_contacts_equal(contacts, expected_contacts)
+        stats = contacts_api.pagination_stats
+        self.assertEqual(stats.pages, 4)
+        self.assertEqual(stats.contacts, 7)
+        self.assertTrue(stats.bytes > 0)
+
+    def test_contacts_adaptive_page_size(self):
+        expected_contacts = self.make_n_contacts(
+            self.MAX_CONTACTS_PER_PAGE + 1)
+        page_size = AdaptivePageSize(initial_size=1, min_size=1)
+        contacts_api = self.make_client()
+        contacts = list(contacts_api.contacts(page_size=page_size))
+        self.assert_contacts_equal(contacts, expected_contacts)
+        # Pages are fast, so the page size doubles after each page.
+        self.assertEqual(contacts_api.pagination_stats.pages, 4)
+        self.assertEqual(page_size.size, 16)
+
     def test_create_contact(self):
         contacts = self.make_client()
         contact_data = {
@@ -303,6 +429,21 @@ class TestContactsApiClient(TestCase):
         self.assert_http_error(
             400, contacts.get_contact, msisdn='+12345')
 
+    def test_get_contacts(self):
+        contacts = self.make_client()
+        existing_contacts = self.make_n_contacts(5)
+        keys = [contact[u"key"] for contact in existing_contacts]
+
+        result = contacts.get_contacts(keys + [keys[0], u"missing"])
+        expected = dict(
+            (contact[u"key"], contact) for contact in existing_contacts)
+        expected[u"missing"] = None
+        self.assertEqual(result, expected)
+
+    def test_get_contacts_error(self):
+        contacts = self.make_client(auth_token="bogus_token")
+        self.assert_http_error(403, contacts.get_contacts, ["foo", "bar"])
+
     def test_update_contact(self):
         contacts = self.make_client()
         existing_contact = self.make_existing_contact({
@@ -472,6 +613,72 @@ class TestContactsApiClient(TestCase):
         client = self.make_client()
         self.assert_http_error(404, client.delete_group, 'foo')
 
+    def test_groups(self):
+        expected_groups = [
+            self.make_existing_group({u'name': u'Group %d' % i})
+            for i in range(self.MAX_CONTACTS_PER_PAGE + 1)]
+        client = self.make_client()
+        groups = list(client.groups())
+        self.assertEqual(
+            sorted(groups, key=lambda g: g[u'key']),
+            sorted(expected_groups, key=lambda g: g[u'key']))
+
+    def test_get_group_cached(self):
+        cache = TTLCache()
+        client = self.make_client(group_cache=cache)
+        existing_group = self.make_existing_group({
+            u'name': u'Bob',
+        })
+        group = client.get_group(existing_group[u'key'])
+        self.assertEqual(group, existing_group)
+
+        # Changes made elsewhere aren't seen until the entry expires.
+        self.groups_data[existing_group[u'key']][u'name'] = u'Susan'
+        group[u'name'] = u'Mutated'
+        self.assertEqual(
+            client.get_group(existing_group[u'key'])[u'name'], u'Bob')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.clear()
+        self.assertEqual(
+            client.get_group(existing_group[u'key'])[u'name'], u'Susan')
+
+    def test_group_cache_writes(self):
+        cache = TTLCache()
+        client = self.make_client(group_cache=cache)
+        group = client.create_group({u'name': u'Bob'})
+        self.assertEqual(cache.get(group[u'key']), group)
+
+        client.update_group(group[u'key'], {u'name': u'Susan'})
+        self.assertEqual(cache.get(group[u'key'])[u'name'], u'Susan')
+        self.assertEqual(
+            client.get_group(group[u'key'])[u'name'], u'Susan')
+
+        client.delete_group(group[u'key'])
+        self.assertTrue(group[u'key'] not in cache)
+        self.assert_http_error(404, client.get_group, group[u'key'])
+
+    def test_group_cache_failed_update(self):
+        cache = TTLCache()
+        client = self.make_client(group_cache=cache)
+        cache.set(u'foo', {u'key': u'foo'})
+        self.assert_http_error(404, client.update_group, u'foo', {})
+        self.assertTrue(u'foo' not in cache)
+
+    def test_warm_group_cache(self):
+        cache = TTLCache()
+        client = self.make_client(group_cache=cache)
+        groups = [
+            self.make_existing_group({u'name': u'Group %d' % i})
+            for i in range(self.MAX_CONTACTS_PER_PAGE + 1)]
+        self.assertEqual(client.warm_group_cache(), len(groups))
+        self.simulate_api_down()
+        for group in groups:
+            self.assertEqual(client.get_group(group[u'key']), group)
+
+    def test_warm_group_cache_without_cache(self):
+        client = self.make_client()
+        self.assertRaises(ValueError, client.warm_group_cache)
+
     def test_group_contacts_multiple_pages_with_cursor(self):
         self.make_existing_group({
             u'name': 'key',
@@ -538,6 +745,40 @@ class TestContactsApiClient(TestCase):
         self.assert_contacts_equal(
             contacts + [last_contact], expected_contacts)
 
+    def test_group_contacts_streamed_multiple_pages(self):
+        self.make_existing_group({
+            u'name': 'key',
+        })
+        expected_contacts = self.make_n_contacts(
+            self.MAX_CONTACTS_PER_PAGE + 1, groups=["key"])
+
+        client = self.make_client()
+        contacts = list(client.group_contacts("key", stream=True))
+        self.assert_contacts_equal(contacts, expected_contacts)
+
+    def test_group_contacts_fields(self):
+        self.make_existing_group({
+            u'name': 'key',
+        })
+        expected_contacts = self.make_n_contacts(
+            self.MAX_CONTACTS_PER_PAGE + 1, groups=["key"])
+
+        client = self.make_client()
+        contacts = list(client.group_contacts("key", fields=["msisdn"]))
+        self.assert_contacts_equal(contacts, [
+            {u"msisdn": contact[u"msisdn"]} for contact in expected_contacts])
+
+    def test_group_contacts_page_size(self):
+        self.make_existing_group({
+            u'name': 'key',
+        })
+        expected_contacts = self.make_n_contacts(5, groups=["key"])
+
+        client = self.make_client()
+        contacts = list(client.group_contacts("key", page_size=2))
+        self.assert_contacts_equal(contacts, expected_contacts)
+        self.assertEqual(client.pagination_stats.pages, 3)
+
     def test_group_contacts_none_found(self):
         self.make_existing_group({
             u'name': 'key',
@@ -551,3 +792,87 @@ class TestContactsApiClient(TestCase):
         client = self.make_client()
         contacts = list(client.group_contacts("key"))
         self.assert_contacts_equal(contacts, [])
+
+
+class TestAdaptivePageSize(TestCase):
+
+    def test_grows_towards_target(self):
+        page_size = AdaptivePageSize(target_time=1.0, initial_size=100)
+        page_size.record(100, 10000, 0.8)
+        self.assertEqual(page_size.size, 125)
+
+    def test_shrinks_towards_target(self):
+        page_size = AdaptivePageSize(target_time=1.0, initial_size=100)
+        page_size.record(100, 10000, 1.6)
+        self.assertEqual(page_size.size, 62)
+
+    def test_change_limited(self):
+        page_size = AdaptivePageSize(target_time=1.0, initial_size=100)
+        page_size.record(100, 10000, 0.01)
+        self.assertEqual(page_size.size, 200)
+        page_size.record(100, 10000, 100)
+        self.assertEqual(page_size.size, 100)
+
+    def test_limits(self):
+        page_size = AdaptivePageSize(
+            initial_size=100, min_size=80, max_size=150)
+        page_size.record(100, 10000, 0.01)
+        self.assertEqual(page_size.size, 150)
+        page_size.record(100, 10000, 100)
+        self.assertEqual(page_size.size, 80)
+
+    def test_max_bytes(self):
+        page_size = AdaptivePageSize(initial_size=100, max_bytes=5000)
+        page_size.record(100, 10000, 0.01)
+        self.assertEqual(page_size.size, 50)
+
+    def test_partial_page(self):
+        page_size = AdaptivePageSize(target_time=1.0, initial_size=100)
+        page_size.record(10, 1000, 0.05)
+        self.assertEqual(page_size.size, 200)
+        page_size.record(0, 0, 0.05)
+        self.assertEqual(page_size.size, 200)
+
+
+class TestIterJsonObject(TestCase):
+
+    def chunked(self, data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def assert_items(self, data, expected, sizes=(1, 2, 3, 7, 1024)):
+        for size in sizes:
+            items = list(_iter_json_object(self.chunked(data, size), 'data'))
+            self.assertEqual(items, expected)
+
+    def test_page(self):
+        data = json.dumps({
+            u"cursor": u"abc",
+            u"data": [{u"key": u"k%d" % i, u"n": i * 1001} for i in range(3)],
+        }, sort_keys=True)
+        self.assert_items(data, [
+            (u"cursor", u"abc"),
+            (u"data", {u"key": u"k0", u"n": 0}),
+            (u"data", {u"key": u"k1", u"n": 1001}),
+            (u"data", {u"key": u"k2", u"n": 2002}),
+        ])
+
+    def test_cursor_after_data(self):
+        data = b'{"data": [1, 22, 333], "cursor": null}'
+        self.assert_items(data, [
+            (u"data", 1), (u"data", 22), (u"data", 333), (u"cursor", None),
+        ])
+
+    def test_empty(self):
+        self.assert_items(b' { } ', [])
+        self.assert_items(b'{"data": [ ], "cursor": 12}', [(u"cursor", 12)])
+
+    def test_unicode_split_across_chunks(self):
+        data = json.dumps(
+            {u"data": [u"caf\xe9"]}, ensure_ascii=False).encode('utf-8')
+        self.assert_items(data, [(u"data", u"caf\xe9")])
+
+    def test_truncated(self):
+        self.assertRaises(
+            ValueError, list, _iter_json_object([b'{"data": [1, 2'], 'data'))
+        self.assertRaises(
+            ValueError, list, _iter_json_object([b'[1, 2]'], 'data'))
@@ -0,0 +1,138 @@
+"""
+Tests for go_http.contactsync.
+"""
+
+from unittest import TestCase
+
+from requests_testadapter import TestSession
+
+from fake_go_contacts import FakeContactsApi
+
+from go_http.contacts import ContactsApiClient
+from go_http.contactsync import SyncPlan, plan_sync
+from go_http.tests.test_contacts import (
+    FakeContactsApiAdapter, make_contact_dict)
+
+
+class TestContactSync(TestCase):
+    API_URL = "http://example.com/go"
+    AUTH_TOKEN = "auth_token"
+
+    def setUp(self):
+        self.contacts_data = {}
+        self.contacts_backend = FakeContactsApi(
+            "go/", self.AUTH_TOKEN, self.contacts_data, {},
+            contacts_limit=3)
+        self.session = TestSession()
+        self.session.mount(
+            self.API_URL, FakeContactsApiAdapter(self.contacts_backend))
+        self.client = ContactsApiClient(
+            self.AUTH_TOKEN, api_url=self.API_URL, session=self.session)
+
+    def make_existing_contact(self, contact_data):
+        contact = make_contact_dict(contact_data)
+        self.contacts_data[contact[u"key"]] = contact
+        return contact
+
+    def contacts_by_msisdn(self):
+        return dict(
+            (contact[u"msisdn"], contact)
+            for contact in self.contacts_data.values())
+
+    def test_plan_by_msisdn(self):
+        unchanged = self.make_existing_contact(
+            {u"msisdn": u"+1", u"name": u"Arthur"})
+        changed = self.make_existing_contact(
+            {u"msisdn": u"+2", u"name": u"Lance", u"surname": u"Lot"})
+        missing = self.make_existing_contact({u"msisdn": u"+3"})
+
+        plan = plan_sync(self.client, [
+            {u"msisdn": u"+1", u"name": u"Arthur"},
+            {u"msisdn": u"+2", u"name": u"Lancelot", u"surname": u"Lot"},
+            {u"msisdn": u"+4", u"name": u"Gawain"},
+        ], match_on=u"msisdn", delete_missing=True)
+
+        self.assertEqual(
+            plan.creates, [{u"msisdn": u"+4", u"name": u"Gawain"}])
+        self.assertEqual(
+            plan.updates, [(changed[u"key"], {u"name": u"Lancelot"})])
+        self.assertEqual(plan.deletes, [missing[u"key"]])
+        self.assertTrue(unchanged[u"key"] not in plan.deletes)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(
+            repr(plan),
+            "<SyncPlan creates=1 updates=1 deletes=1 conflicts=0>")
+
+    def test_plan_duplicate_matches_not_deleted(self):
+        first = self.make_existing_contact(
+            {u"msisdn": u"+1", u"name": u"Arthur"})
+        second = self.make_existing_contact(
+            {u"msisdn": u"+1", u"name": u"Art"})
+        missing = self.make_existing_contact({u"msisdn": u"+2"})
+
+        plan = plan_sync(self.client, [
+            {u"msisdn": u"+1", u"name": u"Arthur"},
+        ], match_on=u"msisdn", delete_missing=True)
+
+        self.assertEqual(plan.deletes, [missing[u"key"]])
+        self.assertEqual(len(plan.conflicts), 1)
+        self.assertTrue(
+            plan.conflicts[0] in (first[u"key"], second[u"key"]))
+        self.assertEqual(len(plan), 1 + len(plan.updates))
+
+    def test_plan_by_key(self):
+        existing = self.make_existing_contact(
+            {u"msisdn": u"+1", u"extra": {u"quest": u"Grail"}})
+        other = self.make_existing_contact({u"msisdn": u"+2"})
+
+        plan = plan_sync(self.client, [
+            {u"key": existing[u"key"], u"extra": {u"quest": u"lunch"}},
+            {u"key": u"gone", u"msisdn": u"+5"},
+            {u"msisdn": u"+6"},
+        ])
+
+        self.assertEqual(
+            sorted(plan.creates), [{u"msisdn": u"+5"}, {u"msisdn": u"+6"}])
+        self.assertEqual(plan.updates, [
+            (existing[u"key"], {u"extra": {u"quest": u"lunch"}})])
+        self.assertEqual(plan.deletes, [])
+        self.assertTrue(other[u"key"] in self.contacts_data)
+
+    def test_plan_ignore_fields(self):
+        self.make_existing_contact({u"msisdn": u"+1", u"name": u"Arthur"})
+        plan = plan_sync(
+            self.client, [{u"msisdn": u"+1", u"name": u"Bob"}],
+            match_on=u"msisdn", ignore_fields=[u"name"])
+        self.assertEqual(len(plan), 0)
+
+    def test_apply(self):
+        self.make_existing_contact({u"msisdn": u"+1", u"name": u"Arthur"})
+        self.make_existing_contact({u"msisdn": u"+2", u"name": u"Lance"})
+        self.make_existing_contact({u"msisdn": u"+3"})
+        desired = [
+            {u"msisdn": u"+1", u"name": u"Arthur"},
+            {u"msisdn": u"+2", u"name": u"Lancelot"},
+            {u"msisdn": u"+4", u"name": u"Gawain"},
+        ]
+
+        plan = plan_sync(
+            self.client, desired, match_on=u"msisdn", delete_missing=True)
+        self.assertEqual(plan.apply(self.client, concurrency=2), [])
+
+        contacts = self.contacts_by_msisdn()
+        self.assertEqual(sorted(contacts), [u"+1", u"+2", u"+4"])
+        for contact in desired:
+            self.assertEqual(
+                contacts[contact[u"msisdn"]][u"name"], contact[u"name"])
+        self.assertEqual(
+            len(plan_sync(self.client, desired, match_on=u"msisdn")), 0)
+
+    def test_apply_failures(self):
+        plan = SyncPlan(
+            updates=[(u"missing", {u"name": u"Bob"})], deletes=[u"gone"])
+        failures = plan.apply(self.client)
+        self.assertEqual(
+            sorted((action, target) for action, target, _ in failures),
+            [("delete", u"gone"), ("update", (u"missing", {u"name": u"Bob"}))])
+        for _, _, error in failures:
+            self.assertEqual(error.response.status_code, 404)
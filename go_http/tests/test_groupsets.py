@@ -0,0 +1,210 @@
+"""
+Tests for go_http.groupsets.
+"""
+
+from unittest import TestCase
+
+from requests_testadapter import TestAdapter, TestSession
+
+from fake_go_contacts import FakeContactsApi
+
+from go_http.contacts import ContactsApiClient
+from go_http.exceptions import PagedException
+from go_http.groupsets import ContactKeySet, export_groups
+from go_http.tests.test_contacts import (
+    FakeContactsApiAdapter, make_contact_dict, make_group_dict)
+
+
+class TestContactKeySet(TestCase):
+
+    def test_keys_sorted_and_unique(self):
+        key_set = ContactKeySet([u"c", u"a", u"b", u"a"])
+        self.assertEqual(list(key_set), [u"a", u"b", u"c"])
+        self.assertEqual(len(key_set), 3)
+
+    def test_iterated_keys_are_text(self):
+        key_set = ContactKeySet([b"a", u"b"])
+        self.assertEqual(
+            [type(key) for key in key_set], [type(u"")] * 2)
+
+    def test_contains(self):
+        key_set = ContactKeySet([u"a", u"c"])
+        self.assertTrue(u"a" in key_set)
+        self.assertTrue(b"c" in key_set)
+        self.assertFalse(u"b" in key_set)
+        self.assertFalse(u"d" in key_set)
+
+    def test_equality(self):
+        self.assertEqual(
+            ContactKeySet([u"a", u"b"]), ContactKeySet([u"b", u"a"]))
+        self.assertNotEqual(ContactKeySet([u"a"]), ContactKeySet([u"b"]))
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(ContactKeySet([u"a", u"b"])), "<ContactKeySet size=2>")
+
+    def test_union(self):
+        a = ContactKeySet([u"a", u"b", u"d"])
+        b = ContactKeySet([u"b", u"c", u"e"])
+        self.assertEqual(
+            list(a.union(b)), [u"a", u"b", u"c", u"d", u"e"])
+        self.assertEqual(a | b, a.union(b))
+
+    def test_intersection(self):
+        a = ContactKeySet([u"a", u"b", u"d", u"e"])
+        b = ContactKeySet([u"b", u"c", u"e"])
+        self.assertEqual(list(a.intersection(b)), [u"b", u"e"])
+        self.assertEqual(a & b, a.intersection(b))
+
+    def test_difference(self):
+        a = ContactKeySet([u"a", u"b", u"d", u"e"])
+        b = ContactKeySet([u"b", u"c", u"e"])
+        self.assertEqual(list(a.difference(b)), [u"a", u"d"])
+        self.assertEqual(a - b, a.difference(b))
+
+    def test_different_key_widths(self):
+        a = ContactKeySet([u"a", u"abc", u"b"])
+        b = ContactKeySet([u"ab", u"abc", u"c", u"\u00e9"])
+        self.assertEqual(
+            list(a | b), [u"a", u"ab", u"abc", u"b", u"c", u"\u00e9"])
+        self.assertEqual(list(a & b), [u"abc"])
+        self.assertEqual(list(a - b), [u"a", u"b"])
+        self.assertEqual(list(b - a), [u"ab", u"c", u"\u00e9"])
+        self.assertTrue(u"abc" in a | b)
+        self.assertFalse(u"abcd" in a | b)
+        self.assertEqual(a & b, ContactKeySet([u"abc"]))
+
+    def test_empty(self):
+        empty = ContactKeySet()
+        a = ContactKeySet([u"a"])
+        self.assertEqual(len(empty), 0)
+        self.assertFalse(u"a" in empty)
+        self.assertEqual(empty | a, a)
+        self.assertEqual(empty & a, empty)
+        self.assertEqual(a - empty, a)
+
+    def test_keys_packed(self):
+        key_set = ContactKeySet([u"%032x" % i for i in range(1000)])
+        self.assertEqual(len(key_set._data), 32 * 1000)
+
+    def test_from_contacts(self):
+        key_set = ContactKeySet.from_contacts([
+            {u"key": u"b", u"msisdn": u"+1"},
+            {u"key": u"a", u"msisdn": u"+2"},
+        ])
+        self.assertEqual(list(key_set), [u"a", u"b"])
+
+    def test_from_group_fetches_keys_only(self):
+        calls = []
+
+        class Client(object):
+            def group_contacts(self, group_key, **kw):
+                calls.append((group_key, kw))
+                return iter([{u"key": u"b"}, {u"key": u"a"}])
+
+        key_set = ContactKeySet.from_group(Client(), u"group-1")
+        self.assertEqual(list(key_set), [u"a", u"b"])
+        self.assertEqual(calls, [(u"group-1", {"fields": [u"key"]})])
+
+
+class FakeGroupsTestCase(TestCase):
+    API_URL = "http://example.com/go"
+    AUTH_TOKEN = "auth_token"
+
+    def setUp(self):
+        self.contacts_data = {}
+        self.groups_data = {}
+        self.contacts_backend = FakeContactsApi(
+            "go/", self.AUTH_TOKEN, self.contacts_data, self.groups_data,
+            contacts_limit=3)
+        self.session = TestSession()
+        self.session.mount(
+            self.API_URL, FakeContactsApiAdapter(self.contacts_backend))
+        self.client = ContactsApiClient(
+            self.AUTH_TOKEN, api_url=self.API_URL, session=self.session)
+
+    def make_existing_group(self, name):
+        group = make_group_dict({u"name": name})
+        self.groups_data[group[u"key"]] = group
+        return group[u"key"]
+
+    def make_existing_contact(self, msisdn, groups):
+        contact = make_contact_dict({u"msisdn": msisdn, u"groups": groups})
+        self.contacts_data[contact[u"key"]] = contact
+        return contact
+
+
+class TestContactKeySetWithApi(FakeGroupsTestCase):
+
+    def test_group_algebra(self):
+        group_a = self.make_existing_group(u"A")
+        group_b = self.make_existing_group(u"B")
+        group_c = self.make_existing_group(u"C")
+        in_ab = [
+            self.make_existing_contact(u"+1%d" % i, [group_a, group_b])
+            for i in range(4)]
+        in_abc = self.make_existing_contact(
+            u"+20", [group_a, group_b, group_c])
+        self.make_existing_contact(u"+30", [group_a])
+        self.make_existing_contact(u"+40", [group_b, group_c])
+
+        a = ContactKeySet.from_group(self.client, group_a)
+        b = ContactKeySet.from_group(self.client, group_b)
+        c = ContactKeySet.from_group(self.client, group_c)
+        self.assertEqual(len(a), 6)
+
+        result = (a & b) - c
+        self.assertEqual(
+            sorted(result), sorted(contact[u"key"] for contact in in_ab))
+        self.assertTrue(in_abc[u"key"] not in result)
+
+        contacts = list(result.contacts(self.client))
+        self.assertEqual(
+            contacts, sorted(in_ab, key=lambda contact: contact[u"key"]))
+
+
+class TestExportGroups(FakeGroupsTestCase):
+
+    def test_export_groups(self):
+        group_a = self.make_existing_group(u"A")
+        group_b = self.make_existing_group(u"B")
+        group_c = self.make_existing_group(u"C")
+        only_a = [self.make_existing_contact(u"+1%d" % i, [group_a])
+                  for i in range(4)]
+        in_ab = [self.make_existing_contact(u"+2%d" % i, [group_a, group_b])
+                 for i in range(4)]
+        in_bc = self.make_existing_contact(u"+30", [group_b, group_c])
+
+        results = list(export_groups(
+            self.client, [group_a, group_b], concurrency=2, buffer_size=2))
+        tags = dict((contact[u"key"], groups) for contact, groups in results)
+        self.assertEqual(len(results), len(tags))
+
+        expected = {}
+        for contact in only_a:
+            expected[contact[u"key"]] = [group_a]
+        for contact in in_ab:
+            expected[contact[u"key"]] = sorted([group_a, group_b])
+        expected[in_bc[u"key"]] = [group_b]
+        self.assertEqual(tags, expected)
+
+    def test_export_no_groups(self):
+        self.assertEqual(list(export_groups(self.client, [])), [])
+
+    def test_export_failure(self):
+        group_a = self.make_existing_group(u"A")
+        for i in range(4):
+            self.make_existing_contact(u"+1%d" % i, [group_a])
+        self.session.mount(
+            self.API_URL + "/groups/%s/contacts?cursor=" % (group_a,),
+            TestAdapter("API is down", 500))
+        self.assertRaises(
+            PagedException, list, export_groups(self.client, [group_a]))
+
+    def test_export_stopped_early(self):
+        group_a = self.make_existing_group(u"A")
+        for i in range(8):
+            self.make_existing_contact(u"+1%d" % i, [group_a])
+        results = export_groups(self.client, [group_a], buffer_size=1)
+        next(results)
+        results.close()
@@ -2,13 +2,23 @@
 Tests for go_http.metrics.
 """
 
-import urlparse
 import json
-from unittest import TestCase
+import threading
+from unittest import TestCase, skipIf
 
-from requests_testadapter import TestAdapter, TestSession
+try:
+    import urlparse
+except ImportError:  # Python 3
+    import urllib.parse as urlparse
 
-from go_http.metrics import MetricsApiClient
+from requests import HTTPError
+from requests_testadapter import Resp, TestAdapter, TestSession
+
+from go_http.cache import TTLCache
+from go_http.metrics import (
+    AsyncMetricsFlusher, IncrementalMetricFetcher, MetricsAggregator,
+    MetricsApiClient, MetricsFlusher, asyncio, parse_interval)
+from go_http.tests.helpers import FakeClock
 
 
 class RecordingAdapter(TestAdapter):
@@ -17,11 +27,43 @@ class RecordingAdapter(TestAdapter):
     """
     request = None
 
+    def __init__(self, *args, **kw):
+        super(RecordingAdapter, self).__init__(*args, **kw)
+        self.requests = []
+
     def send(self, request, *args, **kw):
         self.request = request
+        self.requests.append(request)
         return super(RecordingAdapter, self).send(request, *args, **kw)
 
 
+class FakeMetricsAdapter(RecordingAdapter):
+
+    """ Return an empty series for each metric requested, or an error for
+    metrics listed in ``failing``.
+    """
+
+    def __init__(self, failing=()):
+        super(FakeMetricsAdapter, self).__init__(b"")
+        self.failing = failing
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def send(self, request, *args, **kw):
+        qs = dict(urlparse.parse_qsl(urlparse.urlparse(request.url).query))
+        metric = qs["m"]
+        with self._lock:
+            self.metrics.append(metric)
+            self.requests.append(request)
+        if metric in self.failing:
+            resp = Resp(b"", 500, {})
+        else:
+            resp = Resp(json.dumps({metric: []}).encode("utf-8"), 200, {})
+        response = self.build_response(request, resp)
+        response.content
+        return response
+
+
 class TestMetricApiClient(TestCase):
 
     def setUp(self):
@@ -86,6 +128,72 @@ class TestMetricApiClient(TestCase):
                 "from": "-30d", "nulls": "omit"},
             headers={"Authorization": u'Bearer auth-token'})
 
+    def make_cached_client(self, clock):
+        client = MetricsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session, clock=clock,
+            query_cache=TTLCache(ttl=60, clock=clock))
+        adapter = RecordingAdapter(json.dumps({u"a.sum": []}))
+        self.session.mount("http://example.com/api/v1/go/metrics/", adapter)
+        return client, adapter
+
+    def test_get_metric_cached_for_interval(self):
+        clock = FakeClock()
+        client, adapter = self.make_cached_client(clock)
+        result = client.get_metric("a.sum", "-1d", "1h", "omit")
+        self.assertEqual(result, {u"a.sum": []})
+        result[u"a.sum"].append(u"mutated")
+        self.assertEqual(
+            client.get_metric("a.sum", "-1d", "1h", "omit"), {u"a.sum": []})
+        self.assertEqual(len(adapter.requests), 1)
+        client.get_metric("a.sum", "-1d", "1h", "zeroize")
+        self.assertEqual(len(adapter.requests), 2)
+        clock.now += 3600
+        client.get_metric("a.sum", "-1d", "1h", "omit")
+        self.assertEqual(len(adapter.requests), 3)
+
+    def test_get_metric_cached_forever_for_closed_range(self):
+        clock = FakeClock()
+        clock.now = 100000.0
+        client, adapter = self.make_cached_client(clock)
+        client.get_metric("a.sum", "10000", "1h", "omit", end="90000")
+        client.get_metric("a.sum", "10000", "1h", "omit", end="99000")
+        clock.now += 10 ** 9
+        client.get_metric("a.sum", "10000", "1h", "omit", end="90000")
+        self.assertEqual(len(adapter.requests), 2)
+        client.get_metric("a.sum", "10000", "1h", "omit", end="99000")
+        self.assertEqual(len(adapter.requests), 3)
+        client.get_metric("a.sum", 10000, "1h", "omit", end=u"90000")
+        self.assertEqual(len(adapter.requests), 4)
+        client.get_metric("a.sum", 10000, "1h", "omit", end=u"90000")
+        self.assertEqual(len(adapter.requests), 4)
+
+    def test_get_metric_unknown_interval_not_cached(self):
+        client, adapter = self.make_cached_client(FakeClock())
+        client.get_metric("a.sum", "-1d", "fortnightly", "omit")
+        client.get_metric("a.sum", "-1d", "fortnightly", "omit")
+        self.assertEqual(len(adapter.requests), 2)
+
+    def test_get_metrics(self):
+        adapter = FakeMetricsAdapter(failing=["broken.sum"])
+        self.session.mount("http://example.com/api/v1/go/metrics/", adapter)
+        results = self.client.get_metrics(
+            ["a.sum", "b.avg", "broken.sum", "a.sum"], "-1d", "1h", "omit",
+            concurrency=2)
+        self.assertEqual(
+            sorted(results), ["a.sum", "b.avg", "broken.sum"])
+        self.assertEqual(results["a.sum"], {u"a.sum": []})
+        self.assertEqual(results["b.avg"], {u"b.avg": []})
+        self.assertEqual(
+            results["broken.sum"].response.status_code, 500)
+        self.assertEqual(sorted(adapter.metrics), [
+            "a.sum", "b.avg", "broken.sum"])
+        for request in adapter.requests:
+            qs = dict(urlparse.parse_qsl(urlparse.urlparse(request.url).query))
+            self.assertEqual(qs["from"], "-1d")
+            self.assertEqual(qs["interval"], "1h")
+
     def test_fire(self):
         response = [{
             'name': 'foo.last',
@@ -105,3 +213,425 @@ class TestMetricApiClient(TestCase):
             adapter.request, 'POST',
             data={"foo.last": 3.1415},
             headers={"Authorization": u'Bearer auth-token'})
+
+
+class TestParseInterval(TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_interval("30s"), 30)
+        self.assertEqual(parse_interval("5m"), 300)
+        self.assertEqual(parse_interval("5min"), 300)
+        self.assertEqual(parse_interval("1h"), 3600)
+        self.assertEqual(parse_interval("1d"), 86400)
+        self.assertEqual(parse_interval("2w"), 1209600)
+        self.assertEqual(parse_interval("1.5h"), 5400)
+
+    def test_invalid(self):
+        for interval in ("", "d", "1y", "-1d", "1 fortnight"):
+            self.assertRaises(ValueError, parse_interval, interval)
+
+
+class RecordingMetricsClient(object):
+    """ Record the metrics fired.
+    """
+
+    def __init__(self):
+        self.fired = []
+        self.error = None
+
+    def fire(self, metrics):
+        if self.error is not None:
+            raise self.error
+        self.fired.append(metrics)
+        return {"success": True}
+
+
+class FakeSeriesAdapter(RecordingAdapter):
+
+    """ Serve hourly buckets whose value is the bucket's hour number, from the
+    requested start up to the requested end (inclusive) or the current time
+    on ``clock``.
+
+    Buckets for the hours in ``null_hours`` are null. The start is rounded
+    down to a whole hour, or up if ``round_up`` is set.
+    """
+
+    def __init__(self, clock, null_hours=(), round_up=False):
+        super(FakeSeriesAdapter, self).__init__(b"")
+        self.clock = clock
+        self.null_hours = set(null_hours)
+        self.round_up = round_up
+
+    def point(self, t, nulls):
+        hour = t // 3600
+        if hour not in self.null_hours:
+            return {u"x": t * 1000, u"y": float(hour)}
+        if nulls == "omit":
+            return None
+        return {u"x": t * 1000, u"y": 0.0 if nulls == "zeroize" else None}
+
+    def send(self, request, *args, **kw):
+        self.request = request
+        self.requests.append(request)
+        qs = dict(urlparse.parse_qsl(urlparse.urlparse(request.url).query))
+        start = qs["from"]
+        if start.startswith("-"):
+            start = self.clock() - parse_interval(start[1:])
+        start = float(start)
+        if self.round_up:
+            start += 3599
+        start = int(start) // 3600 * 3600
+        end = int(float(qs.get("until", self.clock())))
+        points = [
+            self.point(t, qs.get("nulls"))
+            for t in range(start, end + 1, 3600)]
+        points = [point for point in points if point is not None]
+        resp = Resp(json.dumps({qs["m"]: points}).encode("utf-8"), 200, {})
+        response = self.build_response(request, resp)
+        response.content
+        return response
+
+
+class TestIncrementalMetricFetcher(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 100 * 3600 + 1800.0
+        self.session = TestSession()
+        self.adapter = FakeSeriesAdapter(self.clock)
+        self.session.mount(
+            "http://example.com/api/v1/go/metrics/", self.adapter)
+        self.client = MetricsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session)
+        self.fetcher = IncrementalMetricFetcher(self.client, clock=self.clock)
+
+    def hours(self, result, metric="a.sum"):
+        return [int(point[u"y"]) for point in result[metric]]
+
+    def last_request_params(self):
+        url = urlparse.urlparse(self.adapter.request.url)
+        return dict(urlparse.parse_qsl(url.query))
+
+    def test_first_poll_fetches_whole_range(self):
+        result = self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(self.hours(result), list(range(90, 101)))
+        self.assertEqual(self.last_request_params()["from"], "-10h")
+        self.assertEqual(self.fetcher.full_fetches, 1)
+        self.assertEqual(len(self.fetcher), 1)
+
+    def test_later_polls_fetch_new_buckets(self):
+        self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.clock.now += 3 * 3600
+        result = self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(
+            self.last_request_params()["from"], str(100 * 3600))
+        self.assertEqual(self.hours(result), list(range(93, 104)))
+        self.assertEqual(
+            result, self.client.get_metric("a.sum", "-10h", "1h", "omit"))
+        self.assertEqual(self.fetcher.full_fetches, 1)
+        self.assertEqual(self.fetcher.incremental_fetches, 1)
+
+    def test_results_are_copies(self):
+        result = self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        result["a.sum"].append(u"mutated")
+        result = self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertTrue(u"mutated" not in result["a.sum"])
+
+    def test_absolute_start_not_trimmed(self):
+        self.fetcher.get_metric("a.sum", str(95 * 3600), "1h", "omit")
+        self.clock.now += 2 * 3600
+        result = self.fetcher.get_metric(
+            "a.sum", str(95 * 3600), "1h", "omit")
+        self.assertEqual(self.hours(result), list(range(95, 103)))
+
+    def test_forget(self):
+        self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.fetcher.forget("a.sum", "-10h", "1h", "omit")
+        self.fetcher.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(self.fetcher.full_fetches, 2)
+        self.fetcher.clear()
+        self.assertEqual(len(self.fetcher), 0)
+
+
+class TestChunkedMetricFetch(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 100 * 3600 + 1800.0
+        self.session = TestSession()
+        self.adapter = FakeSeriesAdapter(self.clock)
+        self.session.mount(
+            "http://example.com/api/v1/go/metrics/", self.adapter)
+        self.client = MetricsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session, clock=self.clock)
+
+    def hours(self, result, metric="a.sum"):
+        return [int(point[u"y"]) for point in result[metric]]
+
+    def requested_ranges(self):
+        ranges = []
+        for request in self.adapter.requests:
+            url = urlparse.urlparse(request.url)
+            qs = dict(urlparse.parse_qsl(url.query))
+            ranges.append((int(qs["from"]) // 3600, int(qs["until"]) // 3600))
+        return sorted(ranges)
+
+    def test_relative_range(self):
+        result = self.client.get_metric_chunked(
+            "a.sum", "-20h", "1h", "omit", chunk_buckets=6, concurrency=2)
+        self.assertEqual(self.hours(result), list(range(80, 101)))
+        self.assertEqual(self.requested_ranges(), [
+            (80, 86), (86, 92), (92, 98), (98, 100)])
+
+    def test_absolute_range(self):
+        result = self.client.get_metric_chunked(
+            "a.sum", str(10 * 3600 + 60), "1h", "omit",
+            end=str(20 * 3600), chunk_buckets=5)
+        self.assertEqual(self.hours(result), list(range(10, 21)))
+        self.assertEqual(self.requested_ranges(), [(10, 15), (15, 20)])
+
+    def test_matches_single_request(self):
+        chunked = self.client.get_metric_chunked(
+            "a.sum", "-30h", "1h", "omit", chunk_buckets=7)
+        single = self.client.get_metric("a.sum", "-30h", "1h", "omit")
+        self.assertEqual(chunked, single)
+
+    def test_invalid(self):
+        self.assertRaises(
+            ValueError, self.client.get_metric_chunked,
+            "a.sum", "-30h", "1h", "omit", chunk_buckets=0)
+        self.assertRaises(
+            ValueError, self.client.get_metric_chunked,
+            "a.sum", "yesterday", "1h", "omit")
+
+    def test_error(self):
+        self.session.mount(
+            "http://example.com/api/v1/go/metrics/",
+            FakeMetricsAdapter(failing=["a.sum"]))
+        self.assertRaises(
+            HTTPError, self.client.get_metric_chunked,
+            "a.sum", "-30h", "1h", "omit", chunk_buckets=7)
+
+
+class TestMetricsAggregator(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = RecordingMetricsClient()
+        self.aggregator = MetricsAggregator(
+            self.client, interval=10, clock=self.clock)
+
+    def test_combines_by_aggregator(self):
+        self.aggregator.add({
+            "a.sum": 1, "b.avg": 1, "c.max": 1, "d.min": 1, "e.last": 1})
+        self.aggregator.add({
+            "a.sum": 2, "b.avg": 2, "c.max": 5, "d.min": 5, "e.last": 5})
+        self.aggregator.fire({
+            "a.sum": 3, "b.avg": 6, "c.max": 3, "d.min": 0, "e.last": 2})
+        self.assertEqual(len(self.aggregator), 5)
+        self.assertEqual(self.aggregator.flush(), {"success": True})
+        self.assertEqual(self.client.fired, [{
+            "a.sum": 6.0, "b.avg": 3.0, "c.max": 5.0, "d.min": 0.0,
+            "e.last": 2.0,
+        }])
+        self.assertEqual(len(self.aggregator), 0)
+
+    def test_invalid_values_not_added(self):
+        self.aggregator.add({"a.sum": 1})
+        self.assertRaises(
+            ValueError, self.aggregator.add, {"a.sum": 1, "b.bogus": 1})
+        self.assertRaises(
+            ValueError, self.aggregator.add, {"a.sum": 1, "b.sum": "x"})
+        self.assertEqual(len(self.aggregator), 1)
+        self.aggregator.flush()
+        self.assertEqual(self.client.fired, [{"a.sum": 1.0}])
+
+    def test_flush_interval(self):
+        self.aggregator.add({"a.sum": 1})
+        self.clock.now += 9
+        self.aggregator.add({"a.sum": 1})
+        self.assertEqual(self.client.fired, [])
+        self.clock.now += 1
+        self.aggregator.add({"a.sum": 1})
+        self.assertEqual(self.client.fired, [{"a.sum": 3.0}])
+        self.aggregator.add({"a.sum": 1})
+        self.assertEqual(len(self.client.fired), 1)
+
+    def test_flush_empty(self):
+        self.assertEqual(self.aggregator.flush(), None)
+        self.assertEqual(self.client.fired, [])
+
+    def test_flush_failure_keeps_values(self):
+        self.aggregator.add({"a.sum": 1, "b.avg": 2, "c.last": 1})
+        self.client.error = ValueError("boom")
+        self.assertRaises(ValueError, self.aggregator.flush)
+        self.client.error = None
+        self.aggregator.add({"a.sum": 1, "b.avg": 4, "c.last": 7})
+        self.aggregator.flush()
+        self.assertEqual(
+            self.client.fired, [{"a.sum": 2.0, "b.avg": 3.0, "c.last": 7.0}])
+
+    def test_invalid_aggregator(self):
+        self.assertRaises(ValueError, self.aggregator.add, {"foo.bar": 1})
+        self.assertRaises(ValueError, self.aggregator.add, {"foo": 1})
+        self.assertEqual(len(self.aggregator), 0)
+
+
+class TestMetricsFlusher(TestCase):
+
+    def setUp(self):
+        self.client = RecordingMetricsClient()
+
+    def make_flusher(self, **kw):
+        kw.setdefault("interval", 3600)
+        flusher = MetricsFlusher(self.client, **kw)
+        self.addCleanup(flusher.stop)
+        return flusher
+
+    def test_invalid_overflow(self):
+        self.assertRaises(
+            ValueError, MetricsFlusher, self.client, overflow="explode")
+
+    def test_flush(self):
+        flusher = self.make_flusher()
+        flusher.fire({"a.sum": 1, "b.last": 1})
+        flusher.fire({"a.sum": 2, "b.last": 3})
+        self.assertEqual(len(flusher), 4)
+        self.assertEqual(self.client.fired, [])
+        flusher.flush()
+        self.assertEqual(self.client.fired, [{"a.sum": 3.0, "b.last": 3.0}])
+        stats = flusher.stats()
+        self.assertEqual(stats["buffered"], 0)
+        self.assertEqual(stats["flushes"], 1)
+        self.assertEqual(stats["flushed"], 2)
+        self.assertTrue(stats["last_flush_latency"] >= 0)
+
+    def test_invalid_metric(self):
+        flusher = self.make_flusher()
+        self.assertRaises(ValueError, flusher.fire, {"a": 1})
+        self.assertEqual(len(flusher), 0)
+
+    def test_drop_oldest(self):
+        flusher = self.make_flusher(max_size=2)
+        flusher.fire({"a.last": 1})
+        flusher.fire({"b.last": 1})
+        flusher.fire({"c.last": 1})
+        flusher.flush()
+        self.assertEqual(self.client.fired, [{"b.last": 1.0, "c.last": 1.0}])
+        self.assertEqual(flusher.stats()["dropped"], 1)
+
+    def test_drop_newest(self):
+        flusher = self.make_flusher(max_size=2, overflow="drop_newest")
+        flusher.fire({"a.last": 1})
+        flusher.fire({"b.last": 1})
+        flusher.fire({"c.last": 1})
+        flusher.flush()
+        self.assertEqual(self.client.fired, [{"a.last": 1.0, "b.last": 1.0}])
+        self.assertEqual(flusher.stats()["dropped"], 1)
+
+    def test_block(self):
+        flusher = self.make_flusher(max_size=1, overflow="block")
+        flusher.fire({"a.last": 1})
+        fired = threading.Event()
+
+        def fire():
+            flusher.fire({"b.last": 2})
+            fired.set()
+
+        thread = threading.Thread(target=fire)
+        thread.start()
+        self.assertFalse(fired.wait(0.05))
+        flusher.flush()
+        thread.join()
+        flusher.flush()
+        self.assertEqual(
+            self.client.fired, [{"a.last": 1.0}, {"b.last": 2.0}])
+        self.assertEqual(flusher.stats()["dropped"], 0)
+
+    def test_flush_failure(self):
+        flusher = self.make_flusher()
+        flusher.fire({"a.sum": 1})
+        self.client.error = ValueError("boom")
+        flusher.flush()
+        self.assertEqual(flusher.stats()["flush_errors"], 1)
+        self.client.error = None
+        flusher.fire({"a.sum": 1})
+        flusher.flush()
+        self.assertEqual(self.client.fired, [{"a.sum": 2.0}])
+
+    def test_background_flush(self):
+        flusher = self.make_flusher(interval=0.01)
+        flusher.start()
+        flusher.fire({"a.sum": 1})
+        while not self.client.fired:
+            threading.Event().wait(0.01)
+        self.assertEqual(self.client.fired, [{"a.sum": 1.0}])
+
+    def test_stop_flushes(self):
+        flusher = self.make_flusher()
+        flusher.start()
+        flusher.fire({"a.sum": 1})
+        flusher.stop()
+        self.assertEqual(self.client.fired, [{"a.sum": 1.0}])
+
+    def test_stop_without_start_flushes(self):
+        flusher = self.make_flusher()
+        flusher.fire({"a.sum": 1})
+        flusher.stop()
+        self.assertEqual(self.client.fired, [{"a.sum": 1.0}])
+
+
+@skipIf(asyncio is None, "asyncio is not available")
+class TestAsyncMetricsFlusher(TestCase):
+
+    def setUp(self):
+        self.client = RecordingMetricsClient()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def make_flusher(self, **kw):
+        kw.setdefault("interval", 3600)
+        return AsyncMetricsFlusher(self.client, loop=self.loop, **kw)
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_flush(self):
+        flusher = self.make_flusher()
+        self.wait(flusher.fire({"a.sum": 1}))
+        self.wait(flusher.fire({"a.sum": 2}))
+        self.wait(flusher.flush())
+        self.assertEqual(self.client.fired, [{"a.sum": 3.0}])
+        self.assertEqual(flusher.stats()["flushes"], 1)
+
+    def test_drop_oldest(self):
+        flusher = self.make_flusher(max_size=1)
+        flusher.fire({"a.last": 1})
+        flusher.fire({"b.last": 1})
+        self.wait(flusher.flush())
+        self.assertEqual(self.client.fired, [{"b.last": 1.0}])
+        self.assertEqual(flusher.stats()["dropped"], 1)
+
+    def test_block(self):
+        flusher = self.make_flusher(max_size=1, overflow="block")
+        first = flusher.fire({"a.last": 1})
+        second = flusher.fire({"b.last": 2})
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        self.wait(flusher.flush())
+        self.assertTrue(second.done())
+        self.wait(flusher.stop())
+        self.assertEqual(
+            self.client.fired, [{"a.last": 1.0}, {"b.last": 2.0}])
+
+    def test_periodic_flush(self):
+        flusher = self.make_flusher(interval=0.01)
+        flusher.start()
+        flusher.fire({"a.sum": 1})
+        self.wait(asyncio.sleep(0.05))
+        self.wait(flusher.stop())
+        self.assertEqual(self.client.fired, [{"a.sum": 1.0}])
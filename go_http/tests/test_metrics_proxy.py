@@ -0,0 +1,139 @@
+"""
+Tests for go_http.metrics_proxy.
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from go_http.metrics import MetricsFlusher
+from go_http.metrics_proxy import (
+    MetricsProxy, build_parser, main, parse_line)
+from go_http.tests.test_metrics import RecordingMetricsClient
+
+
+class TestParseLine(TestCase):
+
+    def test_statsd_types(self):
+        self.assertEqual(parse_line("requests:1|c"), ("requests.sum", 1.0))
+        self.assertEqual(parse_line("queue:5|g"), ("queue.last", 5.0))
+        self.assertEqual(
+            parse_line("latency:250|ms"), ("latency.avg", 250.0))
+        self.assertEqual(parse_line("size:3|h"), ("size.avg", 3.0))
+
+    def test_aggregator_types(self):
+        self.assertEqual(parse_line("peak:7|max"), ("peak.max", 7.0))
+        self.assertEqual(parse_line("low:1|min"), ("low.min", 1.0))
+
+    def test_name_with_aggregator(self):
+        self.assertEqual(
+            parse_line("requests.sum:2|c"), ("requests.sum", 2.0))
+        self.assertEqual(parse_line("queue.max:2|g"), ("queue.max", 2.0))
+
+    def test_sample_rate(self):
+        self.assertEqual(
+            parse_line("requests:1|c|@0.1"), ("requests.sum", 10.0))
+        self.assertEqual(
+            parse_line("latency:5|ms|@0.5"), ("latency.avg", 5.0))
+
+    def test_invalid(self):
+        for line in ["", "requests", ":1|c", "requests:1", "requests:x|c",
+                     "requests:1|z", "requests:1|c|0.1", "requests:1|c|@0",
+                     "requests:1|c|@2", "requests:1|c|@1|x"]:
+            self.assertRaises(ValueError, parse_line, line)
+
+
+class TestMetricsProxy(TestCase):
+
+    def setUp(self):
+        self.client = RecordingMetricsClient()
+        self.flusher = MetricsFlusher(self.client, interval=60)
+        self.proxy = MetricsProxy(self.flusher)
+
+    def serve(self):
+        thread = threading.Thread(
+            target=self.proxy.serve, kwargs={"timeout": 0.05})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.proxy.stop)
+        return thread
+
+    def wait_for(self, received, timeout=5):
+        deadline = time.time() + timeout
+        while self.proxy.received < received and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.proxy.received, received)
+
+    def test_handle_datagram(self):
+        self.proxy.handle_datagram(
+            b"requests:1|c\nrequests:2|c\n\nlatency:10|ms\nlatency:20|ms\n"
+            b"bogus\n")
+        self.flusher.flush()
+        self.assertEqual(self.client.fired, [{
+            "requests.sum": 3.0, "latency.avg": 15.0}])
+        stats = self.proxy.stats()
+        self.assertEqual(stats["received"], 1)
+        self.assertEqual(stats["metrics"], 4)
+        self.assertEqual(stats["invalid"], 1)
+        self.assertEqual(stats["flushed"], 2)
+
+    def test_serve_without_socket(self):
+        self.assertRaises(RuntimeError, self.proxy.serve)
+
+    def test_udp(self):
+        host, port = self.proxy.bind_udp("127.0.0.1", 0)
+        thread = self.serve()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sender.close)
+        sender.sendto(b"requests:1|c", (host, port))
+        sender.sendto(b"requests:4|c\nqueue:3|g", (host, port))
+        self.wait_for(2)
+        self.proxy.stop()
+        thread.join(5)
+        self.assertEqual(self.client.fired, [{
+            "requests.sum": 5.0, "queue.last": 3.0}])
+
+    @skipIf(not hasattr(socket, "AF_UNIX"), "Unix sockets not supported")
+    def test_unix(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, "metrics.sock")
+        self.assertEqual(self.proxy.bind_unix(path), path)
+        self.serve()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(sender.close)
+        sender.sendto(b"requests:1|c", path)
+        self.wait_for(1)
+        self.flusher.flush()
+        self.assertEqual(self.client.fired, [{"requests.sum": 1.0}])
+
+
+class TestMain(TestCase):
+
+    def test_parser_defaults(self):
+        args = build_parser().parse_args(["--auth-token", "token"])
+        self.assertEqual(args.udp, "127.0.0.1:8125")
+        self.assertEqual(args.unix, None)
+        self.assertEqual(args.interval, 10.0)
+        self.assertEqual(args.max_size, 10000)
+
+    def test_auth_token_required(self):
+        environ = os.environ.pop("GO_METRICS_AUTH_TOKEN", None)
+        if environ is not None:
+            self.addCleanup(
+                os.environ.__setitem__, "GO_METRICS_AUTH_TOKEN", environ)
+        parser = build_parser()
+        self.assertEqual(parser.get_default("auth_token"), None)
+        stderr = tempfile.TemporaryFile(mode="w+")
+        self.addCleanup(stderr.close)
+        old_stderr, sys.stderr = sys.stderr, stderr
+        try:
+            self.assertRaises(SystemExit, main, ["--udp", "127.0.0.1:0"])
+        finally:
+            sys.stderr = old_stderr
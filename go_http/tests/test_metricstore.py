@@ -0,0 +1,282 @@
+"""
+Tests for go_http.metricstore.
+"""
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+from requests_testadapter import TestSession
+
+from go_http.metrics import MetricsApiClient
+from go_http.metricstore import MetricStore
+from go_http.tests.helpers import FakeClock
+from go_http.tests.test_metrics import FakeSeriesAdapter
+
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+
+def points(start, step, *values):
+    return [
+        {u"x": int((start + i * step) * 1000), u"y": value}
+        for i, value in enumerate(values)]
+
+
+class TestMetricStore(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 100 * HOUR
+        self.store = MetricStore(
+            resolutions=[("1m", 120), ("1h", 48), ("1d", 10)],
+            clock=self.clock)
+
+    def test_invalid_resolutions(self):
+        self.assertRaises(
+            ValueError, MetricStore, resolutions=[("1m", 10), ("90s", 10)])
+
+    def test_add_and_query(self):
+        start = 99 * HOUR
+        self.store.add("a.sum", "1m", points(start, MINUTE, 1.0, None, 3.0))
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(
+            self.store.query("a.sum", "1m", start, start + 2 * MINUTE),
+            points(start, MINUTE, 1.0, None, 3.0))
+        self.assertEqual(
+            self.store.query(
+                "a.sum", "1m", start, start + 2 * MINUTE, nulls="omit"),
+            [points(start, MINUTE, 1.0)[0],
+             points(start + 2 * MINUTE, MINUTE, 3.0)[0]])
+        self.assertEqual(
+            self.store.query(
+                "a.sum", "1m", start, start + 2 * MINUTE, nulls="zeroize"),
+            points(start, MINUTE, 1.0, 0.0, 3.0))
+
+    def test_query_missing(self):
+        start = 99 * HOUR
+        self.store.add("a.sum", "1m", points(start, MINUTE, 1.0))
+        self.assertEqual(
+            self.store.query("a.sum", "1m", start, start + MINUTE), None)
+        self.assertEqual(
+            self.store.query("b.sum", "1m", start, start), None)
+        self.assertEqual(
+            self.store.query("a.sum", "5m", start, start), None)
+        self.assertEqual(
+            self.store.query("a.sum", "1m", start - 200 * MINUTE, start),
+            None)
+
+    def test_range_fills_nulls(self):
+        start = 99 * HOUR
+        self.store.add(
+            "a.sum", "1m", points(start + MINUTE, MINUTE, 2.0),
+            start=start, end=start + 3 * MINUTE)
+        self.assertEqual(
+            self.store.query("a.sum", "1m", start, start + 2 * MINUTE),
+            points(start, MINUTE, None, 2.0, None))
+
+    def test_range_partial_buckets_not_filled(self):
+        start = 99 * HOUR + 30
+        self.store.add(
+            "a.sum", "1m", points(99 * HOUR + MINUTE, MINUTE, 2.0),
+            start=start, end=start + 3 * MINUTE)
+        self.assertEqual(
+            self.store.query(
+                "a.sum", "1m", 99 * HOUR + MINUTE, 99 * HOUR + 2 * MINUTE),
+            points(99 * HOUR + MINUTE, MINUTE, 2.0, None))
+        for bucket in [99 * HOUR, 99 * HOUR + 3 * MINUTE]:
+            self.assertEqual(
+                self.store.query("a.sum", "1m", bucket, bucket), None)
+
+    def test_unsupported_interval_ignored(self):
+        self.store.add("a.sum", "5m", points(0, 5 * MINUTE, 1.0))
+        self.assertEqual(len(self.store), 0)
+        self.assertFalse(self.store.supports("5m"))
+        self.assertTrue(self.store.supports("1h"))
+
+    def test_partial_buckets_expire(self):
+        self.clock.now = 99 * HOUR + 30
+        self.store.add("a.sum", "1m", points(99 * HOUR, MINUTE, 1.0))
+        self.clock.now += MINUTE
+        self.assertEqual(
+            self.store.query("a.sum", "1m", 99 * HOUR, 99 * HOUR),
+            points(99 * HOUR, MINUTE, 1.0))
+        self.clock.now += 1
+        self.assertEqual(
+            self.store.query("a.sum", "1m", 99 * HOUR, 99 * HOUR), None)
+        self.assertEqual(
+            self.store.query(
+                "a.sum", "1m", 99 * HOUR, 99 * HOUR, max_age=HOUR),
+            points(99 * HOUR, MINUTE, 1.0))
+
+    def test_complete_buckets_never_expire(self):
+        self.store.add("a.sum", "1m", points(98 * HOUR, MINUTE, 1.0))
+        self.clock.now += 1000 * HOUR
+        self.assertEqual(
+            self.store.query("a.sum", "1m", 98 * HOUR, 98 * HOUR),
+            points(98 * HOUR, MINUTE, 1.0))
+
+    def test_rollups(self):
+        values = [float(i) for i in range(60)]
+        for metric in ["a.sum", "a.avg", "a.max", "a.min", "a.last"]:
+            self.store.add(metric, "1m", points(98 * HOUR, MINUTE, *values))
+        for metric, value in [("a.sum", 1770.0), ("a.avg", 29.5),
+                              ("a.max", 59.0), ("a.min", 0.0),
+                              ("a.last", 59.0)]:
+            self.assertEqual(
+                self.store.query(metric, "1h", 98 * HOUR, 98 * HOUR),
+                points(98 * HOUR, HOUR, value))
+
+    def test_incomplete_rollups_not_stored(self):
+        self.store.add("a.sum", "1m", points(98 * HOUR, MINUTE, *[1.0] * 59))
+        self.assertEqual(
+            self.store.query("a.sum", "1h", 98 * HOUR, 98 * HOUR), None)
+
+    def test_rollups_to_days(self):
+        self.store.add("a.sum", "1h", points(96 * HOUR, HOUR, *[2.0] * 24))
+        self.assertEqual(
+            self.store.query("a.sum", "1d", 96 * HOUR, 96 * HOUR),
+            points(96 * HOUR, 24 * HOUR, 48.0))
+
+    def test_direct_not_replaced_by_older_rollup(self):
+        self.store.add("a.sum", "1m", points(98 * HOUR, MINUTE, *[1.0] * 60))
+        self.clock.now += 1
+        self.store.add("a.sum", "1h", points(98 * HOUR, HOUR, 100.0))
+        self.assertEqual(
+            self.store.query("a.sum", "1h", 98 * HOUR, 98 * HOUR),
+            points(98 * HOUR, HOUR, 100.0))
+        self.clock.now += 1
+        self.store.add("a.sum", "1m", points(98 * HOUR, MINUTE, 2.0))
+        self.assertEqual(
+            self.store.query("a.sum", "1h", 98 * HOUR, 98 * HOUR),
+            points(98 * HOUR, HOUR, 100.0))
+
+    def test_persistence(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        resolutions = [("1m", 120), ("1h", 48)]
+        store = MetricStore(resolutions, path=tempdir, clock=self.clock)
+        store.add("a.sum", "1m", points(98 * HOUR, MINUTE, *[1.0] * 60))
+        store.close()
+
+        store = MetricStore(resolutions, path=tempdir, clock=self.clock)
+        self.addCleanup(store.close)
+        self.assertEqual(
+            store.query("a.sum", "1m", 98 * HOUR, 98 * HOUR + MINUTE),
+            points(98 * HOUR, MINUTE, 1.0, 1.0))
+        self.assertEqual(
+            store.query("a.sum", "1h", 98 * HOUR, 98 * HOUR),
+            points(98 * HOUR, HOUR, 60.0))
+        self.assertEqual(
+            store.query("b.sum", "1m", 98 * HOUR, 98 * HOUR), None)
+
+    def test_persistence_resolution_changed(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        store = MetricStore([("1m", 120)], path=tempdir, clock=self.clock)
+        store.add("a.sum", "1m", points(98 * HOUR, MINUTE, 1.0))
+        store.close()
+
+        store = MetricStore([("1m", 60)], path=tempdir, clock=self.clock)
+        self.addCleanup(store.close)
+        self.assertEqual(
+            store.query("a.sum", "1m", 98 * HOUR, 98 * HOUR), None)
+
+    def test_invalid_max_open(self):
+        self.assertRaises(
+            ValueError, MetricStore, resolutions=[("1m", 10), ("1h", 2)],
+            path=tempfile.gettempdir(), max_open=1)
+
+    def test_persistence_many_metrics(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        store = MetricStore(
+            [("1m", 60), ("1h", 2)], path=tempdir, max_open=10,
+            clock=self.clock)
+        self.addCleanup(store.close)
+        for i in range(600):
+            store.add("m%d.sum" % i, "1m", points(99 * HOUR, MINUTE, i))
+            self.assertTrue(len(store._rings) <= 10)
+        self.assertEqual(len(store), 600)
+        for i in range(600):
+            self.assertEqual(
+                store.query("m%d.sum" % i, "1m", 99 * HOUR, 99 * HOUR),
+                points(99 * HOUR, MINUTE, float(i)))
+
+
+class TestStoredMetricsClient(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 100 * HOUR + 1800.0
+        self.session = TestSession()
+        self.adapter = FakeSeriesAdapter(self.clock)
+        self.session.mount(
+            "http://example.com/api/v1/go/metrics/", self.adapter)
+        self.store = MetricStore([("1h", 48), ("1d", 10)], clock=self.clock)
+        self.client = MetricsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session, metric_store=self.store, clock=self.clock)
+
+    def test_reads_served_from_store(self):
+        first = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(len(first[u"a.sum"]), 11)
+        second = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(second, first)
+        narrower = self.client.get_metric("a.sum", "-5h", "1h", "omit")
+        self.assertEqual(narrower[u"a.sum"], first[u"a.sum"][5:])
+        self.assertEqual(len(self.adapter.requests), 1)
+
+    def test_partial_bucket_refetched(self):
+        self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.clock.now += HOUR + 1
+        self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_nulls_modes_mixed(self):
+        self.adapter.null_hours.add(95)
+        zeroized = self.client.get_metric("a.sum", "-10h", "1h", "zeroize")
+        self.assertEqual(zeroized[u"a.sum"][5][u"y"], 0.0)
+        omitted = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(
+            [point[u"y"] for point in omitted[u"a.sum"]],
+            [90.0, 91.0, 92.0, 93.0, 94.0, 96.0, 97.0, 98.0, 99.0, 100.0])
+        self.assertEqual(
+            self.client.get_metric("a.sum", "-10h", "1h", "zeroize"),
+            zeroized)
+        kept = self.client.get_metric("a.sum", "-10h", "1h", "keep")
+        self.assertEqual(kept[u"a.sum"][5][u"y"], None)
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_partial_first_bucket_not_stored_as_null(self):
+        self.adapter.round_up = True
+        result = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(result[u"a.sum"][0][u"x"], 91 * HOUR * 1000)
+        self.clock.now += 1000 * HOUR
+        self.assertEqual(
+            self.store.query("a.sum", "1h", 90 * HOUR, 90 * HOUR), None)
+        self.assertEqual(
+            self.store.query("a.sum", "1h", 91 * HOUR, 91 * HOUR),
+            points(91 * HOUR, HOUR, 91.0))
+
+    def test_store_failures_ignored(self):
+        def fail(*args, **kw):
+            raise OSError(24, "Too many open files")
+
+        self.store.add = fail
+        self.store.query = fail
+        first = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(len(first[u"a.sum"]), 11)
+        second = self.client.get_metric("a.sum", "-10h", "1h", "omit")
+        self.assertEqual(second, first)
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_unstored_queries(self):
+        self.client.get_metric("a.*", "-10h", "1h", "omit")
+        self.client.get_metric("a.*", "-10h", "1h", "omit")
+        self.client.get_metric("a.sum", "-10h", "5m", "omit")
+        self.client.get_metric("a.sum", "-10h", "5m", "omit")
+        self.assertEqual(len(self.adapter.requests), 4)
+        self.assertEqual(len(self.store), 0)
@@ -0,0 +1,140 @@
+"""
+Tests for go_http.optoutimport.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+from requests_testadapter import TestSession
+
+from go_http.optoutimport import import_optouts, main, read_addresses
+from go_http.optouts import OptOutsApiClient
+from go_http.tests.test_optouts import FakeOptOutsAdapter
+
+
+class TestOptOutImport(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.adapter = FakeOptOutsAdapter()
+        session = TestSession()
+        session.mount("http://example.com/api/v1/go/", self.adapter)
+        self.client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=session)
+
+    def make_path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def write_csv(self, lines, name="optouts.csv"):
+        path = self.make_path(name)
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def optout_addresses(self):
+        return sorted(address for _, address in self.adapter.optouts)
+
+    def test_read_addresses(self):
+        path = self.write_csv(
+            ["name,msisdn", "Arthur, +1 ", "Lancelot,", "Gawain"])
+        self.assertEqual(
+            list(read_addresses(path, column=1, skip_header=True)),
+            [(1, u"+1"), (2, None), (3, None)])
+
+    def test_import(self):
+        path = self.write_csv(["+1", "+2", "", " +1", "+3"])
+        stats = import_optouts(
+            self.client, u"msisdn", path, concurrency=2, retries=0)
+        self.assertEqual(self.optout_addresses(), [u"+1", u"+2", u"+3"])
+        self.assertEqual(stats, {
+            "rows": 5, "resumed": 0, "blank": 1, "duplicates": 1,
+            "updated": 3, "failed": 0, "retries": 0,
+        })
+
+    def test_import_normalizes_addresses(self):
+        path = self.write_csv(["+27 82 123 4567", "+27821234567", "+1-555"])
+        stats = import_optouts(self.client, u"msisdn", path, retries=0)
+        self.assertEqual(
+            self.optout_addresses(), [u"+1555", u"+27821234567"])
+        self.assertEqual(stats["duplicates"], 1)
+
+    def test_delete(self):
+        for address in [u"+1", u"+2", u"+3"]:
+            self.adapter.optouts[(u"msisdn", address)] = {}
+        path = self.write_csv(["+1", "+3", "+4"])
+        stats = import_optouts(
+            self.client, u"msisdn", path, delete=True, retries=0)
+        self.assertEqual(self.optout_addresses(), [u"+2"])
+        self.assertEqual(stats["updated"], 3)
+
+    def test_failures_and_checkpoint(self):
+        path = self.write_csv(["+%d" % i for i in range(10)])
+        checkpoint = self.make_path("checkpoint.json")
+        failures = self.make_path("failures.csv")
+        self.adapter.failures[u"+4"] = 1
+        stats = import_optouts(
+            self.client, u"msisdn", path, checkpoint_path=checkpoint,
+            failures_path=failures, concurrency=3, retries=0,
+            checkpoint_every=2)
+        self.assertEqual(stats["updated"], 9)
+        self.assertEqual(stats["failed"], 1)
+        with open(checkpoint) as f:
+            self.assertEqual(
+                json.load(f), {"path": path, "action": "set", "row": 10})
+        with open(failures) as f:
+            [line] = f.read().splitlines()
+        self.assertTrue(line.startswith("+4,"))
+
+        # Re-running resumes after the checkpoint and does nothing.
+        self.adapter.requests = []
+        stats = import_optouts(
+            self.client, u"msisdn", path, checkpoint_path=checkpoint)
+        self.assertEqual(stats["resumed"], 10)
+        self.assertEqual(self.adapter.requests, [])
+
+        # The failures file can be imported in its turn.
+        import_optouts(self.client, u"msisdn", failures)
+        self.assertEqual(len(self.optout_addresses()), 10)
+
+    def test_resume(self):
+        path = self.write_csv(["+%d" % i for i in range(6)])
+        checkpoint = self.make_path("checkpoint.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"path": path, "action": "set", "row": 4}, f)
+        stats = import_optouts(
+            self.client, u"msisdn", path, checkpoint_path=checkpoint)
+        self.assertEqual(stats["resumed"], 4)
+        self.assertEqual(self.optout_addresses(), [u"+4", u"+5"])
+
+    def test_checkpoint_for_other_import_ignored(self):
+        path = self.write_csv(["+1", "+2"])
+        checkpoint = self.make_path("checkpoint.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"path": path, "action": "delete", "row": 2}, f)
+        stats = import_optouts(
+            self.client, u"msisdn", path, checkpoint_path=checkpoint)
+        self.assertEqual(stats["resumed"], 0)
+        self.assertEqual(self.optout_addresses(), [u"+1", u"+2"])
+
+    def test_main(self):
+        path = self.write_csv(["msisdn", "+1", "+2"])
+        stdout = tempfile.TemporaryFile(mode="w+")
+        self.addCleanup(stdout.close)
+        old_stdout, sys.stdout = sys.stdout, stdout
+        try:
+            result = main(
+                [path, "--skip-header", "--concurrency", "2"],
+                client=self.client)
+        finally:
+            sys.stdout = old_stdout
+        self.assertEqual(result, 0)
+        self.assertEqual(self.optout_addresses(), [u"+1", u"+2"])
+        stdout.seek(0)
+        self.assertTrue("updated: 2" in stdout.read())
@@ -2,13 +2,21 @@
 """
 
 import json
+import threading
 from unittest import TestCase
 
+try:
+    from urllib import unquote
+except ImportError:  # Python 3
+    from urllib.parse import unquote
+
 from requests import HTTPError
 
-from requests_testadapter import TestAdapter, TestSession
+from requests_testadapter import Resp, TestAdapter, TestSession
 
+from go_http.cache import TTLCache
 from go_http.optouts import OptOutsApiClient
+from go_http.tests.helpers import FakeClock
 
 
 class RecordingAdapter(TestAdapter):
@@ -21,6 +29,59 @@ class RecordingAdapter(TestAdapter):
         return super(RecordingAdapter, self).send(request, *args, **kw)
 
 
+class FakeOptOutsAdapter(TestAdapter):
+    """ A fake opt out API backed by a dict mapping ``(address_type,
+    address)`` pairs to opt out records.
+
+    Addresses in ``failures`` get a 500 response the number of times given
+    for them.
+    """
+
+    def __init__(self, optouts=None, failures=None):
+        super(FakeOptOutsAdapter, self).__init__(b"")
+        self.optouts = optouts if optouts is not None else {}
+        self.failures = failures if failures is not None else {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def make_optout(self, address_type, address):
+        return {
+            u'created_at': u'2015-11-10 20:33:03.742409',
+            u'message': None,
+            u'user_account': u'fxxxeee',
+            u'address_type': address_type,
+            u'address': address,
+        }
+
+    def handle(self, method, path):
+        if path == ["count"]:
+            return 200, {u'opt_out_count': len(self.optouts)}
+        address_type, address = path
+        key = (address_type, address)
+        if self.failures.get(address):
+            self.failures[address] -= 1
+            return 500, {}
+        if method == "PUT":
+            self.optouts[key] = self.make_optout(address_type, address)
+            return 200, {u'opt_out': self.optouts[key]}
+        if key not in self.optouts:
+            return 404, {u'status': {u'code': 404}}
+        if method == "DELETE":
+            return 200, {u'opt_out': self.optouts.pop(key)}
+        return 200, {u'opt_out': self.optouts[key]}
+
+    def send(self, request, *args, **kw):
+        path = unquote(request.path_url.split("?")[0])
+        path = path.split("/optouts/", 1)[1].split("/")
+        with self._lock:
+            self.requests.append(request)
+            status, data = self.handle(request.method, path)
+        resp = Resp(json.dumps(data).encode("utf-8"), status, {})
+        response = self.build_response(request, resp)
+        response.content
+        return response
+
+
 class TestOptOutsApiClient(TestCase):
 
     def setUp(self):
@@ -189,3 +250,225 @@ class TestOptOutsApiClient(TestCase):
         self.check_request(
             adapter.request, 'GET',
             headers={"Authorization": u'Bearer auth-token'})
+
+
+class TestOptOutCache(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.adapter = FakeOptOutsAdapter()
+        self.session = TestSession()
+        self.session.mount("http://example.com/api/v1/go/", self.adapter)
+        self.client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session,
+            optout_cache=TTLCache(ttl=300, clock=self.clock),
+            negative_ttl=60)
+
+    def add_optout(self, address):
+        optout = self.adapter.make_optout(u"msisdn", address)
+        self.adapter.optouts[(u"msisdn", address)] = optout
+        return optout
+
+    def test_caches_optouts(self):
+        optout = self.add_optout(u"+1234")
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), optout)
+        result = self.client.get_optout(u"msisdn", u"+1234")
+        self.assertEqual(result, optout)
+        result[u'message'] = u'mutated'
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), optout)
+        self.assertEqual(len(self.adapter.requests), 1)
+        self.clock.now += 301
+        self.client.get_optout(u"msisdn", u"+1234")
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_caches_not_found(self):
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), None)
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), None)
+        self.assertEqual(len(self.adapter.requests), 1)
+        self.add_optout(u"+1234")
+        self.clock.now += 61
+        self.assertNotEqual(
+            self.client.get_optout(u"msisdn", u"+1234"), None)
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_set_and_delete_update_cache(self):
+        self.client.get_optout(u"msisdn", u"+1234")
+        optout = self.client.set_optout(u"msisdn", u"+1234")
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), optout)
+        self.client.delete_optout(u"msisdn", u"+1234")
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), None)
+        self.assertEqual(
+            [r.method for r in self.adapter.requests],
+            ["GET", "PUT", "DELETE"])
+
+    def test_addresses_normalized(self):
+        optout = self.client.set_optout(u"msisdn", u"+27 82 123 4567")
+        self.assertEqual(
+            list(self.adapter.optouts.keys()), [(u"msisdn", u"+27821234567")])
+        self.assertEqual(
+            self.client.get_optout(u"msisdn", u"+27-82-123-4567"), optout)
+        self.assertEqual(len(self.adapter.requests), 1)
+        self.assertEqual(
+            self.adapter.requests[0].path_url,
+            "/api/v1/go/optouts/msisdn/%2B27821234567")
+
+    def test_byte_string_addresses(self):
+        address = u"\u00e9t".encode("utf-8")
+        self.client.set_optout(u"mxit_id", address)
+        self.assertEqual(
+            self.adapter.requests[0].path_url,
+            "/api/v1/go/optouts/mxit_id/%C3%A9t")
+        self.assertNotEqual(self.client.get_optout(u"mxit_id", address), None)
+        self.client.delete_optout(u"mxit_id", address)
+        self.assertEqual(self.adapter.optouts, {})
+
+    def test_case_sensitive_addresses_kept_apart(self):
+        self.client.set_optout(u"mxit_id", u"Vumi")
+        self.assertEqual(self.client.get_optout(u"mxit_id", u"vumi"), None)
+        self.client.set_optout(u"twitter_handle", u"@Vumi")
+        self.assertNotEqual(
+            self.client.get_optout(u"twitter_handle", u"@vumi"), None)
+
+    def test_errors_not_cached(self):
+        self.adapter.failures[u"+1234"] = 1
+        self.assertRaises(
+            HTTPError, self.client.get_optout, u"msisdn", u"+1234")
+        self.assertEqual(self.client.get_optout(u"msisdn", u"+1234"), None)
+        self.assertEqual(len(self.adapter.requests), 2)
+
+    def test_cache_stats_concurrent(self):
+        addresses = [u"+%d" % i for i in range(100)]
+        for address in addresses[::2]:
+            self.add_optout(address)
+        for _ in range(2):
+            list(self.client.check_optouts(
+                u"msisdn", addresses, concurrency=8))
+        stats = self.client.cache_stats()
+        self.assertEqual(stats["misses"], 100)
+        self.assertEqual(stats["hits"], 50)
+        self.assertEqual(stats["negative_hits"], 50)
+
+    def test_cache_stats(self):
+        self.add_optout(u"+1")
+        for address in [u"+1", u"+1", u"+2", u"+2", u"+2"]:
+            self.client.get_optout(u"msisdn", address)
+        self.assertEqual(self.client.cache_stats(), {
+            "hits": 1,
+            "negative_hits": 2,
+            "misses": 2,
+            "hit_rate": 0.6,
+            "size": 2,
+        })
+
+    def test_no_cache(self):
+        client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session)
+        client.get_optout(u"msisdn", u"+1234")
+        client.get_optout(u"msisdn", u"+1234")
+        self.assertEqual(len(self.adapter.requests), 2)
+        self.assertEqual(client.cache_stats()["hit_rate"], 0.0)
+
+
+class TestCheckOptOuts(TestCase):
+
+    def setUp(self):
+        self.adapter = FakeOptOutsAdapter()
+        self.session = TestSession()
+        self.session.mount("http://example.com/api/v1/go/", self.adapter)
+        self.client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=self.session)
+
+    def add_optout(self, address):
+        optout = self.adapter.make_optout(u"msisdn", address)
+        self.adapter.optouts[(u"msisdn", address)] = optout
+        return optout
+
+    def test_check_optouts(self):
+        optouts = dict(
+            (address, self.add_optout(address))
+            for address in [u"+2", u"+5"])
+        addresses = (u"+%d" % i for i in range(8))
+        check = self.client.check_optouts(
+            u"msisdn", addresses, concurrency=3)
+        results = dict(
+            (address, (optout, error)) for address, optout, error in check)
+        self.assertEqual(sorted(results), [u"+%d" % i for i in range(8)])
+        for address, result in results.items():
+            self.assertEqual(result, (optouts.get(address), None))
+        self.assertEqual(check.stats(), {
+            "checked": 8, "opted_out": 2, "retries": 0, "errors": 0})
+
+    def test_retries(self):
+        self.add_optout(u"+1")
+        self.adapter.failures[u"+1"] = 2
+        check = self.client.check_optouts(
+            u"msisdn", [u"+1"], retries=2, retry_delay=0)
+        [(address, optout, error)] = list(check)
+        self.assertEqual(optout[u"address"], u"+1")
+        self.assertEqual(error, None)
+        self.assertEqual(check.retries, 2)
+        self.assertEqual(len(self.adapter.requests), 3)
+
+    def test_errors(self):
+        self.adapter.failures[u"+1"] = 5
+        check = self.client.check_optouts(
+            u"msisdn", [u"+1", u"+2"], retries=1, retry_delay=0)
+        results = dict(
+            (address, (optout, error)) for address, optout, error in check)
+        optout, error = results[u"+1"]
+        self.assertEqual(optout, None)
+        self.assertTrue(isinstance(error, HTTPError))
+        self.assertEqual(results[u"+2"], (None, None))
+        self.assertEqual(check.stats(), {
+            "checked": 2, "opted_out": 0, "retries": 1, "errors": 1})
+
+    def test_client_errors_not_retried(self):
+        self.session.mount(
+            "http://example.com/api/v1/go/optouts/msisdn/",
+            TestAdapter(b"{}", status=400))
+        check = self.client.check_optouts(
+            u"msisdn", [u"+1"], retries=3, retry_delay=0)
+        [(address, optout, error)] = list(check)
+        self.assertEqual(optout, None)
+        self.assertEqual(error.response.status_code, 400)
+        self.assertEqual(check.retries, 0)
+
+    def test_addresses_consumed_lazily(self):
+        consumed = []
+
+        def addresses():
+            for i in range(100):
+                consumed.append(i)
+                yield u"+%d" % i
+
+        check = self.client.check_optouts(
+            u"msisdn", addresses(), concurrency=4)
+        next(check)
+        self.assertTrue(len(consumed) <= 5)
+
+    def test_set_and_delete_optouts(self):
+        self.adapter.failures[u"+3"] = 1
+        update = self.client.set_optouts(
+            u"msisdn", [u"+1", u"+2", u"+3"], retries=0)
+        results = dict(
+            (address, (optout, error)) for address, optout, error in update)
+        self.assertEqual(results[u"+1"][0][u"address"], u"+1")
+        self.assertEqual(results[u"+3"][0], None)
+        self.assertTrue(isinstance(results[u"+3"][1], HTTPError))
+        self.assertEqual(update.stats(), {
+            "updated": 2, "retries": 0, "errors": 1})
+
+        update = self.client.delete_optouts(
+            u"msisdn", [u"+1", u"+3"], retries=0)
+        self.assertEqual(
+            [(optout, error) for address, optout, error in update
+             if address == u"+3"], [(None, None)])
+        self.assertEqual(update.updated, 2)
+        self.assertEqual(
+            sorted(self.adapter.optouts), [(u"msisdn", u"+2")])
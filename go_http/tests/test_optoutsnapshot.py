@@ -0,0 +1,127 @@
+"""
+Tests for go_http.optoutsnapshot.
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from requests_testadapter import TestSession
+
+from go_http.addresses import AddressNormalizer
+from go_http.optouts import OptOutsApiClient
+from go_http.optoutsnapshot import OptOutSnapshot, write_snapshot
+from go_http.tests.test_optouts import FakeOptOutsAdapter
+
+
+class TestOptOutSnapshot(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, "optouts.snapshot")
+
+    def open_snapshot(self):
+        snapshot = OptOutSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_contains(self):
+        addresses = [u"+27%07d" % i for i in range(0, 1000, 7)]
+        write_snapshot(self.path, u"msisdn", reversed(addresses), 200)
+        snapshot = self.open_snapshot()
+        self.assertEqual(len(snapshot), len(addresses))
+        self.assertEqual(list(snapshot), addresses)
+        for i in range(1000):
+            self.assertEqual(u"+27%07d" % i in snapshot, i % 7 == 0)
+        self.assertTrue(snapshot.contains(b" +270000007 "))
+        self.assertTrue(snapshot.contains(u"+27 000-0014"))
+        self.assertFalse(snapshot.contains(u"+2700000000000"))
+        self.assertEqual(snapshot.address_type, u"msisdn")
+        self.assertEqual(snapshot.optout_count, 200)
+        self.assertEqual(snapshot.missing(), 200 - len(addresses))
+
+    def test_variable_widths(self):
+        addresses = [u"a", u"abc", u"ab", u"\u00e9t\u00e9", u"zz"]
+        write_snapshot(self.path, u"twitter_handle", addresses)
+        snapshot = self.open_snapshot()
+        for address in addresses:
+            self.assertTrue(address in snapshot)
+        for address in [u"", u"b", u"abcd", u"abd", u"z"]:
+            self.assertFalse(address in snapshot)
+        self.assertEqual(snapshot.optout_count, -1)
+
+    def test_normalizer(self):
+        normalizer = AddressNormalizer(default_country_code="27")
+        write_snapshot(
+            self.path, u"msisdn", [u"0821234567"], normalizer=normalizer)
+        snapshot = OptOutSnapshot(self.path, normalizer=normalizer)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(list(snapshot), [u"+27821234567"])
+        self.assertTrue(u"27821234567" in snapshot)
+        self.assertTrue(u"082 123 4567" in snapshot)
+
+    def test_empty(self):
+        write_snapshot(self.path, u"msisdn", [])
+        snapshot = self.open_snapshot()
+        self.assertEqual(len(snapshot), 0)
+        self.assertFalse(u"+1" in snapshot)
+
+    def test_filter(self):
+        write_snapshot(self.path, u"msisdn", [u"+2", u"+4"])
+        snapshot = self.open_snapshot()
+        self.assertEqual(
+            snapshot.filter([u"+5", u"+4", u"+3", u"+2", u"+1"]),
+            [u"+5", u"+3", u"+1"])
+
+    def test_many_addresses(self):
+        addresses = [u"+27%07d" % i for i in range(0, 30000, 3)]
+        write_snapshot(self.path, u"msisdn", addresses)
+        snapshot = self.open_snapshot()
+        self.assertEqual(
+            len(snapshot.filter(u"+27%07d" % i for i in range(30000))),
+            20000)
+
+    def test_write_leaves_no_temporary_files(self):
+        write_snapshot(self.path, u"msisdn", [u"+1"])
+        write_snapshot(self.path, u"msisdn", [u"+2"])
+        self.assertEqual(os.listdir(self.tempdir), ["optouts.snapshot"])
+
+    def test_reload(self):
+        write_snapshot(self.path, u"msisdn", [u"+1"])
+        snapshot = self.open_snapshot()
+        self.assertFalse(snapshot.reload())
+        write_snapshot(self.path, u"msisdn", [u"+2", u"+3"])
+        self.assertTrue(snapshot.reload())
+        self.assertEqual(list(snapshot), [u"+2", u"+3"])
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot" * 10)
+        self.assertRaises(ValueError, OptOutSnapshot, self.path)
+        with open(self.path, "wb") as f:
+            f.write(b"short")
+        self.assertRaises(ValueError, OptOutSnapshot, self.path)
+
+    def test_build(self):
+        adapter = FakeOptOutsAdapter()
+        for address in [u"+2", u"+5", u"+99"]:
+            adapter.optouts[(u"msisdn", address)] = adapter.make_optout(
+                u"msisdn", address)
+        adapter.failures[u"+7"] = 10
+        session = TestSession()
+        session.mount("http://example.com/api/v1/go/", adapter)
+        client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=session)
+        snapshot = OptOutSnapshot.build(
+            client, u"msisdn", (u"+%d" % i for i in range(10)), self.path,
+            concurrency=3, retries=0)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(list(snapshot), [u"+2", u"+5", u"+7"])
+        self.assertEqual(snapshot.optout_count, 3)
+        self.assertEqual(snapshot.missing(), 0)
+        adapter.optouts[(u"msisdn", u"+100")] = {}
+        self.assertEqual(snapshot.missing(client), 1)
@@ -4,10 +4,14 @@ import json
 import logging
 from unittest import TestCase
 
-from requests_testadapter import TestAdapter, TestSession
+from requests_testadapter import Resp, TestAdapter, TestSession
 
-from go_http.send import HttpApiSender, LoggingSender
+from go_http.addresses import AddressNormalizer
+from go_http.cache import TTLCache
+from go_http.optouts import OptOutsApiClient
+from go_http.send import HttpApiSender, LoggingSender, OptOutFilter
 from go_http.exceptions import UserOptedOutException
+from go_http.tests.test_optouts import FakeOptOutsAdapter
 
 from requests.exceptions import HTTPError
 
@@ -82,6 +86,19 @@ class TestHttpApiSender(TestCase):
                 "session_event": "close",
             })
 
+    def test_send_text_normalizes_to_addr(self):
+        self.sender = HttpApiSender(
+            account_key="acc-key", conversation_key="conv-key",
+            api_url="http://example.com/api/v1/go/http_api_nostream",
+            conversation_token="conv-token", session=self.session,
+            address_type="msisdn",
+            normalizer=AddressNormalizer(default_country_code="27"))
+        self.check_successful_send(
+            lambda: self.sender.send_text("082 123 4567", "Hello!"),
+            {
+                "content": "Hello!", "to_addr": "+27821234567",
+            })
+
     def test_send_text_to_opted_out(self):
         """
         UserOptedOutException raised for sending messages to opted out
@@ -215,6 +232,113 @@ class TestHttpApiSender(TestCase):
             headers={"Authorization": u'Basic YWNjLWtleTpjb252LXRva2Vu'})
 
 
+class FakeMessagesAdapter(TestAdapter):
+    """ Accept messages, except those to addresses in ``opted_out`` or
+    ``failing``.
+    """
+
+    def __init__(self, opted_out=(), failing=()):
+        super(FakeMessagesAdapter, self).__init__(b"")
+        self.opted_out = set(opted_out)
+        self.failing = set(failing)
+        self.to_addrs = []
+
+    def send(self, request, *args, **kw):
+        to_addr = json.loads(request.body)["to_addr"]
+        self.to_addrs.append(to_addr)
+        if to_addr in self.failing:
+            status, data = 500, {"success": False, "reason": "Oops"}
+        elif to_addr in self.opted_out:
+            status, data = 400, {
+                "success": False,
+                "reason": "Recipient with msisdn %s has opted out" % to_addr,
+            }
+        else:
+            status, data = 200, {"message_id": "id-%s" % to_addr}
+        resp = Resp(json.dumps(data).encode("utf-8"), status, {})
+        response = self.build_response(request, resp)
+        response.content
+        return response
+
+
+class TestOptOutFilter(TestCase):
+
+    def setUp(self):
+        self.optouts_adapter = FakeOptOutsAdapter()
+        for address in [u"+2", u"+4"]:
+            self.optouts_adapter.optouts[(u"msisdn", address)] = (
+                self.optouts_adapter.make_optout(u"msisdn", address))
+        self.messages_adapter = FakeMessagesAdapter()
+        session = TestSession()
+        session.mount("http://example.com/api/v1/go/", self.optouts_adapter)
+        session.mount(
+            "http://example.com/api/v1/go/http_api_nostream/",
+            self.messages_adapter)
+        self.optouts_client = OptOutsApiClient(
+            auth_token="auth-token",
+            api_url="http://example.com/api/v1/go",
+            session=session, optout_cache=TTLCache(ttl=300))
+        self.sender = HttpApiSender(
+            account_key="acc-key", conversation_key="conv-key",
+            api_url="http://example.com/api/v1/go/http_api_nostream",
+            conversation_token="conv-token", session=session)
+        self.skipped = []
+        self.optout_filter = OptOutFilter(
+            self.optouts_client, concurrency=2, retries=0,
+            on_skipped=lambda address, reason: self.skipped.append(
+                (address, reason)))
+
+    def test_filter(self):
+        eligible = self.optout_filter([u"+1", u"+2", u"+3", u"+4"])
+        self.assertEqual(sorted(eligible), [u"+1", u"+3"])
+        self.assertEqual(
+            sorted(address for address, _ in self.skipped), [u"+2", u"+4"])
+        self.assertEqual(
+            self.optout_filter.stats(),
+            {"eligible": 2, "skipped": 2, "errors": 0})
+
+    def test_check_errors_skipped(self):
+        self.optouts_adapter.failures[u"+1"] = 1
+        self.assertEqual(list(self.optout_filter([u"+1"])), [])
+        [(address, reason)] = self.skipped
+        self.assertEqual(address, u"+1")
+        self.assertTrue(isinstance(reason, HTTPError))
+        self.assertEqual(self.optout_filter.errors, 1)
+
+    def test_send_text_batch(self):
+        self.messages_adapter.opted_out.add(u"+3")
+        results = dict(self.sender.send_text_batch(
+            [u"+1", u"+2", u"+3", u"+4"], u"Hello!", self.optout_filter))
+        self.assertEqual(sorted(results), [u"+1", u"+3"])
+        self.assertEqual(results[u"+1"], {u"message_id": u"id-+1"})
+        self.assertTrue(isinstance(results[u"+3"], UserOptedOutException))
+        self.assertEqual(
+            sorted(self.messages_adapter.to_addrs), [u"+1", u"+3"])
+        self.assertEqual(
+            sorted(address for address, _ in self.skipped),
+            [u"+2", u"+3", u"+4"])
+        self.assertEqual(self.optout_filter.skipped, 3)
+
+    def test_send_text_batch_errors_recorded(self):
+        self.messages_adapter.failing.add(u"+2")
+        results = self.sender.send_text_batch(
+            [u"+1", u"+2", u"+3"], u"Hello!")
+        self.assertEqual(
+            [address for address, _ in results], [u"+1", u"+2", u"+3"])
+        self.assertTrue(isinstance(results[1][1], HTTPError))
+        self.assertEqual(results[2][1], {u"message_id": u"id-+3"})
+
+    def test_send_text_batch_without_filter(self):
+        results = self.sender.send_text_batch([u"+1", u"+2"], u"Hello!")
+        self.assertEqual([address for address, _ in results], [u"+1", u"+2"])
+        self.assertEqual(self.messages_adapter.to_addrs, [u"+1", u"+2"])
+
+    def test_cached_checks(self):
+        list(self.optout_filter([u"+1", u"+2"]))
+        list(self.optout_filter([u"+1", u"+2"]))
+        self.assertEqual(len(self.optouts_adapter.requests), 2)
+
+
 class RecordingHandler(logging.Handler):
     """ Record logs. """
     logs = None
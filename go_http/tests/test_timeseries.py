@@ -0,0 +1,160 @@
+"""
+Tests for go_http.timeseries.
+"""
+
+import json
+import math
+from unittest import TestCase, skipIf
+
+from requests_testadapter import TestAdapter, TestSession
+
+from go_http.metrics import MetricsApiClient
+from go_http.timeseries import TimeSeries, align, np, series_from_response
+
+
+HOUR = 3600 * 1000
+
+
+def points(*values, **kw):
+    start = kw.get("start", 0)
+    step = kw.get("step", HOUR)
+    return [
+        {u"x": start + i * step, u"y": value}
+        for i, value in enumerate(values)]
+
+
+def nan_list(values):
+    return [None if math.isnan(v) else v for v in values]
+
+
+@skipIf(np is None, "NumPy is not installed")
+class TestTimeSeries(TestCase):
+
+    def test_from_datapoints(self):
+        series = TimeSeries.from_datapoints(
+            points(1.0, None, 3.0), name="a.sum")
+        self.assertEqual(series.name, "a.sum")
+        self.assertEqual(len(series), 3)
+        self.assertEqual(list(series.timestamps), [0, HOUR, 2 * HOUR])
+        self.assertEqual(nan_list(series.values), [1.0, None, 3.0])
+        self.assertEqual(repr(series), "<TimeSeries name='a.sum' points=3>")
+
+    def test_from_datapoints_empty(self):
+        series = TimeSeries.from_datapoints([])
+        self.assertEqual(len(series), 0)
+
+    def test_nulls(self):
+        data = points(1.0, None, 3.0)
+        omitted = TimeSeries.from_datapoints(data, nulls="omit")
+        self.assertEqual(list(omitted.timestamps), [0, 2 * HOUR])
+        self.assertEqual(list(omitted.values), [1.0, 3.0])
+        zeroized = TimeSeries.from_datapoints(data, nulls="zeroize")
+        self.assertEqual(list(zeroized.values), [1.0, 0.0, 3.0])
+        self.assertRaises(
+            ValueError, TimeSeries.from_datapoints, data, nulls="drop")
+
+    def test_mismatched_lengths(self):
+        self.assertRaises(ValueError, TimeSeries, [1, 2], [1.0])
+
+    def test_resample(self):
+        series = TimeSeries.from_datapoints(
+            points(1.0, 2.0, None, 4.0, None, None, step=HOUR / 2))
+        resampled = series.resample("1h")
+        self.assertEqual(list(resampled.timestamps), [0, HOUR, 2 * HOUR])
+        self.assertEqual(nan_list(resampled.values), [3.0, 4.0, None])
+        self.assertEqual(
+            nan_list(series.resample("1h", how="avg").values),
+            [1.5, 4.0, None])
+        self.assertEqual(
+            nan_list(series.resample("1h", how="max").values),
+            [2.0, 4.0, None])
+        self.assertEqual(
+            nan_list(series.resample("1h", how="min").values),
+            [1.0, 4.0, None])
+        self.assertEqual(
+            nan_list(series.resample("1h", how="last").values),
+            [2.0, 4.0, None])
+        self.assertRaises(ValueError, series.resample, "1h", how="median")
+
+    def test_resample_aligns_to_epoch(self):
+        series = TimeSeries.from_datapoints(points(
+            1.0, 1.0, 1.0, start=HOUR / 2, step=HOUR / 2))
+        resampled = series.resample("1h")
+        self.assertEqual(list(resampled.timestamps), [0, HOUR])
+        self.assertEqual(list(resampled.values), [1.0, 2.0])
+
+    def test_rolling(self):
+        series = TimeSeries.from_datapoints(points(1.0, 2.0, None, 4.0, 6.0))
+        self.assertEqual(
+            nan_list(series.rolling(2, how="sum").values),
+            [None, 3.0, 2.0, 4.0, 10.0])
+        self.assertEqual(
+            nan_list(series.rolling(2).values),
+            [None, 1.5, 2.0, 4.0, 5.0])
+        self.assertEqual(
+            nan_list(series.rolling(3, how="max").values),
+            [None, None, 2.0, 4.0, 6.0])
+        self.assertEqual(
+            nan_list(series.rolling(3, how="min").values),
+            [None, None, 1.0, 2.0, 4.0])
+        self.assertEqual(
+            nan_list(series.rolling(6).values), [None] * 5)
+        self.assertRaises(ValueError, series.rolling, 0)
+
+    def test_rolling_all_nulls(self):
+        series = TimeSeries.from_datapoints(points(None, None, 1.0))
+        self.assertEqual(
+            nan_list(series.rolling(2, how="sum").values),
+            [None, None, 1.0])
+        self.assertEqual(
+            nan_list(series.rolling(2, how="max").values),
+            [None, None, 1.0])
+
+    def test_rate(self):
+        series = TimeSeries.from_datapoints(
+            points(0.0, 3600.0, 10800.0))
+        rate = series.rate()
+        self.assertEqual(list(rate.timestamps), [HOUR, 2 * HOUR])
+        self.assertEqual(list(rate.values), [1.0, 2.0])
+
+    def test_total(self):
+        series = TimeSeries.from_datapoints(points(1.0, None, 3.0))
+        self.assertEqual(series.total(), 4.0)
+
+    def test_align(self):
+        a = TimeSeries.from_datapoints(points(1.0, 2.0, 3.0))
+        b = TimeSeries.from_datapoints(points(5.0, 6.0, start=HOUR * 2))
+        timestamps, values = align([a, b])
+        self.assertEqual(list(timestamps), [0, HOUR, 2 * HOUR, 3 * HOUR])
+        self.assertEqual(nan_list(values[0]), [1.0, 2.0, 3.0, None])
+        self.assertEqual(nan_list(values[1]), [None, None, 5.0, 6.0])
+
+        timestamps, values = align([a, b], how="inner")
+        self.assertEqual(list(timestamps), [2 * HOUR])
+        self.assertEqual(values.tolist(), [[3.0], [5.0]])
+        self.assertRaises(ValueError, align, [a, b], how="left")
+
+    def test_align_empty(self):
+        timestamps, values = align([])
+        self.assertEqual(len(timestamps), 0)
+
+    def test_series_from_response(self):
+        series = series_from_response({
+            u"a.sum": points(1.0, None),
+            u"b.avg": points(2.0),
+        }, nulls="zeroize")
+        self.assertEqual(sorted(series), [u"a.sum", u"b.avg"])
+        self.assertEqual(series[u"a.sum"].name, u"a.sum")
+        self.assertEqual(list(series[u"a.sum"].values), [1.0, 0.0])
+
+    def test_get_metric_series(self):
+        session = TestSession()
+        response = {u"a.sum": points(1.0, 2.0)}
+        session.mount(
+            "http://example.com/api/v1/go/metrics/",
+            TestAdapter(json.dumps(response).encode("utf-8")))
+        client = MetricsApiClient(
+            auth_token="auth-token", api_url="http://example.com/api/v1/go",
+            session=session)
+        series = client.get_metric_series("a.sum", "-2h", "1h", "omit")
+        self.assertEqual(list(series[u"a.sum"].values), [1.0, 2.0])
@@ -0,0 +1,274 @@
+"""
+NumPy arrays for metric time series.
+
+Datapoints returned by :meth:`go_http.metrics.MetricsApiClient.get_metric`
+are decoded into arrays of timestamps and values so that resampling, rolling
+windows and rates are computed without looping over datapoints in Python.
+
+This module requires NumPy, which can be installed with the ``numpy`` extra
+(``pip install go_http[numpy]``).
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from go_http.metrics import parse_interval
+
+
+NULLS = ("omit", "zeroize", "keep")
+
+SERIES_AGGREGATORS = ("sum", "avg", "max", "min", "last")
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("go_http.timeseries requires NumPy.")
+
+
+def _check_nulls(nulls):
+    if nulls not in NULLS:
+        raise ValueError("Invalid nulls %r. Expected one of %s." % (
+            nulls, ", ".join(NULLS)))
+
+
+def _check_how(how, allowed=SERIES_AGGREGATORS):
+    if how not in allowed:
+        raise ValueError("Invalid aggregator %r. Expected one of %s." % (
+            how, ", ".join(allowed)))
+
+
+def _group_aggregate(groups, values, n, how):
+    """
+    Aggregate ``values`` into ``n`` groups, ignoring NaNs. Groups with no
+    values are NaN.
+    """
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    counts = np.bincount(groups, minlength=n)
+    if how in ("sum", "avg"):
+        result = np.bincount(groups, weights=values, minlength=n)
+        if how == "avg":
+            result = result / np.maximum(counts, 1)
+    elif how == "max":
+        result = np.full(n, -np.inf)
+        np.maximum.at(result, groups, values)
+    elif how == "min":
+        result = np.full(n, np.inf)
+        np.minimum.at(result, groups, values)
+    else:
+        positions = np.full(n, -1, dtype=np.int64)
+        np.maximum.at(positions, groups, np.arange(len(values)))
+        result = np.full(n, np.nan)
+        result[counts > 0] = values[positions[counts > 0]]
+    result = np.asarray(result, dtype=np.float64)
+    result[counts == 0] = np.nan
+    return result
+
+
+class TimeSeries(object):
+    """
+    A metric time series backed by NumPy arrays.
+
+    :param timestamps:
+        Timestamps in milliseconds since the epoch, in ascending order.
+    :param values:
+        Values for each timestamp. Nulls are represented as NaN.
+    :param str name:
+        The name of the metric. Optional.
+
+    Attributes:
+        timestamps - A ``numpy.int64`` array of timestamps in milliseconds.
+        values - A ``numpy.float64`` array of values.
+        name - The name of the metric or ``None``.
+    """
+
+    def __init__(self, timestamps, values, name=None):
+        _require_numpy()
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.timestamps.shape != self.values.shape:
+            raise ValueError("Timestamps and values must be the same length.")
+        self.name = name
+
+    @classmethod
+    def from_datapoints(cls, datapoints, name=None, nulls="keep"):
+        """
+        Decode a list of ``{"x": timestamp, "y": value}`` datapoints.
+
+        :param list datapoints:
+            Datapoints as returned by the metrics API.
+        :param str name:
+            The name of the metric. Optional.
+        :param str nulls:
+            How to handle null values. One of ``omit``, ``zeroize`` or
+            ``keep`` (represent them as NaN). Defaults to ``keep``.
+        """
+        _require_numpy()
+        _check_nulls(nulls)
+        count = len(datapoints)
+        timestamps = np.fromiter(
+            (point[u"x"] for point in datapoints), np.int64, count)
+        values = np.fromiter(
+            (np.nan if point[u"y"] is None else point[u"y"]
+             for point in datapoints), np.float64, count)
+        return cls(timestamps, values, name=name).fill_nulls(nulls)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return "<TimeSeries name=%r points=%d>" % (self.name, len(self))
+
+    def _with_values(self, timestamps, values):
+        return type(self)(timestamps, values, name=self.name)
+
+    def fill_nulls(self, nulls):
+        """
+        Return a series with nulls handled as the metrics API would.
+
+        :param str nulls:
+            One of ``omit`` (drop null points), ``zeroize`` (replace nulls
+            with zero) or ``keep`` (leave nulls as NaN).
+        """
+        _check_nulls(nulls)
+        missing = np.isnan(self.values)
+        if nulls == "omit":
+            return self._with_values(
+                self.timestamps[~missing], self.values[~missing])
+        if nulls == "zeroize":
+            return self._with_values(
+                self.timestamps, np.where(missing, 0.0, self.values))
+        return self
+
+    def resample(self, interval, how="sum"):
+        """
+        Aggregate the series into buckets of a fixed size.
+
+        Buckets are aligned to the epoch, so a ``1h`` bucket starts on the
+        hour. Nulls are ignored and buckets containing only nulls are NaN.
+
+        :param str interval:
+            The bucket size, e.g. ``5m`` or ``1d``.
+        :param str how:
+            One of ``sum``, ``avg``, ``max``, ``min`` or ``last``. Defaults
+            to ``sum``.
+        """
+        _check_how(how)
+        step = int(parse_interval(interval) * 1000)
+        if step <= 0:
+            raise ValueError("Invalid interval %r." % (interval,))
+        buckets = self.timestamps - self.timestamps % step
+        starts, groups = np.unique(buckets, return_inverse=True)
+        return self._with_values(
+            starts, _group_aggregate(groups, self.values, len(starts), how))
+
+    def rolling(self, window, how="avg"):
+        """
+        Aggregate a rolling window of points ending at each point.
+
+        Nulls are ignored. Points before the first full window and windows
+        containing only nulls are NaN.
+
+        :param int window:
+            The number of points in each window.
+        :param str how:
+            One of ``sum``, ``avg``, ``max`` or ``min``. Defaults to ``avg``.
+        """
+        _check_how(how, ("sum", "avg", "max", "min"))
+        if window < 1:
+            raise ValueError("Window must be at least 1.")
+        n = len(self)
+        result = np.full(n, np.nan)
+        if n < window:
+            return self._with_values(self.timestamps, result)
+        missing = np.isnan(self.values)
+        if how in ("sum", "avg"):
+            totals = np.concatenate(
+                ([0.0], np.cumsum(np.where(missing, 0.0, self.values))))
+            counts = np.concatenate(([0], np.cumsum(~missing)))
+            sums = totals[window:] - totals[:-window]
+            present = counts[window:] - counts[:-window]
+            if how == "avg":
+                sums = sums / np.maximum(present, 1)
+            sums[present == 0] = np.nan
+            result[window - 1:] = sums
+        else:
+            # A read-only view of each window; fmax/fmin ignore NaNs.
+            values = np.ascontiguousarray(self.values)
+            stride = values.strides[0]
+            windows = np.lib.stride_tricks.as_strided(
+                values, shape=(n - window + 1, window),
+                strides=(stride, stride), writeable=False)
+            reduce = np.fmax if how == "max" else np.fmin
+            result[window - 1:] = reduce.reduce(windows, axis=1)
+        return self._with_values(self.timestamps, result)
+
+    def rate(self):
+        """
+        Return the per-second rate of change between consecutive points.
+
+        The result has one point fewer than the series, with each rate at
+        the timestamp of the later point.
+        """
+        seconds = np.diff(self.timestamps) / 1000.0
+        return self._with_values(
+            self.timestamps[1:], np.diff(self.values) / seconds)
+
+    def total(self):
+        """
+        Return the sum of the values, ignoring nulls.
+        """
+        return float(np.nansum(self.values))
+
+
+def align(series, how="outer"):
+    """
+    Align several series on a common set of timestamps.
+
+    :param list series:
+        The :class:`TimeSeries` to align.
+    :param str how:
+        ``outer`` to use every timestamp from any series (missing values are
+        NaN) or ``inner`` to use only timestamps present in every series.
+        Defaults to ``outer``.
+
+    :returns:
+        A tuple ``(timestamps, values)`` where ``values`` is a 2D array with
+        one row per series.
+    """
+    _require_numpy()
+    if how not in ("outer", "inner"):
+        raise ValueError("Invalid alignment %r." % (how,))
+    if not series:
+        return np.array([], dtype=np.int64), np.empty((0, 0))
+    combine = np.union1d if how == "outer" else np.intersect1d
+    timestamps = series[0].timestamps
+    for other in series[1:]:
+        timestamps = combine(timestamps, other.timestamps)
+    timestamps = np.unique(timestamps)
+    values = np.full((len(series), len(timestamps)), np.nan)
+    for row, item in zip(values, series):
+        positions = np.searchsorted(timestamps, item.timestamps)
+        found = positions < len(timestamps)
+        found[found] = timestamps[positions[found]] == item.timestamps[found]
+        row[positions[found]] = item.values[found]
+    return timestamps, values
+
+
+def series_from_response(response, nulls="keep"):
+    """
+    Decode a :meth:`go_http.metrics.MetricsApiClient.get_metric` response.
+
+    :param dict response:
+        A mapping from metric names to lists of datapoints.
+    :param str nulls:
+        How to handle null values. See :meth:`TimeSeries.from_datapoints`.
+
+    :returns:
+        A dict mapping metric names to :class:`TimeSeries`.
+    """
+    return dict(
+        (name, TimeSeries.from_datapoints(datapoints, name=name, nulls=nulls))
+        for name, datapoints in response.items())
@@ -13,7 +13,17 @@ setup(
     include_package_data=True,
     install_requires=[
         'requests>=2',
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'go-metrics-proxy = go_http.metrics_proxy:main',
+            'go-optouts-import = go_http.optoutimport:main',
+        ],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
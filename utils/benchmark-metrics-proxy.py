@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of the metrics proxy against a local stand-in for
+the metrics API.
+
+Usage: utils/benchmark-metrics-proxy.py [--datagrams N] [--lines N] [--burst N]
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from go_http.metrics import MetricsApiClient, MetricsFlusher
+from go_http.metrics_proxy import MetricsProxy
+
+
+class FakeMetricsHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        json.loads(self.rfile.read(length).decode("utf-8"))
+        FakeMetricsHandler.requests += 1
+        body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--datagrams", type=int, default=100000)
+    parser.add_argument("--lines", type=int, default=5,
+                        help="Metric lines per datagram.")
+    parser.add_argument("--metrics", type=int, default=50,
+                        help="Number of distinct metric names.")
+    parser.add_argument("--burst", type=int, default=100,
+                        help="Datagrams sent before waiting for the proxy.")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = HTTPServer(("127.0.0.1", 0), FakeMetricsHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    client = MetricsApiClient(
+        "token", api_url="http://127.0.0.1:%d/api/v1/go" % (
+            server.server_address[1],))
+    proxy = MetricsProxy(MetricsFlusher(
+        client, interval=args.interval, max_size=10 ** 6))
+    address = proxy.bind_udp("127.0.0.1", 0)
+    proxy_thread = threading.Thread(target=proxy.serve)
+    proxy_thread.start()
+
+    datagrams = [
+        "\n".join(
+            "bench.m%d:%d|c" % ((i * args.lines + j) % args.metrics, j)
+            for j in range(args.lines)).encode("ascii")
+        for i in range(min(args.datagrams, 1000))]
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.time()
+    sent = 0
+    while sent < args.datagrams:
+        # Send in bursts that fit in the socket buffer and let the proxy
+        # catch up, so that the proxy's throughput is measured rather than
+        # the kernel dropping datagrams.
+        for _ in range(min(args.burst, args.datagrams - sent)):
+            sender.sendto(datagrams[sent % len(datagrams)], address)
+            sent += 1
+        deadline = time.time() + 1
+        while proxy.received < sent and time.time() < deadline:
+            time.sleep(0.0005)
+    elapsed = time.time() - start
+    proxy.stop()
+    proxy_thread.join()
+    server.shutdown()
+
+    stats = proxy.stats()
+    print("received %d of %d datagrams (%d lines) in %.2fs" % (
+        stats["received"], args.datagrams, stats["metrics"], elapsed))
+    print("throughput: %.0f datagrams/s, %.0f lines/s" % (
+        stats["received"] / elapsed, stats["metrics"] / elapsed))
+    print("flushes: %d, flush errors: %d, dropped: %d, invalid: %d" % (
+        stats["flushes"], stats["flush_errors"], stats["dropped"],
+        stats["invalid"]))
+    print("flush latency: last %.4fs, max %.4fs" % (
+        stats["last_flush_latency"] or 0, stats["max_flush_latency"]))
+    print("API requests: %d" % (FakeMetricsHandler.requests,))
+
+
+if __name__ == "__main__":
+    main()